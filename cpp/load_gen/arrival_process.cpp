@@ -0,0 +1,161 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include <cmath>
+#include <sstream>
+#include <stdexcept>
+#include "arrival_process.h"
+
+std::shared_ptr<ArrivalProcess> ArrivalProcess::Poisson() {
+    return std::make_shared<PoissonArrival>();
+}
+
+std::shared_ptr<ArrivalProcess> ArrivalProcess::Constant() {
+    return std::make_shared<ConstantArrival>();
+}
+
+std::shared_ptr<ArrivalProcess> ArrivalProcess::Pareto(double shape) {
+    return std::make_shared<ParetoArrival>(shape);
+}
+
+std::shared_ptr<ArrivalProcess> ArrivalProcess::OnOff(double on_ms, double off_ms) {
+    return std::make_shared<OnOffArrival>(on_ms, off_ms);
+}
+
+std::shared_ptr<ArrivalProcess> ArrivalProcess::MMPP(std::vector<double> rate_factors, std::vector<double> mean_dwell_ms) {
+    return std::make_shared<MMPPArrival>(rate_factors, mean_dwell_ms);
+}
+
+double PoissonArrival::NextInterval(std::mt19937& rng, double qps) {
+    return std::exponential_distribution<double>(qps)(rng);
+}
+
+std::string PoissonArrival::Name() const {
+    return "poisson";
+}
+
+double ConstantArrival::NextInterval(std::mt19937&, double qps) {
+    return 1.0 / qps;
+}
+
+std::string ConstantArrival::Name() const {
+    return "constant";
+}
+
+ParetoArrival::ParetoArrival(double shape)
+  : shape_(shape) {
+    if (shape <= 1) {
+        throw std::invalid_argument("ParetoArrival: shape must be greater than 1");
+    }
+}
+
+double ParetoArrival::NextInterval(std::mt19937& rng, double qps) {
+    // the mean of Pareto(scale, shape) is scale * shape / (shape - 1).
+    double scale = (shape_ - 1) / (shape_ * qps);
+    double u = 1.0 - std::uniform_real_distribution<double>(0.0, 1.0)(rng);  // (0, 1]
+    return scale / std::pow(u, 1.0 / shape_);
+}
+
+std::string ParetoArrival::Name() const {
+    std::ostringstream name;
+    name << "pareto(shape=" << shape_ << ")";
+    return name.str();
+}
+
+OnOffArrival::OnOffArrival(double on_ms, double off_ms)
+  : on_s_(on_ms / 1e3)
+  , off_s_(off_ms / 1e3)
+  , phase_s_(0) {
+    if (on_ms <= 0 || off_ms < 0) {
+        throw std::invalid_argument("OnOffArrival: on_ms must be positive and off_ms must not be negative");
+    }
+}
+
+double OnOffArrival::NextInterval(std::mt19937& rng, double qps) {
+    std::exponential_distribution<double> exp(qps * (on_s_ + off_s_) / on_s_);
+    double interval = 0;
+    while (true) {
+        double dt = exp(rng);
+        if (phase_s_ + dt <= on_s_) {
+            phase_s_ += dt;
+            return interval + dt;
+        }
+        // no arrival in the rest of this burst, skip the off period. the
+        // exponential distribution is memoryless so just sample again.
+        interval += on_s_ - phase_s_ + off_s_;
+        phase_s_ = 0;
+    }
+}
+
+void OnOffArrival::Reset() {
+    phase_s_ = 0;
+}
+
+std::string OnOffArrival::Name() const {
+    std::ostringstream name;
+    name << "on_off(on_ms=" << on_s_ * 1e3 << ", off_ms=" << off_s_ * 1e3 << ")";
+    return name.str();
+}
+
+MMPPArrival::MMPPArrival(std::vector<double> rate_factors, std::vector<double> mean_dwell_ms)
+  : rate_factors_(std::move(rate_factors))
+  , state_(0)
+  , dwell_left_s_(-1) {
+    if (rate_factors_.empty() || rate_factors_.size() != mean_dwell_ms.size()) {
+        throw std::invalid_argument("MMPPArrival: rate_factors and mean_dwell_ms must have the same non-zero length");
+    }
+
+    double total_dwell_ms = 0, weighted_factors = 0;
+    for (size_t i = 0; i < rate_factors_.size(); i++) {
+        if (rate_factors_[i] <= 0 || mean_dwell_ms[i] <= 0) {
+            throw std::invalid_argument("MMPPArrival: rate_factors and mean_dwell_ms must be positive");
+        }
+        total_dwell_ms += mean_dwell_ms[i];
+        weighted_factors += rate_factors_[i] * mean_dwell_ms[i];
+        mean_dwell_s_.push_back(mean_dwell_ms[i] / 1e3);
+    }
+
+    // normalize the factors so that the time-averaged rate is exactly qps.
+    for (auto& f : rate_factors_) {
+        f *= total_dwell_ms / weighted_factors;
+    }
+}
+
+double MMPPArrival::NextInterval(std::mt19937& rng, double qps) {
+    if (dwell_left_s_ < 0) {
+        dwell_left_s_ = std::exponential_distribution<double>(1.0 / mean_dwell_s_[state_])(rng);
+    }
+
+    double interval = 0;
+    while (true) {
+        double dt = std::exponential_distribution<double>(qps * rate_factors_[state_])(rng);
+        if (dt <= dwell_left_s_) {
+            dwell_left_s_ -= dt;
+            return interval + dt;
+        }
+        // switch to the next state before the next arrival happens.
+        interval += dwell_left_s_;
+        state_ = (state_ + 1) % rate_factors_.size();
+        dwell_left_s_ = std::exponential_distribution<double>(1.0 / mean_dwell_s_[state_])(rng);
+    }
+}
+
+void MMPPArrival::Reset() {
+    state_ = 0;
+    dwell_left_s_ = -1;
+}
+
+std::string MMPPArrival::Name() const {
+    auto join = [](std::ostringstream& name, const std::vector<double>& values, double scale) {
+        for (size_t i = 0; i < values.size(); i++) {
+            name << (i == 0 ? "" : ", ") << values[i] * scale;
+        }
+    };
+    std::ostringstream name;
+    name << "mmpp(rate_factors=[";
+    join(name, rate_factors_, 1);
+    name << "], mean_dwell_ms=[";
+    join(name, mean_dwell_s_, 1e3);
+    name << "])";
+    return name.str();
+}
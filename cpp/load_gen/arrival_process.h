@@ -0,0 +1,86 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <memory>
+#include <random>
+#include <string>
+#include <vector>
+
+// Inter-arrival time distribution of ServerLoadGen. All processes are scaled
+// so that their long-run average rate equals the target qps, they differ in
+// how bursty the arrivals are.
+class ArrivalProcess {
+  public:
+    virtual ~ArrivalProcess() = default;
+    // seconds from the previous arrival to the next one.
+    virtual double NextInterval(std::mt19937& rng, double qps) = 0;
+    // forget the state of the previous run.
+    virtual void Reset() {}
+    virtual std::string Name() const = 0;
+
+    static std::shared_ptr<ArrivalProcess> Poisson();
+    static std::shared_ptr<ArrivalProcess> Constant();
+    static std::shared_ptr<ArrivalProcess> Pareto(double shape = 1.5);
+    static std::shared_ptr<ArrivalProcess> OnOff(double on_ms, double off_ms);
+    static std::shared_ptr<ArrivalProcess> MMPP(std::vector<double> rate_factors, std::vector<double> mean_dwell_ms);
+};
+
+// exponential inter-arrival times.
+class PoissonArrival:public ArrivalProcess {
+  public:
+    double NextInterval(std::mt19937& rng, double qps) override;
+    std::string Name() const override;
+};
+
+// deterministic inter-arrival times of 1/qps.
+class ConstantArrival:public ArrivalProcess {
+  public:
+    double NextInterval(std::mt19937& rng, double qps) override;
+    std::string Name() const override;
+};
+
+// heavy-tailed Pareto inter-arrival times, shape must be greater than 1 to
+// have a finite mean, the smaller the shape the heavier the tail.
+class ParetoArrival:public ArrivalProcess {
+  public:
+    ParetoArrival(double shape);
+    double NextInterval(std::mt19937& rng, double qps) override;
+    std::string Name() const override;
+
+  private:
+    double shape_;
+};
+
+// Poisson bursts of on_ms followed by off_ms of silence, the rate during
+// bursts is qps * (on_ms + off_ms) / on_ms.
+class OnOffArrival:public ArrivalProcess {
+  public:
+    OnOffArrival(double on_ms, double off_ms);
+    double NextInterval(std::mt19937& rng, double qps) override;
+    void Reset() override;
+    std::string Name() const override;
+
+  private:
+    double on_s_;
+    double off_s_;
+    double phase_s_;  // time elapsed in the current on period
+};
+
+// Markov-modulated Poisson process. The process cycles through states, stays
+// in state i for an exponential time with mean mean_dwell_ms[i], and arrivals
+// of state i are Poisson with a rate proportional to rate_factors[i].
+class MMPPArrival:public ArrivalProcess {
+  public:
+    MMPPArrival(std::vector<double> rate_factors, std::vector<double> mean_dwell_ms);
+    double NextInterval(std::mt19937& rng, double qps) override;
+    void Reset() override;
+    std::string Name() const override;
+
+  private:
+    std::vector<double> rate_factors_;
+    std::vector<double> mean_dwell_s_;
+    size_t state_;
+    double dwell_left_s_;  // negative if not sampled yet
+};
@@ -0,0 +1,61 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include <stdexcept>
+#include "closed_loop_load_gen.h"
+
+ClosedLoopLoadGen::ClosedLoopLoadGen(PerfResult& result, int64_t concurrency, int64_t min_query_count, int64_t min_duration_ms)
+  : LoadGen(result, min_query_count, min_duration_ms)
+  , concurrency_(concurrency)
+  , outstanding_(std::make_shared<Outstanding>()) {
+    if (concurrency <= 0) {
+        throw std::invalid_argument("ClosedLoopLoadGen: concurrency must be positive");
+    }
+}
+
+ClosedLoopLoadGen::ClosedLoopLoadGen(std::shared_ptr<PerfResult> result, int64_t concurrency, int64_t min_query_count, int64_t min_duration_ms)
+  : ClosedLoopLoadGen(*result, concurrency, min_query_count, min_duration_ms) {
+}
+
+std::list<std::shared_ptr<Query>> ClosedLoopLoadGen::IssueQuery() {
+    std::list<std::shared_ptr<Query>> res;
+    std::shared_ptr<Outstanding> outstanding = outstanding_;
+
+    // wait until at least one query is completed, then take all free slots.
+    int64_t num_free;
+    {
+        std::unique_lock<std::mutex> guard(outstanding->lock);
+        outstanding->completed.wait(guard, [&]() { return outstanding->count < concurrency_; });
+        num_free = concurrency_ - outstanding->count;
+        outstanding->count = concurrency_;
+    }
+
+    auto now = std::chrono::steady_clock::now();
+    if (CountIssued() != 0 && IsFinished(now)) {
+        std::lock_guard<std::mutex> guard(outstanding->lock);
+        outstanding->count -= num_free;
+        res.push_back(LoadGen::IssueQuery());
+        return res;
+    }
+
+    for (int64_t i = 0; i < num_free; i++) {
+        std::shared_ptr<Query> q = std::make_shared<Query>();
+        q->issued_at = now;
+        q->on_completed = [outstanding]() {
+            std::lock_guard<std::mutex> guard(outstanding->lock);
+            outstanding->count -= 1;
+            outstanding->completed.notify_one();
+        };
+        res.push_back(AddQuery(q));
+    }
+    return res;
+}
+
+int64_t ClosedLoopLoadGen::GetConcurrency() {
+    return concurrency_;
+}
+
+int64_t ClosedLoopLoadGen::CountOutstanding() {
+    std::lock_guard<std::mutex> guard(outstanding_->lock);
+    return outstanding_->count;
+}
@@ -0,0 +1,40 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <list>
+#include <mutex>
+#include <condition_variable>
+#include "load_gen.h"
+
+// Closed-loop scenario: exactly `concurrency` queries are outstanding at any
+// time, a new query is issued as soon as one of them is completed.
+class ClosedLoopLoadGen:public LoadGen {
+  public:
+    ClosedLoopLoadGen(
+      std::shared_ptr<PerfResult> result,
+      int64_t concurrency = 1,
+      int64_t min_query_count = 100,
+      int64_t min_duration_ms = 10000);
+    ClosedLoopLoadGen(
+      PerfResult& result,
+      int64_t concurrency = 1,
+      int64_t min_query_count = 100,
+      int64_t min_duration_ms = 10000);
+    virtual ~ClosedLoopLoadGen() = default;
+    std::list<std::shared_ptr<Query>> IssueQuery();
+    int64_t GetConcurrency();
+    int64_t CountOutstanding();
+
+  private:
+    struct Outstanding {
+        std::mutex lock;
+        std::condition_variable completed;
+        int64_t count = 0;
+    };
+
+    int64_t concurrency_;
+    // shared with the completion callbacks of issued queries, which may outlive the load gen.
+    std::shared_ptr<Outstanding> outstanding_;
+};
@@ -0,0 +1,210 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include <cmath>
+#include <limits>
+#include <stdexcept>
+#include <algorithm>
+#include "latency_histogram.h"
+
+namespace {
+int32_t Log2Ceiling(int64_t value) {
+    int32_t n = 0;
+    while ((int64_t(1) << n) < value) {
+        n++;
+    }
+    return n;
+}
+
+int32_t CountLeadingZeros(int64_t value) {
+    uint64_t v = static_cast<uint64_t>(value);
+    int32_t n = 0;
+    for (uint64_t mask = uint64_t(1) << 63; mask != 0 && (v & mask) == 0; mask >>= 1) {
+        n++;
+    }
+    return n;
+}
+}  // namespace
+
+LatencyHistogram::LatencyHistogram(int significant_digits, int64_t max_latency_ns)
+  : significant_digits_(significant_digits)
+  , max_latency_ns_(max_latency_ns) {
+    if (significant_digits < 1 || significant_digits > 5) {
+        throw std::invalid_argument("LatencyHistogram: significant_digits must be in [1, 5]");
+    }
+    if (max_latency_ns < 2) {
+        throw std::invalid_argument("LatencyHistogram: max_latency_ns must be at least 2");
+    }
+
+    int64_t largest_value_with_single_unit_resolution = 2 * static_cast<int64_t>(std::pow(10, significant_digits));
+    int32_t sub_bucket_count_magnitude = Log2Ceiling(largest_value_with_single_unit_resolution);
+    sub_bucket_half_count_magnitude_ = std::max(sub_bucket_count_magnitude, 1) - 1;
+    int32_t sub_bucket_count = 1 << (sub_bucket_half_count_magnitude_ + 1);
+    sub_bucket_half_count_ = sub_bucket_count / 2;
+    sub_bucket_mask_ = static_cast<int64_t>(sub_bucket_count) - 1;
+
+    // the number of power-of-two buckets required to cover [0, max_latency_ns].
+    int64_t smallest_untrackable_value = static_cast<int64_t>(sub_bucket_count);
+    bucket_count_ = 1;
+    while (smallest_untrackable_value <= max_latency_ns) {
+        if (smallest_untrackable_value > std::numeric_limits<int64_t>::max() / 2) {
+            bucket_count_++;
+            break;
+        }
+        smallest_untrackable_value <<= 1;
+        bucket_count_++;
+    }
+
+    counts_.resize(static_cast<size_t>(bucket_count_ + 1) * sub_bucket_half_count_, 0);
+    Reset();
+}
+
+void LatencyHistogram::Reset() {
+    std::fill(counts_.begin(), counts_.end(), 0);
+    total_count_ = 0;
+    min_ns_ = std::numeric_limits<int64_t>::max();
+    max_ns_ = 0;
+    total_ns_ = 0;
+}
+
+int32_t LatencyHistogram::BucketIndex(int64_t value) const {
+    int32_t pow2_ceiling = 64 - CountLeadingZeros(value | sub_bucket_mask_);
+    return pow2_ceiling - (sub_bucket_half_count_magnitude_ + 1);
+}
+
+int32_t LatencyHistogram::SubBucketIndex(int64_t value, int32_t bucket_index) const {
+    return static_cast<int32_t>(value >> bucket_index);
+}
+
+int32_t LatencyHistogram::CountsIndex(int64_t value) const {
+    int32_t bucket_index = BucketIndex(value);
+    int32_t sub_bucket_index = SubBucketIndex(value, bucket_index);
+    int32_t bucket_base_index = (bucket_index + 1) << sub_bucket_half_count_magnitude_;
+    return bucket_base_index + (sub_bucket_index - sub_bucket_half_count_);
+}
+
+int64_t LatencyHistogram::ValueFromIndex(int32_t index) const {
+    int32_t bucket_index = (index >> sub_bucket_half_count_magnitude_) - 1;
+    int32_t sub_bucket_index = (index & (sub_bucket_half_count_ - 1)) + sub_bucket_half_count_;
+    if (bucket_index < 0) {
+        sub_bucket_index -= sub_bucket_half_count_;
+        bucket_index = 0;
+    }
+    return static_cast<int64_t>(sub_bucket_index) << bucket_index;
+}
+
+int64_t LatencyHistogram::HighestEquivalentValue(int64_t value) const {
+    int32_t bucket_index = BucketIndex(value);
+    int32_t sub_bucket_index = SubBucketIndex(value, bucket_index);
+    int32_t adjusted_bucket = (sub_bucket_index >= (sub_bucket_half_count_ << 1)) ? bucket_index + 1 : bucket_index;
+    int64_t lowest_equivalent_value = static_cast<int64_t>(sub_bucket_index) << bucket_index;
+    return lowest_equivalent_value + (int64_t(1) << adjusted_bucket) - 1;
+}
+
+void LatencyHistogram::Record(std::chrono::nanoseconds latency, int64_t count) {
+    Record(static_cast<int64_t>(latency.count()), count);
+}
+
+void LatencyHistogram::Record(int64_t latency_ns, int64_t count) {
+    if (count <= 0) {
+        return;
+    }
+    // clamp instead of failing, a single outlier should not break a long run.
+    int64_t value = std::min(std::max<int64_t>(latency_ns, 0), max_latency_ns_);
+    counts_[CountsIndex(value)] += count;
+    total_count_ += count;
+    total_ns_ += static_cast<double>(value) * count;
+    min_ns_ = std::min(min_ns_, value);
+    max_ns_ = std::max(max_ns_, value);
+}
+
+void LatencyHistogram::Merge(const LatencyHistogram& other) {
+    if (other.total_count_ == 0) {
+        return;
+    }
+
+    if (other.significant_digits_ == significant_digits_ && other.counts_.size() == counts_.size()) {
+        for (size_t i = 0; i < counts_.size(); i++) {
+            counts_[i] += other.counts_[i];
+        }
+    } else {
+        for (size_t i = 0; i < other.counts_.size(); i++) {
+            if (other.counts_[i] != 0) {
+                int64_t value = std::min(other.ValueFromIndex(static_cast<int32_t>(i)), max_latency_ns_);
+                counts_[CountsIndex(value)] += other.counts_[i];
+            }
+        }
+    }
+    total_count_ += other.total_count_;
+    total_ns_ += other.total_ns_;
+    min_ns_ = std::min(min_ns_, std::min(other.min_ns_, max_latency_ns_));
+    max_ns_ = std::max(max_ns_, std::min(other.max_ns_, max_latency_ns_));
+}
+
+int64_t LatencyHistogram::Count() const {
+    return total_count_;
+}
+
+int LatencyHistogram::SignificantDigits() const {
+    return significant_digits_;
+}
+
+double LatencyHistogram::GetPercentile(double p) const {
+    if (total_count_ == 0) {
+        return 0;
+    }
+
+    // same rank convention as the exact (sorted) mode of PerfResult.
+    int64_t rank = static_cast<int64_t>(total_count_ * p);
+    rank = std::min(std::max<int64_t>(rank, 0), total_count_ - 1);
+
+    int64_t cumulative = 0;
+    for (size_t i = 0; i < counts_.size(); i++) {
+        cumulative += counts_[i];
+        if (cumulative > rank) {
+            int64_t value = HighestEquivalentValue(ValueFromIndex(static_cast<int32_t>(i)));
+            value = std::min(std::max(value, min_ns_), max_ns_);
+            return std::chrono::duration<double, std::milli>(std::chrono::nanoseconds(value)).count();
+        }
+    }
+    return GetMax();
+}
+
+double LatencyHistogram::GetMin() const {
+    if (total_count_ == 0) {
+        return 0;
+    }
+    return std::chrono::duration<double, std::milli>(std::chrono::nanoseconds(min_ns_)).count();
+}
+
+double LatencyHistogram::GetAvg() const {
+    if (total_count_ == 0) {
+        return 0;
+    }
+    return total_ns_ / total_count_ / 1e6;
+}
+
+double LatencyHistogram::GetMax() const {
+    return std::chrono::duration<double, std::milli>(std::chrono::nanoseconds(max_ns_)).count();
+}
+
+std::vector<double> LatencyHistogram::GetLatencies(std::vector<double> percentiles, bool min, bool avg, bool max) const {
+    std::vector<double> res;
+    if (total_count_ == 0) {
+        return res;
+    }
+
+    for (double p : percentiles) {
+        res.push_back(GetPercentile(p));
+    }
+    if (min) {
+        res.push_back(GetMin());
+    }
+    if (avg) {
+        res.push_back(GetAvg());
+    }
+    if (max) {
+        res.push_back(GetMax());
+    }
+    return res;
+}
@@ -0,0 +1,56 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <cstdint>
+#include <chrono>
+#include <vector>
+
+// A log-bucketed latency histogram in the style of HdrHistogram. Values are
+// recorded in nanoseconds. Each power-of-two bucket is split into linear
+// sub-buckets so that the relative error of any reported value is bounded by
+// 10^-significant_digits, while memory is constant and independent of the
+// number of recorded values.
+class LatencyHistogram {
+  public:
+    LatencyHistogram(int significant_digits = 3, int64_t max_latency_ns = 3600LL * 1000 * 1000 * 1000);
+    virtual ~LatencyHistogram() = default;
+
+    void Record(std::chrono::nanoseconds latency, int64_t count = 1);
+    void Record(int64_t latency_ns, int64_t count = 1);
+    // Add all values recorded by another histogram. Both histograms do not
+    // need to share the same precision.
+    void Merge(const LatencyHistogram& other);
+    void Reset();
+
+    int64_t Count() const;
+    int SignificantDigits() const;
+
+    // latency values in milliseconds, percentile p is in [0, 1].
+    double GetPercentile(double p) const;
+    std::vector<double> GetLatencies(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true) const;
+    double GetMin() const;
+    double GetAvg() const;
+    double GetMax() const;
+
+  private:
+    int32_t BucketIndex(int64_t value) const;
+    int32_t SubBucketIndex(int64_t value, int32_t bucket_index) const;
+    int32_t CountsIndex(int64_t value) const;
+    int64_t ValueFromIndex(int32_t index) const;
+    int64_t HighestEquivalentValue(int64_t value) const;
+
+    int significant_digits_;
+    int64_t max_latency_ns_;
+    int32_t sub_bucket_half_count_magnitude_;
+    int32_t sub_bucket_half_count_;
+    int64_t sub_bucket_mask_;
+    int32_t bucket_count_;
+
+    std::vector<int64_t> counts_;
+    int64_t total_count_;
+    int64_t min_ns_;
+    int64_t max_ns_;
+    double total_ns_;
+};
@@ -1,25 +1,44 @@
 // Copyright (c) Microsoft Corporation.
 // Licensed under the MIT License.
 
+#include <stdexcept>
 #include "load_gen.h"
 
 std::atomic_int64_t LoadGen::next_query_id_{ 0 };
 
+EarlyStopping::EarlyStopping(double percentile, double relative_width, double confidence,
+                             int64_t max_duration_ms, int64_t check_interval_ms)
+  : percentile(percentile)
+  , relative_width(relative_width)
+  , confidence(confidence)
+  , max_duration_ms(max_duration_ms)
+  , check_interval_ms(check_interval_ms) {
+    if (percentile <= 0 || percentile >= 1) {
+        throw std::invalid_argument("percentile must be in (0, 1)");
+    }
+    if (confidence <= 0 || confidence >= 1) {
+        throw std::invalid_argument("confidence must be in (0, 1)");
+    }
+}
+
 LoadGen::LoadGen(PerfResult& result, int64_t min_query_count, int64_t min_duration_ms)
   : seed_(std::chrono::system_clock::now().time_since_epoch().count())
   , rng_(seed_)
   , result_(&result)
   , min_query_count_(min_query_count)
   , min_duration_ms_(min_duration_ms)
-  , issued_query_count_(0) {
-    start_time_ = std::chrono::high_resolution_clock::now();
+  , issued_query_count_(0)
+  , finished_(false)
+  , converged_(false)
+  , stopped_(false) {
+    start_time_ = std::chrono::steady_clock::now();
 }
 
 LoadGen::LoadGen(std::shared_ptr<PerfResult> result, int64_t min_query_count, int64_t min_duration_ms)
   :LoadGen(*result, min_query_count, min_duration_ms) {}
 
 std::shared_ptr<Query> LoadGen::IssueQuery() {
-    auto now = std::chrono::high_resolution_clock::now();
+    auto now = std::chrono::steady_clock::now();
     // use the issued time of the first query a start time.
     if (issued_query_count_ == 0) {
         start_time_ = now;
@@ -27,12 +46,67 @@ std::shared_ptr<Query> LoadGen::IssueQuery() {
 
     std::shared_ptr<Query> q = std::make_shared<Query>();
     q->issued_at = now;
-    int64_t span = std::chrono::duration_cast<std::chrono::milliseconds>(now - start_time_).count();
-    if (span >= min_duration_ms_ && issued_query_count_ >= min_query_count_) {
+    if (IsFinished(now)) {
         q->id = -1;
         return q;
     }
+    return AddQuery(q);
+}
+
+bool LoadGen::IsFinished(std::chrono::steady_clock::time_point now) {
+    if (stopped_) {
+        return true;
+    }
+    int64_t span = std::chrono::duration_cast<std::chrono::milliseconds>(now - start_time_).count();
+    if (span < min_duration_ms_ || issued_query_count_ < min_query_count_) {
+        return false;
+    }
+    if (!early_stopping_ || finished_) {
+        return true;
+    }
 
+    if (span >= early_stopping_->max_duration_ms) {
+        finished_ = true;
+        return true;
+    }
+    if (now < next_check_time_ || !result_) {
+        return false;
+    }
+    next_check_time_ = now + std::chrono::milliseconds(early_stopping_->check_interval_ms);
+    std::vector<double> ci = result_->GetPercentileCI(early_stopping_->percentile, early_stopping_->confidence);
+    if (ci.empty() || ci[2] - ci[0] > early_stopping_->relative_width * ci[1]) {
+        return false;
+    }
+    converged_ = true;
+    finished_ = true;
+    return true;
+}
+
+void LoadGen::SetEarlyStopping(const EarlyStopping& early_stopping) {
+    early_stopping_.reset(new EarlyStopping(early_stopping));
+    finished_ = false;
+    converged_ = false;
+}
+
+bool LoadGen::IsConverged() {
+    return converged_;
+}
+
+void LoadGen::Stop() {
+    stopped_ = true;
+}
+
+bool LoadGen::IsStopped() {
+    return stopped_;
+}
+
+std::shared_ptr<Query> LoadGen::AddQuery(std::shared_ptr<Query> q) {
+    if (issued_query_count_ == 0) {
+        start_time_ = q->issued_at;
+    }
+    if (q->scheduled_at.time_since_epoch().count() == 0) {
+        q->scheduled_at = q->issued_at;
+    }
     issued_query_count_++;
     q->id = (next_query_id_++);
     if (result_) {
@@ -46,7 +120,7 @@ int64_t LoadGen::CountIssued() {
 }
 
 double LoadGen::GetIssuedQPS() {
-    auto now = std::chrono::high_resolution_clock::now();
+    auto now = std::chrono::steady_clock::now();
     double lat_ms = std::chrono::duration<double, std::milli>(now - start_time_).count();
     return CountIssued() / lat_ms * 1e3;
 }
\ No newline at end of file
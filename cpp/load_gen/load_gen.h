@@ -11,6 +11,20 @@
 #include "query.h"
 #include "perf_result.h"
 
+// stop a run once the confidence interval of a latency percentile is narrower than relative_width
+// of the percentile, or after max_duration_ms, instead of as soon as the minimums are met.
+struct EarlyStopping {
+    EarlyStopping(double percentile = 0.99, double relative_width = 0.05, double confidence = 0.95,
+                  int64_t max_duration_ms = 600000, int64_t check_interval_ms = 100);
+
+    double percentile;
+    double relative_width;
+    double confidence;
+    int64_t max_duration_ms;
+    // the interval is computed at most once per interval, it costs a pass over the latencies.
+    int64_t check_interval_ms;
+};
+
 class LoadGen {
   public:
     LoadGen(std::shared_ptr<PerfResult> result, int64_t min_query_count=100, int64_t min_duration_ms=10000);
@@ -19,8 +33,20 @@ class LoadGen {
     std::shared_ptr<Query> IssueQuery();
     int64_t CountIssued();
     double GetIssuedQPS();
+    // min_query_count and min_duration_ms still have to be met before the run stops early.
+    void SetEarlyStopping(const EarlyStopping& early_stopping);
+    // whether the run stopped because the confidence interval converged, not at max_duration_ms.
+    bool IsConverged();
+    // finish the run at the next query, whether the minimums are met or not.
+    void Stop();
+    bool IsStopped();
 
   protected:
+    // whether both min_query_count and min_duration_ms are satisfied, and the early stopping rule if any.
+    bool IsFinished(std::chrono::steady_clock::time_point now);
+    // assign an id to the query and register it with the perf result.
+    std::shared_ptr<Query> AddQuery(std::shared_ptr<Query> q);
+
     unsigned seed_;
     std::mt19937 rng_; // Pseudo-random number generation
 
@@ -30,6 +56,13 @@ class LoadGen {
     int64_t min_duration_ms_;
     static std::atomic_int64_t next_query_id_;
 
-    std::chrono::high_resolution_clock::time_point start_time_;
+    std::chrono::steady_clock::time_point start_time_;
     std::atomic<int64_t> issued_query_count_;
+
+    std::unique_ptr<EarlyStopping> early_stopping_;
+    // a run that stopped early stays finished, the rule is not checked again.
+    std::atomic<bool> finished_;
+    std::atomic<bool> converged_;
+    std::atomic<bool> stopped_;
+    std::chrono::steady_clock::time_point next_check_time_;
 };
\ No newline at end of file
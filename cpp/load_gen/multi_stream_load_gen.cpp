@@ -0,0 +1,58 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include <thread>
+#include <stdexcept>
+#include "multi_stream_load_gen.h"
+
+std::atomic_int64_t MultiStreamLoadGen::next_frame_id_{ 0 };
+
+MultiStreamLoadGen::MultiStreamLoadGen(std::shared_ptr<PerfResult> result, int64_t samples_per_frame, double frame_interval_ms, int64_t min_query_count, int64_t min_duration_ms)
+  : LoadGen(result, min_query_count, min_duration_ms)
+  , samples_per_frame_(samples_per_frame)
+  , frame_interval_(std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::duration<double, std::milli>(frame_interval_ms)))
+  , num_frames_(0) {
+    if (samples_per_frame <= 0 || frame_interval_ms <= 0) {
+        throw std::invalid_argument("MultiStreamLoadGen: samples_per_frame and frame_interval_ms must be positive");
+    }
+}
+
+std::list<std::shared_ptr<Query>> MultiStreamLoadGen::IssueQuery() {
+    std::list<std::shared_ptr<Query>> res;
+    auto now = std::chrono::steady_clock::now();
+
+    // for the first frame
+    if (CountIssued() == 0) {
+        next_frame_time_ = now;
+    }
+
+    // never stop in the middle of a frame.
+    if (CountIssued() != 0 && IsFinished(now)) {
+        res.push_back(LoadGen::IssueQuery());
+        return res;
+    }
+
+    if (now < next_frame_time_) {
+        std::this_thread::sleep_until(next_frame_time_);
+        now = std::chrono::steady_clock::now();
+    }
+
+    int64_t group = next_frame_id_++;
+    for (int64_t i = 0; i < samples_per_frame_; i++) {
+        std::shared_ptr<Query> q = std::make_shared<Query>();
+        q->issued_at = now;
+        q->scheduled_at = next_frame_time_;
+        q->group = group;
+        q->deadline = next_frame_time_ + frame_interval_;
+        res.push_back(AddQuery(q));
+    }
+
+    // keep the fixed cadence even if the issuing falls behind.
+    next_frame_time_ += frame_interval_;
+    num_frames_++;
+    return res;
+}
+
+int64_t MultiStreamLoadGen::CountFrames() {
+    return num_frames_;
+}
@@ -0,0 +1,31 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <list>
+#include "load_gen.h"
+
+// MultiStream scenario: every frame_interval_ms, a frame of samples_per_frame
+// queries is issued together, like frames of a camera. Frames are issued on a
+// fixed cadence no matter whether the previous frame is completed, and a frame
+// misses its deadline if it is not completed before the next frame is due.
+class MultiStreamLoadGen:public LoadGen {
+  public:
+    MultiStreamLoadGen(
+      std::shared_ptr<PerfResult> result,
+      int64_t samples_per_frame,
+      double frame_interval_ms,
+      int64_t min_query_count = 100,
+      int64_t min_duration_ms = 10000);
+    virtual ~MultiStreamLoadGen() = default;
+    std::list<std::shared_ptr<Query>> IssueQuery();
+    int64_t CountFrames();
+
+  private:
+    int64_t samples_per_frame_;
+    std::chrono::nanoseconds frame_interval_;
+    int64_t num_frames_;
+    static std::atomic_int64_t next_frame_id_;
+    std::chrono::steady_clock::time_point next_frame_time_;
+};
@@ -0,0 +1,28 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include "offline_load_gen.h"
+
+OfflineLoadGen::OfflineLoadGen(std::shared_ptr<PerfResult> result, int64_t query_count)
+  : LoadGen(result, query_count, 0)
+  , query_count_(query_count) {
+}
+
+std::list<std::shared_ptr<Query>> OfflineLoadGen::IssueQuery() {
+    std::list<std::shared_ptr<Query>> res;
+
+    if (CountIssued() == 0) {
+        auto now = std::chrono::steady_clock::now();
+        for (int64_t i = 0; i < query_count_; i++) {
+            std::shared_ptr<Query> q = std::make_shared<Query>();
+            q->issued_at = now;
+            res.push_back(AddQuery(q));
+        }
+    }
+
+    // all queries are issued, the next call returns the end-of-queries marker.
+    if (res.size() == 0) {
+        res.push_back(LoadGen::IssueQuery());
+    }
+    return res;
+}
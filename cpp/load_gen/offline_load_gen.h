@@ -0,0 +1,19 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <list>
+#include "load_gen.h"
+
+// Offline (max-throughput) scenario: the whole query set is issued at once,
+// and the system under test processes it as fast as it can.
+class OfflineLoadGen:public LoadGen {
+  public:
+    OfflineLoadGen(std::shared_ptr<PerfResult> result, int64_t query_count = 1000);
+    virtual ~OfflineLoadGen() = default;
+    std::list<std::shared_ptr<Query>> IssueQuery();
+
+  private:
+    int64_t query_count_;
+};
@@ -2,25 +2,48 @@
 // Licensed under the MIT License.
 
 #include <iostream>
+#include <algorithm>
+#include <cmath>
+#include <stdexcept>
 #include "perf_result.h"
 
 bool set_cmp(const Query& a, const Query& b) {
     return a.latency < b.latency;
 }
 
-PerfResult::PerfResult()
+PerfResult::PerfResult(bool histogram, int significant_digits)
   : num_queries_(0)
   , num_succeeded_queries_(0)
   , num_failed_queries_(0)
   , succeeded_queries_sorted_(PerfResult::set_cmp)
-  , total_latency_ns_(0) {
-    start_time_ = std::chrono::high_resolution_clock::now();
+  , total_latency_ns_(0)
+  , histogram_mode_(histogram)
+  , histogram_(significant_digits)
+  , response_histogram_(significant_digits)
+  , issue_lag_histogram_(significant_digits)
+  , dispatch_histogram_(significant_digits)
+  , worker_queue_histogram_(significant_digits)
+  , service_histogram_(significant_digits)
+  , return_histogram_(significant_digits)
+  , group_histogram_(significant_digits)
+  , num_completed_groups_(0)
+  , num_missed_deadlines_(0)
+  , significant_digits_(significant_digits)
+  , window_ms_(1000)
+  , window_percentiles_({ 0.5, 0.9, 0.99, 0.999 })
+  , window_started_(false)
+  , current_window_()
+  // windows are short-lived, a lower precision is enough.
+  , window_histogram_(2)
+  , recording_(false) {
+    start_time_ = std::chrono::steady_clock::now();
+    last_completed_at_ = start_time_;
 }
 
 void PerfResult::AddQuery(int64_t id) {
     std::shared_ptr<Query> q = std::make_shared<Query>();
     q->id = id;
-    q->issued_at = std::chrono::high_resolution_clock::now();
+    q->issued_at = std::chrono::steady_clock::now();
     AddQuery(q);
 }
 
@@ -34,50 +57,233 @@ void PerfResult::AddQuery(std::shared_ptr<Query> q) {
         start_time_ = q->issued_at;
     }
 
+    // windows follow the clock of this result, the issued time of a query
+    // can be arbitrary when it is created outside of a load gen.
+    auto now = std::chrono::steady_clock::now();
+    if (!window_started_) {
+        window_origin_ = now;
+        window_started_ = true;
+    }
+    AdvanceWindows(now);
+    current_window_.num_issued += 1;
+
+    if (q->tag >= 0) {
+        auto ite = tag_stats_.find(q->tag);
+        if (ite == tag_stats_.end()) {
+            ite = tag_stats_.emplace(q->tag, TagStats(significant_digits_)).first;
+            ite->second.first_issued_at = q->issued_at;
+        }
+        ite->second.num_issued += 1;
+        ite->second.last_issued_at = q->issued_at;
+    }
+
+    if (q->group >= 0) {
+        auto ite = pending_groups_.find(q->group);
+        if (ite == pending_groups_.end()) {
+            QueryGroup g;
+            g.issued_at = q->issued_at;
+            g.completed_at = q->issued_at;
+            g.deadline = q->deadline;
+            g.num_pending = 0;
+            ite = pending_groups_.emplace(q->group, g).first;
+        }
+        ite->second.num_pending += 1;
+    }
+
     num_queries_ += 1;
 }
 
-void PerfResult::CompleteQuery(int64_t id, bool error, float latency_ms) {
-    std::lock_guard<std::mutex> guard(lock_);
+int64_t PerfResult::ClockNs() {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
 
+void PerfResult::CompleteQuery(int64_t id, bool error, float latency_ms, int64_t dequeued_at_ns, int64_t started_at_ns, int64_t finished_at_ns) {
+    std::unique_lock<std::mutex> guard(lock_);
+    auto q = CompleteQueryLocked(id, error, latency_ms, std::chrono::steady_clock::now(),
+                                 dequeued_at_ns, started_at_ns, finished_at_ns);
+    if (pending_queries_.empty()) {
+        all_completed_.notify_all();
+    }
+
+    // the callback may take locks of the load gen, never call it while holding ours.
+    guard.unlock();
+    if (q && q->on_completed) {
+        q->on_completed();
+    }
+}
+
+void PerfResult::CompleteQueries(const std::vector<int64_t>& ids, const std::vector<bool>& errors, const std::vector<float>& latencies_ms,
+                                 const std::vector<int64_t>& dequeued_at_ns, const std::vector<int64_t>& started_at_ns,
+                                 const std::vector<int64_t>& finished_at_ns) {
+    for (size_t size : { errors.size(), latencies_ms.size(), dequeued_at_ns.size(), started_at_ns.size(), finished_at_ns.size() }) {
+        if (size != 0 && size != ids.size()) {
+            throw std::invalid_argument("PerfResult::CompleteQueries: all arguments must be empty or as long as ids");
+        }
+    }
+    auto at = [](const std::vector<int64_t>& v, size_t i) { return v.empty() ? int64_t(-1) : v[i]; };
+
+    std::vector<std::shared_ptr<Query>> completed;
+    std::unique_lock<std::mutex> guard(lock_);
+    auto now = std::chrono::steady_clock::now();
+    for (size_t i = 0; i < ids.size(); i++) {
+        auto q = CompleteQueryLocked(ids[i], errors.empty() ? false : errors[i], latencies_ms.empty() ? -1.0f : latencies_ms[i], now,
+                                     at(dequeued_at_ns, i), at(started_at_ns, i), at(finished_at_ns, i));
+        if (q && q->on_completed) {
+            completed.push_back(q);
+        }
+    }
+    if (pending_queries_.empty()) {
+        all_completed_.notify_all();
+    }
+
+    guard.unlock();
+    for (auto& q : completed) {
+        q->on_completed();
+    }
+}
+
+std::shared_ptr<Query> PerfResult::CompleteQueryLocked(int64_t id, bool error, float latency_ms, std::chrono::steady_clock::time_point now,
+                                                       int64_t dequeued_at_ns, int64_t started_at_ns, int64_t finished_at_ns) {
     // if id not found, then the query might be issued by previous runs.
     // we choose to ignore it instead of reporting an error.
     auto ite = pending_queries_.find(id);
     if (ite == pending_queries_.end()) {
         // throw std::runtime_error("PerfResult::CompleteQuery: query not found");
-        return;
+        return nullptr;
     }
 
     std::shared_ptr<Query> q = ite->second;
+    last_completed_at_ = now;
     if (latency_ms >= 0) {
         q->latency = std::chrono::nanoseconds(int64_t(latency_ms * 1e6));
     } else {
-        q->latency = std::chrono::high_resolution_clock::now() - q->issued_at;
+        q->latency = last_completed_at_ - q->issued_at;
+    }
+
+    AdvanceWindows(last_completed_at_);
+    if (error) {
+        current_window_.num_failed += 1;
+    } else {
+        current_window_.num_succeeded += 1;
+        window_histogram_.Record(q->latency);
     }
 
     if (error) {
-        failed_queries_.push_back(q);
+        if (!histogram_mode_) {
+            failed_queries_.push_back(q);
+        }
         num_failed_queries_ += 1;
     } else {
-        succeeded_queries_buffer_.push_back(q);
+        if (!histogram_mode_) {
+            succeeded_queries_buffer_.push_back(q);
+        }
+        histogram_.Record(q->latency);
+        // a query issued late because the issuing loop stalled should count the stall as latency.
+        auto issue_lag = q->issued_at - q->scheduled_at;
+        response_histogram_.Record(q->latency + issue_lag);
+        issue_lag_histogram_.Record(issue_lag);
+        RecordBreakdown(*q, now, dequeued_at_ns, started_at_ns, finished_at_ns);
         num_succeeded_queries_ += 1;
         total_latency_ns_ += q->latency;
     }
 
-    pending_queries_.erase(id);
+    if (q->group >= 0) {
+        CompleteGroup(q);
+    }
+
+    if (recording_) {
+        auto to_ns = [](std::chrono::steady_clock::time_point t) {
+            return std::chrono::duration_cast<std::chrono::nanoseconds>(t.time_since_epoch()).count();
+        };
+        records_.push_back({ q->id, q->index, q->tag, q->group,
+                             to_ns(q->scheduled_at), to_ns(q->issued_at),
+                             dequeued_at_ns, started_at_ns, finished_at_ns, to_ns(now),
+                             std::chrono::duration<double, std::milli>(q->latency).count(), error });
+    }
+
+    auto tag_ite = tag_stats_.find(q->tag);
+    if (tag_ite != tag_stats_.end()) {
+        if (error) {
+            tag_ite->second.num_failed += 1;
+        } else {
+            tag_ite->second.num_succeeded += 1;
+            tag_ite->second.histogram.Record(q->latency);
+        }
+    }
+
+    pending_queries_.erase(ite);
 
     // If someone created the promise and wait for the completion, we should set its value and notify.
     if (q->completed) {
         q->completed->set_value(true);
     }
+    return q;
+}
+
+void PerfResult::RecordBreakdown(const Query& q, std::chrono::steady_clock::time_point now,
+                                 int64_t dequeued_at_ns, int64_t started_at_ns, int64_t finished_at_ns) {
+    if (dequeued_at_ns < 0 || started_at_ns < 0 || finished_at_ns < 0) {
+        return;
+    }
+
+    int64_t issued_at_ns = std::chrono::duration_cast<std::chrono::nanoseconds>(q.issued_at.time_since_epoch()).count();
+    int64_t completed_at_ns = std::chrono::duration_cast<std::chrono::nanoseconds>(now.time_since_epoch()).count();
+    dispatch_histogram_.Record(dequeued_at_ns - issued_at_ns);
+    worker_queue_histogram_.Record(started_at_ns - dequeued_at_ns);
+    service_histogram_.Record(finished_at_ns - started_at_ns);
+    return_histogram_.Record(completed_at_ns - finished_at_ns);
+}
+
+void PerfResult::CompleteGroup(const std::shared_ptr<Query>& q) {
+    auto ite = pending_groups_.find(q->group);
+    if (ite == pending_groups_.end()) {
+        return;
+    }
+
+    QueryGroup& g = ite->second;
+    auto completed_at = q->issued_at + std::chrono::duration_cast<std::chrono::steady_clock::duration>(q->latency);
+    if (completed_at > g.completed_at) {
+        g.completed_at = completed_at;
+    }
+
+    g.num_pending -= 1;
+    if (g.num_pending > 0) {
+        return;
+    }
+
+    group_histogram_.Record(g.completed_at - g.issued_at);
+    num_completed_groups_ += 1;
+    if (g.deadline.time_since_epoch().count() != 0 && g.completed_at > g.deadline) {
+        num_missed_deadlines_ += 1;
+    }
+    pending_groups_.erase(ite);
 }
 
 double PerfResult::GetActualQPS() {
-    std::chrono::duration<double, std::milli> fp_ms = std::chrono::high_resolution_clock::now() - start_time_;
+    std::chrono::duration<double, std::milli> fp_ms = std::chrono::steady_clock::now() - start_time_;
     int64_t total_completed = CountSucceeded();
     return total_completed / fp_ms.count() * 1e3;
 }
 
+double PerfResult::GetThroughput() {
+    std::lock_guard<std::mutex> guard(lock_);
+    std::chrono::duration<double, std::milli> fp_ms = last_completed_at_ - start_time_;
+    if (fp_ms.count() <= 0) {
+        return 0;
+    }
+    return num_succeeded_queries_ / fp_ms.count() * 1e3;
+}
+
+bool PerfResult::WaitAllCompleted(int64_t timeout_ms) {
+    std::unique_lock<std::mutex> guard(lock_);
+    auto is_idle = [this]() { return pending_queries_.empty(); };
+    if (timeout_ms < 0) {
+        all_completed_.wait(guard, is_idle);
+        return true;
+    }
+    return all_completed_.wait_for(guard, std::chrono::milliseconds(timeout_ms), is_idle);
+}
+
 int64_t PerfResult::CountSucceeded() {
     return num_succeeded_queries_;
 }
@@ -86,7 +292,208 @@ int64_t PerfResult::CountFailed() {
     return num_failed_queries_;
 }
 
+std::vector<double> PerfResult::GetResponseLatencies(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return response_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+std::vector<double> PerfResult::GetIssueLags(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return issue_lag_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+std::vector<double> PerfResult::GetDispatchDelays(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return dispatch_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+std::vector<double> PerfResult::GetWorkerQueueDelays(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return worker_queue_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+std::vector<double> PerfResult::GetServiceTimes(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return service_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+std::vector<double> PerfResult::GetReturnDelays(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return return_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+std::vector<double> PerfResult::GetGroupLatencies(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    return group_histogram_.GetLatencies(percentiles, min, avg, max);
+}
+
+int64_t PerfResult::CountGroups() {
+    std::lock_guard<std::mutex> guard(lock_);
+    return num_completed_groups_;
+}
+
+int64_t PerfResult::CountMissedDeadlines() {
+    std::lock_guard<std::mutex> guard(lock_);
+    return num_missed_deadlines_;
+}
+
+const PerfResult::TagStats* PerfResult::FindTagStats(int64_t tag) {
+    auto ite = tag_stats_.find(tag);
+    return ite == tag_stats_.end() ? nullptr : &ite->second;
+}
+
+std::vector<int64_t> PerfResult::GetTags() {
+    std::lock_guard<std::mutex> guard(lock_);
+    std::vector<int64_t> tags;
+    for (const auto& ite : tag_stats_) {
+        tags.push_back(ite.first);
+    }
+    return tags;
+}
+
+std::vector<double> PerfResult::GetTagLatencies(int64_t tag, std::vector<double> percentiles, bool min, bool avg, bool max) {
+    std::lock_guard<std::mutex> guard(lock_);
+    const TagStats* stats = FindTagStats(tag);
+    return stats ? stats->histogram.GetLatencies(percentiles, min, avg, max) : std::vector<double>();
+}
+
+int64_t PerfResult::CountTagIssued(int64_t tag) {
+    std::lock_guard<std::mutex> guard(lock_);
+    const TagStats* stats = FindTagStats(tag);
+    return stats ? stats->num_issued : 0;
+}
+
+int64_t PerfResult::CountTagSucceeded(int64_t tag) {
+    std::lock_guard<std::mutex> guard(lock_);
+    const TagStats* stats = FindTagStats(tag);
+    return stats ? stats->num_succeeded : 0;
+}
+
+int64_t PerfResult::CountTagFailed(int64_t tag) {
+    std::lock_guard<std::mutex> guard(lock_);
+    const TagStats* stats = FindTagStats(tag);
+    return stats ? stats->num_failed : 0;
+}
+
+double PerfResult::GetTagIssuedQPS(int64_t tag) {
+    std::lock_guard<std::mutex> guard(lock_);
+    const TagStats* stats = FindTagStats(tag);
+    if (!stats) {
+        return 0;
+    }
+    double span_ms = std::chrono::duration<double, std::milli>(stats->last_issued_at - stats->first_issued_at).count();
+    return span_ms > 0 ? stats->num_issued / span_ms * 1e3 : 0;
+}
+
+double PerfResult::GetTagActualQPS(int64_t tag) {
+    std::lock_guard<std::mutex> guard(lock_);
+    const TagStats* stats = FindTagStats(tag);
+    if (!stats) {
+        return 0;
+    }
+    double span_ms = std::chrono::duration<double, std::milli>(stats->last_issued_at - stats->first_issued_at).count();
+    return span_ms > 0 ? stats->num_succeeded / span_ms * 1e3 : 0;
+}
+
+void PerfResult::SetWindow(int64_t window_ms, std::vector<double> percentiles) {
+    std::lock_guard<std::mutex> guard(lock_);
+    window_ms_ = window_ms;
+    window_percentiles_ = percentiles;
+}
+
+void PerfResult::AdvanceWindows(std::chrono::steady_clock::time_point now) {
+    if (window_ms_ <= 0 || !window_started_) {
+        return;
+    }
+
+    int64_t index = std::chrono::duration_cast<std::chrono::milliseconds>(now - window_origin_).count() / window_ms_;
+    while (current_window_.index < index) {
+        current_window_.start_ms = static_cast<double>(current_window_.index * window_ms_);
+        current_window_.duration_ms = static_cast<double>(window_ms_);
+        current_window_.qps = current_window_.num_succeeded / current_window_.duration_ms * 1e3;
+        current_window_.latencies = window_histogram_.GetLatencies(window_percentiles_);
+        closed_windows_.push_back(current_window_);
+
+        int64_t next_index = current_window_.index + 1;
+        current_window_ = Window();
+        current_window_.index = next_index;
+        window_histogram_.Reset();
+    }
+}
+
+std::vector<PerfResult::Window> PerfResult::GetWindows(int64_t since) {
+    std::lock_guard<std::mutex> guard(lock_);
+    AdvanceWindows(std::chrono::steady_clock::now());
+
+    std::vector<Window> res;
+    for (size_t i = static_cast<size_t>(std::max<int64_t>(since, 0)); i < closed_windows_.size(); i++) {
+        res.push_back(closed_windows_[i]);
+    }
+    return res;
+}
+
+void PerfResult::SetRecording(bool enabled) {
+    std::lock_guard<std::mutex> guard(lock_);
+    recording_ = enabled;
+}
+
+std::vector<PerfResult::Record> PerfResult::TakeRecords() {
+    std::vector<Record> records;
+    std::lock_guard<std::mutex> guard(lock_);
+    records.swap(records_);
+    return records;
+}
+
+LatencyHistogram PerfResult::GetHistogram() {
+    std::lock_guard<std::mutex> guard(lock_);
+    return histogram_;
+}
+
+bool PerfResult::IsHistogramMode() {
+    return histogram_mode_;
+}
+
+namespace {
+// z such that a standard normal variable is within [-z, z] with the given probability.
+double TwoSidedZScore(double confidence) {
+    double low = 0, high = 10;
+    for (int i = 0; i < 64; i++) {
+        double z = (low + high) / 2;
+        if (std::erf(z / std::sqrt(2.0)) < confidence) {
+            low = z;
+        } else {
+            high = z;
+        }
+    }
+    return (low + high) / 2;
+}
+}
+
+std::vector<double> PerfResult::GetPercentileCI(double percentile, double confidence) {
+    if (confidence <= 0 || confidence >= 1) {
+        throw std::invalid_argument("confidence must be in (0, 1)");
+    }
+    int64_t n = CountSucceeded();
+    if (n == 0) {
+        return {};
+    }
+    // the rank of the percentile among n latencies is binomial(n, percentile), so the interval
+    // lies between the latencies at percentile -/+ z * sqrt(percentile * (1 - percentile) / n).
+    double half_width = TwoSidedZScore(confidence) * std::sqrt(percentile * (1 - percentile) / n);
+    double low = percentile - half_width, high = percentile + half_width;
+    if (low < 0 || high >= 1) {
+        return {};
+    }
+    return GetLatencies({ low, percentile, high }, false, false, false);
+}
+
 std::vector<double> PerfResult::GetLatencies(std::vector<double> percentiles, bool min, bool avg, bool max) {
+    if (histogram_mode_) {
+        std::lock_guard<std::mutex> guard(lock_);
+        return histogram_.GetLatencies(percentiles, min, avg, max);
+    }
+
+    std::lock_guard<std::mutex> sorted_guard(sorted_lock_);
     std::list<std::shared_ptr<Query>> succeeded_queries_buffer1;
     {
         std::lock_guard<std::mutex> guard(lock_);
@@ -9,26 +9,148 @@
 #include <chrono>
 #include <memory>
 #include <mutex>
+#include <condition_variable>
 #include <unordered_map>
 #include <list>
 #include "query.h"
+#include "latency_histogram.h"
 
 class PerfResult {
   public:
-    PerfResult();
+    // statistics of the queries completed in one time window of the run.
+    struct Window {
+        int64_t index;
+        double start_ms;  // since the first query is added
+        double duration_ms;
+        int64_t num_issued;
+        int64_t num_succeeded;
+        int64_t num_failed;
+        double qps;  // succeeded queries per second
+        // latencies at the window percentiles, then min, avg and max, empty if no query succeeded.
+        std::vector<double> latencies;
+    };
+
+    // a completed query, timestamps are ClockNs() nanoseconds, -1 if unknown.
+    struct Record {
+        int64_t id;
+        int64_t index;
+        int64_t tag;
+        int64_t group;
+        int64_t scheduled_at_ns;
+        int64_t issued_at_ns;
+        int64_t dequeued_at_ns;
+        int64_t started_at_ns;
+        int64_t finished_at_ns;
+        int64_t completed_at_ns;
+        double latency_ms;
+        bool error;
+    };
+
+    // histogram=true keeps only a log-bucketed histogram of succeeded latencies
+    // instead of every query, memory is constant no matter how long the run is.
+    PerfResult(bool histogram = false, int significant_digits = 3);
     virtual ~PerfResult() = default;
     void AddQuery(int64_t id);
     void AddQuery(std::shared_ptr<Query> q);
 
-    void CompleteQuery(int64_t id, bool error=false, float latency_ms=-1.0);
+    // the clock of issued_at in nanoseconds, which is shared by all processes of the machine.
+    // it is monotonic, i.e. CLOCK_MONOTONIC on linux, so clock adjustments don't skew the breakdown.
+    static int64_t ClockNs();
+
+    // dequeued_at_ns, started_at_ns and finished_at_ns are optional ClockNs() timestamps taken by
+    // the worker when it received the query and before and after running it. -1 if unknown.
+    void CompleteQuery(int64_t id, bool error=false, float latency_ms=-1.0,
+                       int64_t dequeued_at_ns = -1, int64_t started_at_ns = -1, int64_t finished_at_ns = -1);
+    // complete a batch of queries while taking the lock once. the other vectors are either
+    // empty, i.e. no error, measured latency and no timestamps, or as long as ids.
+    void CompleteQueries(const std::vector<int64_t>& ids, const std::vector<bool>& errors = {}, const std::vector<float>& latencies_ms = {},
+                         const std::vector<int64_t>& dequeued_at_ns = {}, const std::vector<int64_t>& started_at_ns = {},
+                         const std::vector<int64_t>& finished_at_ns = {});
 
     double GetActualQPS();
+    // succeeded queries per second between the first issued and the last completed query.
+    double GetThroughput();
+    // block until there is no pending query, return false on timeout.
+    bool WaitAllCompleted(int64_t timeout_ms = -1);
     int64_t CountSucceeded();
     int64_t CountFailed();
 
     std::vector<double> GetLatencies(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    // coordinated-omission-corrected latencies, from when the query was scheduled instead of issued.
+    std::vector<double> GetResponseLatencies(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    // how late queries were issued compared with their schedule.
+    std::vector<double> GetIssueLags(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+
+    // distribution-free confidence interval of a latency percentile from the order statistics of the
+    // succeeded latencies: {low, estimate, high}, empty if there are too few latencies to bound it.
+    std::vector<double> GetPercentileCI(double percentile, double confidence = 0.95);
+
+    // breakdown of the latency of succeeded queries with worker timestamps, which add up to the latency:
+    // issued -> dequeued by a worker -> started -> finished -> completed.
+    std::vector<double> GetDispatchDelays(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    std::vector<double> GetWorkerQueueDelays(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    std::vector<double> GetServiceTimes(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    std::vector<double> GetReturnDelays(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+
+    // latencies of query groups, from the first issued to the last completed query of each group.
+    std::vector<double> GetGroupLatencies(std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    int64_t CountGroups();
+    int64_t CountMissedDeadlines();
+
+    // statistics of queries issued with the same tag.
+    std::vector<int64_t> GetTags();
+    std::vector<double> GetTagLatencies(int64_t tag, std::vector<double> percentiles, bool min = true, bool avg = true, bool max = true);
+    int64_t CountTagIssued(int64_t tag);
+    int64_t CountTagSucceeded(int64_t tag);
+    int64_t CountTagFailed(int64_t tag);
+    // issued and succeeded queries per second over the issue span of the tag.
+    double GetTagIssuedQPS(int64_t tag);
+    double GetTagActualQPS(int64_t tag);
+
+    // split the run into windows of window_ms, 0 disables windows. must be set before any query is added.
+    void SetWindow(int64_t window_ms, std::vector<double> percentiles);
+    // closed windows with index >= since, the window in progress is not included.
+    std::vector<Window> GetWindows(int64_t since = 0);
+
+    // keep a record of each query completed from now on until the records are taken.
+    void SetRecording(bool enabled);
+    // the records kept since the last call, memory is bounded by how often they are taken.
+    std::vector<Record> TakeRecords();
+
+    // a snapshot of the latency histogram, which can be merged with the snapshots of other runs.
+    LatencyHistogram GetHistogram();
+    bool IsHistogramMode();
 
   private:
+    struct QueryGroup {
+        std::chrono::steady_clock::time_point issued_at;
+        std::chrono::steady_clock::time_point completed_at;
+        std::chrono::steady_clock::time_point deadline;
+        int64_t num_pending;
+    };
+
+    struct TagStats {
+        TagStats(int significant_digits)
+          : histogram(significant_digits) {}
+        LatencyHistogram histogram;
+        int64_t num_issued = 0;
+        int64_t num_succeeded = 0;
+        int64_t num_failed = 0;
+        std::chrono::steady_clock::time_point first_issued_at;
+        std::chrono::steady_clock::time_point last_issued_at;
+    };
+
+    // complete a query while the lock is held, return nullptr if the query is not pending.
+    std::shared_ptr<Query> CompleteQueryLocked(int64_t id, bool error, float latency_ms, std::chrono::steady_clock::time_point now,
+                                               int64_t dequeued_at_ns, int64_t started_at_ns, int64_t finished_at_ns);
+    void RecordBreakdown(const Query& q, std::chrono::steady_clock::time_point now,
+                         int64_t dequeued_at_ns, int64_t started_at_ns, int64_t finished_at_ns);
+    void CompleteGroup(const std::shared_ptr<Query>& q);
+    // close all windows that end before now.
+    void AdvanceWindows(std::chrono::steady_clock::time_point now);
+    // nullptr if no query is issued with the tag.
+    const TagStats* FindTagStats(int64_t tag);
+
     static bool set_cmp(const std::shared_ptr<Query>& a, const std::shared_ptr<Query>& b) {
         return a->latency < b->latency;
     }
@@ -42,8 +164,41 @@ class PerfResult {
     std::list<std::shared_ptr<Query>> succeeded_queries_buffer_;
     std::list<std::shared_ptr<Query>> failed_queries_;
 
+    // guards the sorted latencies, which are updated by readers of the latencies outside of lock_.
+    std::mutex sorted_lock_;
     std::set<std::shared_ptr<Query>, decltype(set_cmp)*> succeeded_queries_sorted_;
 
-    std::chrono::high_resolution_clock::time_point start_time_;
+    std::condition_variable all_completed_;
+
+    std::chrono::steady_clock::time_point start_time_;
+    std::chrono::steady_clock::time_point last_completed_at_;
     std::chrono::nanoseconds total_latency_ns_;
+
+    bool histogram_mode_;
+    LatencyHistogram histogram_;
+    LatencyHistogram response_histogram_;
+    LatencyHistogram issue_lag_histogram_;
+    LatencyHistogram dispatch_histogram_;
+    LatencyHistogram worker_queue_histogram_;
+    LatencyHistogram service_histogram_;
+    LatencyHistogram return_histogram_;
+
+    std::unordered_map<int64_t, QueryGroup> pending_groups_;
+    LatencyHistogram group_histogram_;
+    int64_t num_completed_groups_;
+    int64_t num_missed_deadlines_;
+
+    int significant_digits_;
+    std::map<int64_t, TagStats> tag_stats_;
+
+    int64_t window_ms_;
+    std::vector<double> window_percentiles_;
+    bool window_started_;
+    std::chrono::steady_clock::time_point window_origin_;
+    Window current_window_;
+    LatencyHistogram window_histogram_;
+    std::vector<Window> closed_windows_;
+
+    bool recording_;
+    std::vector<Record> records_;
 };
\ No newline at end of file
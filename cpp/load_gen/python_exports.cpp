@@ -7,54 +7,172 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 #include <pybind11/chrono.h>
+#include <pybind11/numpy.h>
 #include "server_load_gen.h"
+#include "closed_loop_load_gen.h"
 #include "single_stream_load_gen.h"
+#include "offline_load_gen.h"
+#include "multi_stream_load_gen.h"
+#include "trace_load_gen.h"
+#include "latency_histogram.h"
+#include "qps_schedule.h"
+#include "arrival_process.h"
 #include "perf_result.h"
 
 namespace py = pybind11;
 
-PYBIND11_MODULE(load_gen_c, m) {
+// iterate over the queries of a load generator whose IssueQuery returns a list of queries.
+template <typename T>
+struct LoadGenIterator {
+    LoadGenIterator(T& lg)
+      : lg(lg) {}
 
-    py::class_<Query, std::shared_ptr<Query>>(m, "Query")
-      .def(py::init<>())
-      .def_readwrite("id", &Query::id)
-      .def_readwrite("issued_at", &Query::issued_at)
-      .def_readwrite("latency", &Query::latency);
+    std::shared_ptr<Query> next() {
+        if (cached.size() == 0) {
+            cached = lg.IssueQuery();
+        }
 
-    struct ServerLoadGenIterator {
-        ServerLoadGenIterator(ServerLoadGen& lg)
-          : lg(lg) {}
+        auto it = cached.begin();
+        auto q = *it;
+        cached.erase(it);
 
-        std::shared_ptr<Query> next() {
-            if (cached.size() == 0) {
-                cached = lg.IssueQuery();
-            }
+        if (q->id < 0) {
+            throw py::stop_iteration();
+        }
+        return q;
+    }
 
-            auto it = cached.begin();
-            auto q = *it;
-            cached.erase(it);
+    std::list<std::shared_ptr<Query>> cached;
+    T& lg;
+};
 
-            if (q->id < 0) {
-                throw py::stop_iteration();
-            }
-            return q;
+// issue all due queries at once, which avoids creating a python object for
+// each query. return (ids, indices) numpy arrays, or None once all queries
+// are issued.
+template <typename T>
+py::object IssueQueryBatch(T& lg) {
+    std::list<std::shared_ptr<Query>> qs;
+    {
+        py::gil_scoped_release release;
+        qs = lg.IssueQuery();
+    }
+
+    std::vector<std::shared_ptr<Query>> issued;
+    for (auto& q : qs) {
+        if (q->id >= 0) {
+            issued.push_back(q);
         }
+    }
+    if (issued.empty() && !qs.empty()) {
+        return py::none();
+    }
 
-        std::list<std::shared_ptr<Query>> cached;
-        ServerLoadGen& lg;
-    };
+    auto n = static_cast<py::ssize_t>(issued.size());
+    py::array_t<int64_t> ids(n), indices(n);
+    auto ids_ptr = ids.mutable_data();
+    auto indices_ptr = indices.mutable_data();
+    for (py::ssize_t i = 0; i < n; i++) {
+        ids_ptr[i] = issued[i]->id;
+        indices_ptr[i] = issued[i]->index;
+    }
+    return py::make_tuple(ids, indices);
+}
+
+using ServerLoadGenIterator = LoadGenIterator<ServerLoadGen>;
+using OfflineLoadGenIterator = LoadGenIterator<OfflineLoadGen>;
+using MultiStreamLoadGenIterator = LoadGenIterator<MultiStreamLoadGen>;
+using ClosedLoopLoadGenIterator = LoadGenIterator<ClosedLoopLoadGen>;
+using TraceLoadGenIterator = LoadGenIterator<TraceLoadGen>;
+
+PYBIND11_MODULE(load_gen_c, m) {
+
+    py::class_<Query, std::shared_ptr<Query>>(m, "Query")
+      .def(py::init<>())
+      .def_readwrite("id", &Query::id)
+      .def_readwrite("issued_at", &Query::issued_at)
+      .def_readwrite("scheduled_at", &Query::scheduled_at)
+      .def_readwrite("latency", &Query::latency)
+      .def_readwrite("index", &Query::index)
+      .def_readwrite("tag", &Query::tag)
+      .def_readwrite("group", &Query::group);
 
     py::class_<ServerLoadGenIterator>(m, "ServerLoadGenIterator")
       .def(
         "__iter__", [](ServerLoadGenIterator& it) -> ServerLoadGenIterator& { return it; }, py::call_guard<py::gil_scoped_release>())
       .def("__next__", &ServerLoadGenIterator::next, py::call_guard<py::gil_scoped_release>());
 
+    py::class_<QpsSchedule>(m, "QpsSchedule")
+      .def_static("constant", &QpsSchedule::Constant, py::arg("qps"))
+      .def_static("ramp",
+                  &QpsSchedule::Ramp,
+                  py::arg("start_qps"),
+                  py::arg("end_qps"),
+                  py::arg("duration_ms"),
+                  py::arg("num_steps") = 10)
+      .def_static("staircase", &QpsSchedule::Staircase, py::arg("qps"), py::arg("durations_ms"))
+      .def_static("sinusoid",
+                  &QpsSchedule::Sinusoid,
+                  py::arg("mean_qps"),
+                  py::arg("amplitude_qps"),
+                  py::arg("period_ms"),
+                  py::arg("duration_ms"),
+                  py::arg("num_steps") = 24)
+      .def("qps_at", &QpsSchedule::QpsAt, py::arg("elapsed_ms"))
+      .def("step_at", &QpsSchedule::StepAt, py::arg("elapsed_ms"))
+      .def("num_steps", &QpsSchedule::NumSteps)
+      .def("get_duration_ms", &QpsSchedule::GetDurationMs)
+      .def("get_step_qps", &QpsSchedule::GetStepQps, py::arg("step"))
+      .def("__repr__", [](const QpsSchedule& s) {
+          // (duration_ms, begin_qps, end_qps) of each step, e.g. to key cached results of a schedule.
+          py::list steps;
+          for (const auto& step : s.GetSteps()) {
+              steps.append(py::make_tuple(step.duration_ms, step.begin_qps, step.end_qps));
+          }
+          return py::str("QpsSchedule({})").format(steps);
+      });
+
+    py::class_<ArrivalProcess, std::shared_ptr<ArrivalProcess>>(m, "ArrivalProcess")
+      .def_static("poisson", &ArrivalProcess::Poisson)
+      .def_static("constant", &ArrivalProcess::Constant)
+      .def_static("pareto", &ArrivalProcess::Pareto, py::arg("shape") = 1.5)
+      .def_static("on_off", &ArrivalProcess::OnOff, py::arg("on_ms"), py::arg("off_ms"))
+      .def_static("mmpp", &ArrivalProcess::MMPP, py::arg("rate_factors"), py::arg("mean_dwell_ms"))
+      .def("name", &ArrivalProcess::Name)
+      .def("reset", &ArrivalProcess::Reset)
+      .def("__repr__", [](const ArrivalProcess& a) { return "ArrivalProcess(" + a.Name() + ")"; });
+
+    py::class_<EarlyStopping>(m, "EarlyStopping")
+      .def(py::init<double /* percentile */, double /* relative_width */, double /* confidence */, int64_t /* max_duration_ms */, int64_t /* check_interval_ms */>(),
+           py::arg("percentile") = 0.99,
+           py::arg("relative_width") = 0.05,
+           py::arg("confidence") = 0.95,
+           py::arg("max_duration_ms") = 600000,
+           py::arg("check_interval_ms") = 100)
+      .def_readonly("percentile", &EarlyStopping::percentile)
+      .def_readonly("relative_width", &EarlyStopping::relative_width)
+      .def_readonly("confidence", &EarlyStopping::confidence)
+      .def_readonly("max_duration_ms", &EarlyStopping::max_duration_ms)
+      .def_readonly("check_interval_ms", &EarlyStopping::check_interval_ms)
+      .def("__repr__", [](const EarlyStopping& e) {
+          return py::str("EarlyStopping(percentile={}, relative_width={}, confidence={}, max_duration_ms={}, check_interval_ms={})")
+              .format(e.percentile, e.relative_width, e.confidence, e.max_duration_ms, e.check_interval_ms);
+      });
+
     py::class_<ServerLoadGen, std::shared_ptr<ServerLoadGen>>(m, "ServerLoadGen")
-      .def(py::init<std::shared_ptr<PerfResult> /* result */, float /* target_qps */, int64_t /* min_query_cnt = 100 */, int64_t /* min_duration_ms = 10000 */>(),
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, float /* target_qps */, int64_t /* min_query_cnt = 100 */, int64_t /* min_duration_ms = 10000 */, std::shared_ptr<ArrivalProcess> /* arrival = None */>(),
            py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
            py::arg("target_qps"),
            py::arg("min_query_count") = 100,
-           py::arg("min_duration_ms") = 10000)
+           py::arg("min_duration_ms") = 10000,
+           py::arg("arrival") = py::none())
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, const QpsSchedule& /* schedule */, int64_t /* min_query_cnt = 100 */, int64_t /* min_duration_ms = 10000 */, std::shared_ptr<ArrivalProcess> /* arrival = None */>(),
+           py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
+           py::arg("schedule"),
+           py::arg("min_query_count") = 100,
+           py::arg("min_duration_ms") = 10000,
+           py::arg("arrival") = py::none())
       .def(
         "issue_query",
         &ServerLoadGen::IssueQuery,
@@ -64,7 +182,12 @@ PYBIND11_MODULE(load_gen_c, m) {
         "queries",
         [](ServerLoadGen& s) { return ServerLoadGenIterator(s); },
         py::keep_alive<0, 1>() /* Essential: keep object alive while iterator exists */)
+      .def("issue_query_batch", &IssueQueryBatch<ServerLoadGen>)
       .def("count_issued", &ServerLoadGen::CountIssued)
+      .def("set_early_stopping", &ServerLoadGen::SetEarlyStopping, py::arg("early_stopping"))
+      .def("is_converged", &ServerLoadGen::IsConverged)
+      .def("stop", &ServerLoadGen::Stop)
+      .def("is_stopped", &ServerLoadGen::IsStopped)
       .def("get_issued_qps", &ServerLoadGen::GetIssuedQPS)
       .def(
         "test_qps",
@@ -95,6 +218,7 @@ PYBIND11_MODULE(load_gen_c, m) {
     py::class_<SingleStreamLoadGen, std::shared_ptr<SingleStreamLoadGen>>(m, "SingleStreamLoadGen")
       .def(py::init<std::shared_ptr<PerfResult> /* result */, int64_t /* min_query_cnt = 100 */, int64_t /* min_duration_ms = 10000 */>(),
            py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
            py::arg("min_query_count") = 100,
            py::arg("min_duration_ms") = 10000)
       .def(
@@ -106,30 +230,367 @@ PYBIND11_MODULE(load_gen_c, m) {
         "queries",
         [](SingleStreamLoadGen& s) { return SingleStreamLoadGenIterator(s); },
         py::keep_alive<0, 1>() /* Essential: keep object alive while iterator exists */)
+      .def("issue_query_batch", &IssueQueryBatch<SingleStreamLoadGen>)
       .def("count_issued", &SingleStreamLoadGen::CountIssued)
+      .def("set_early_stopping", &SingleStreamLoadGen::SetEarlyStopping, py::arg("early_stopping"))
+      .def("is_converged", &SingleStreamLoadGen::IsConverged)
+      .def("stop", &SingleStreamLoadGen::Stop)
+      .def("is_stopped", &SingleStreamLoadGen::IsStopped)
       .def("get_issued_qps", &SingleStreamLoadGen::GetIssuedQPS);
 
+    py::class_<ClosedLoopLoadGenIterator>(m, "ClosedLoopLoadGenIterator")
+      .def(
+        "__iter__", [](ClosedLoopLoadGenIterator& it) -> ClosedLoopLoadGenIterator& { return it; }, py::call_guard<py::gil_scoped_release>())
+      .def("__next__", &ClosedLoopLoadGenIterator::next, py::call_guard<py::gil_scoped_release>());
+
+    py::class_<ClosedLoopLoadGen, std::shared_ptr<ClosedLoopLoadGen>>(m, "ClosedLoopLoadGen")
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, int64_t /* concurrency = 1 */, int64_t /* min_query_cnt = 100 */, int64_t /* min_duration_ms = 10000 */>(),
+           py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
+           py::arg("concurrency") = 1,
+           py::arg("min_query_count") = 100,
+           py::arg("min_duration_ms") = 10000)
+      .def(
+        "issue_query",
+        &ClosedLoopLoadGen::IssueQuery,
+        py::return_value_policy::reference,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "queries",
+        [](ClosedLoopLoadGen& s) { return ClosedLoopLoadGenIterator(s); },
+        py::keep_alive<0, 1>() /* Essential: keep object alive while iterator exists */)
+      .def("issue_query_batch", &IssueQueryBatch<ClosedLoopLoadGen>)
+      .def("count_issued", &ClosedLoopLoadGen::CountIssued)
+      .def("set_early_stopping", &ClosedLoopLoadGen::SetEarlyStopping, py::arg("early_stopping"))
+      .def("is_converged", &ClosedLoopLoadGen::IsConverged)
+      .def("stop", &ClosedLoopLoadGen::Stop)
+      .def("is_stopped", &ClosedLoopLoadGen::IsStopped)
+      .def("count_outstanding", &ClosedLoopLoadGen::CountOutstanding)
+      .def("get_concurrency", &ClosedLoopLoadGen::GetConcurrency)
+      .def("get_issued_qps", &ClosedLoopLoadGen::GetIssuedQPS);
+
+    py::class_<OfflineLoadGenIterator>(m, "OfflineLoadGenIterator")
+      .def(
+        "__iter__", [](OfflineLoadGenIterator& it) -> OfflineLoadGenIterator& { return it; }, py::call_guard<py::gil_scoped_release>())
+      .def("__next__", &OfflineLoadGenIterator::next, py::call_guard<py::gil_scoped_release>());
+
+    py::class_<OfflineLoadGen, std::shared_ptr<OfflineLoadGen>>(m, "OfflineLoadGen")
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, int64_t /* query_count = 1000 */>(),
+           py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
+           py::arg("query_count") = 1000)
+      .def(
+        "issue_query",
+        &OfflineLoadGen::IssueQuery,
+        py::return_value_policy::reference,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "queries",
+        [](OfflineLoadGen& s) { return OfflineLoadGenIterator(s); },
+        py::keep_alive<0, 1>() /* Essential: keep object alive while iterator exists */)
+      .def("issue_query_batch", &IssueQueryBatch<OfflineLoadGen>)
+      .def("count_issued", &OfflineLoadGen::CountIssued)
+      .def("get_issued_qps", &OfflineLoadGen::GetIssuedQPS);
+
+    py::class_<MultiStreamLoadGenIterator>(m, "MultiStreamLoadGenIterator")
+      .def(
+        "__iter__", [](MultiStreamLoadGenIterator& it) -> MultiStreamLoadGenIterator& { return it; }, py::call_guard<py::gil_scoped_release>())
+      .def("__next__", &MultiStreamLoadGenIterator::next, py::call_guard<py::gil_scoped_release>());
+
+    py::class_<MultiStreamLoadGen, std::shared_ptr<MultiStreamLoadGen>>(m, "MultiStreamLoadGen")
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, int64_t /* samples_per_frame */, double /* frame_interval_ms */, int64_t /* min_query_cnt = 100 */, int64_t /* min_duration_ms = 10000 */>(),
+           py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
+           py::arg("samples_per_frame"),
+           py::arg("frame_interval_ms"),
+           py::arg("min_query_count") = 100,
+           py::arg("min_duration_ms") = 10000)
+      .def(
+        "issue_query",
+        &MultiStreamLoadGen::IssueQuery,
+        py::return_value_policy::reference,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "queries",
+        [](MultiStreamLoadGen& s) { return MultiStreamLoadGenIterator(s); },
+        py::keep_alive<0, 1>() /* Essential: keep object alive while iterator exists */)
+      .def("issue_query_batch", &IssueQueryBatch<MultiStreamLoadGen>)
+      .def("count_issued", &MultiStreamLoadGen::CountIssued)
+      .def("set_early_stopping", &MultiStreamLoadGen::SetEarlyStopping, py::arg("early_stopping"))
+      .def("is_converged", &MultiStreamLoadGen::IsConverged)
+      .def("stop", &MultiStreamLoadGen::Stop)
+      .def("is_stopped", &MultiStreamLoadGen::IsStopped)
+      .def("count_frames", &MultiStreamLoadGen::CountFrames)
+      .def("get_issued_qps", &MultiStreamLoadGen::GetIssuedQPS);
+
+    py::class_<TraceLoadGenIterator>(m, "TraceLoadGenIterator")
+      .def(
+        "__iter__", [](TraceLoadGenIterator& it) -> TraceLoadGenIterator& { return it; }, py::call_guard<py::gil_scoped_release>())
+      .def("__next__", &TraceLoadGenIterator::next, py::call_guard<py::gil_scoped_release>());
+
+    py::class_<TraceLoadGen, std::shared_ptr<TraceLoadGen>>(m, "TraceLoadGen")
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, const std::string& /* trace_file */, double /* time_scale = 1.0 */, bool /* with_index = false */>(),
+           py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
+           py::arg("trace_file"),
+           py::arg("time_scale") = 1.0,
+           py::arg("with_index") = false)
+      .def(py::init<std::shared_ptr<PerfResult> /* result */, std::vector<int64_t> /* offsets_us */, std::vector<int64_t> /* indices = {} */, double /* time_scale = 1.0 */>(),
+           py::arg("result"),
+           py::keep_alive<1, 2>() /* the load gen holds a non-owning pointer to the result */,
+           py::arg("offsets_us"),
+           py::arg("indices") = std::vector<int64_t>(),
+           py::arg("time_scale") = 1.0)
+      .def(
+        "issue_query",
+        &TraceLoadGen::IssueQuery,
+        py::return_value_policy::reference,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "queries",
+        [](TraceLoadGen& s) { return TraceLoadGenIterator(s); },
+        py::keep_alive<0, 1>() /* Essential: keep object alive while iterator exists */)
+      .def("issue_query_batch", &IssueQueryBatch<TraceLoadGen>)
+      .def("count_issued", &TraceLoadGen::CountIssued)
+      .def("count_entries", &TraceLoadGen::CountEntries)
+      .def("get_issued_qps", &TraceLoadGen::GetIssuedQPS)
+      .def_static("read_trace", &TraceLoadGen::ReadTrace, py::arg("trace_file"), py::arg("with_index") = false);
+
+    py::class_<LatencyHistogram, std::shared_ptr<LatencyHistogram>>(m, "LatencyHistogram")
+      .def(py::init<int /* significant_digits = 3 */, int64_t /* max_latency_ns */>(),
+           py::arg("significant_digits") = 3,
+           py::arg("max_latency_ns") = 3600LL * 1000 * 1000 * 1000)
+      .def("record",
+           static_cast<void (LatencyHistogram::*)(int64_t, int64_t)>(&LatencyHistogram::Record),
+           py::arg("latency_ns"),
+           py::arg("count") = 1)
+      .def("merge", &LatencyHistogram::Merge, py::arg("other"))
+      .def("reset", &LatencyHistogram::Reset)
+      .def("count", &LatencyHistogram::Count)
+      .def("significant_digits", &LatencyHistogram::SignificantDigits)
+      .def("get_percentile", &LatencyHistogram::GetPercentile, py::arg("percentile"))
+      .def(
+        "get_latencies",
+        &LatencyHistogram::GetLatencies,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true);
+
+    m.def("clock_ns", &PerfResult::ClockNs, "the monotonic clock of issued_at in nanoseconds, shared by all processes of the machine.");
+
+    py::class_<PerfResult::Window>(m, "PerfResultWindow")
+      .def_readonly("index", &PerfResult::Window::index)
+      .def_readonly("start_ms", &PerfResult::Window::start_ms)
+      .def_readonly("duration_ms", &PerfResult::Window::duration_ms)
+      .def_readonly("num_issued", &PerfResult::Window::num_issued)
+      .def_readonly("num_succeeded", &PerfResult::Window::num_succeeded)
+      .def_readonly("num_failed", &PerfResult::Window::num_failed)
+      .def_readonly("qps", &PerfResult::Window::qps)
+      .def_readonly("latencies", &PerfResult::Window::latencies);
+
     py::class_<PerfResult, std::shared_ptr<PerfResult>>(m, "PerfResult")
-      .def(py::init<>())
+      .def(py::init<bool /* histogram = false */, int /* significant_digits = 3 */>(),
+           py::arg("histogram") = false,
+           py::arg("significant_digits") = 3)
       .def("add_query",
            static_cast<void (PerfResult::*)(std::shared_ptr<Query>)>(&PerfResult::AddQuery),
            py::arg("query"),
            py::call_guard<py::gil_scoped_release>())
       .def(
         "complete_query",
-        static_cast<void (PerfResult::*)(int64_t, bool, float)>(&PerfResult::CompleteQuery),
+        static_cast<void (PerfResult::*)(int64_t, bool, float, int64_t, int64_t, int64_t)>(&PerfResult::CompleteQuery),
         py::arg("id"),
         py::arg("error")=false,
         py::arg("latency_ms") = -1.0,
+        py::arg("dequeued_at_ns") = -1,
+        py::arg("started_at_ns") = -1,
+        py::arg("finished_at_ns") = -1,
         py::call_guard<py::gil_scoped_release>())
+      .def(
+        "complete_queries",
+        [](PerfResult& r, py::array_t<int64_t, py::array::c_style | py::array::forcecast> ids, py::object errors, py::object latency_ms,
+           py::object dequeued_at_ns, py::object started_at_ns, py::object finished_at_ns) {
+            std::vector<int64_t> ids_vec(ids.data(), ids.data() + ids.size());
+            std::vector<bool> errors_vec;
+            if (!errors.is_none()) {
+                auto arr = py::array_t<bool, py::array::c_style | py::array::forcecast>::ensure(errors);
+                if (!arr) {
+                    throw py::type_error("complete_queries: error must be an array");
+                }
+                errors_vec.assign(arr.data(), arr.data() + arr.size());
+            }
+            std::vector<float> latency_ms_vec;
+            if (!latency_ms.is_none()) {
+                auto arr = py::array_t<float, py::array::c_style | py::array::forcecast>::ensure(latency_ms);
+                if (!arr) {
+                    throw py::type_error("complete_queries: latency_ms must be an array");
+                }
+                latency_ms_vec.assign(arr.data(), arr.data() + arr.size());
+            }
+            auto timestamps = [](py::object ts, const char* name) {
+                std::vector<int64_t> res;
+                if (!ts.is_none()) {
+                    auto arr = py::array_t<int64_t, py::array::c_style | py::array::forcecast>::ensure(ts);
+                    if (!arr) {
+                        throw py::type_error(std::string("complete_queries: ") + name + " must be an array");
+                    }
+                    res.assign(arr.data(), arr.data() + arr.size());
+                }
+                return res;
+            };
+            auto dequeued_at_vec = timestamps(dequeued_at_ns, "dequeued_at_ns");
+            auto started_at_vec = timestamps(started_at_ns, "started_at_ns");
+            auto finished_at_vec = timestamps(finished_at_ns, "finished_at_ns");
+            py::gil_scoped_release release;
+            r.CompleteQueries(ids_vec, errors_vec, latency_ms_vec, dequeued_at_vec, started_at_vec, finished_at_vec);
+        },
+        py::arg("ids"),
+        py::arg("error") = py::none(),
+        py::arg("latency_ms") = py::none(),
+        py::arg("dequeued_at_ns") = py::none(),
+        py::arg("started_at_ns") = py::none(),
+        py::arg("finished_at_ns") = py::none())
       .def_static(
         "complete_query_args",
-        []() -> std::vector<std::string> { return { "id", "error", "latency_ms" }; })
+        []() -> std::vector<std::string> { return { "id", "error", "latency_ms", "dequeued_at_ns", "started_at_ns", "finished_at_ns" }; })
       .def(
         "get_actual_qps",
         &PerfResult::GetActualQPS)
+      .def("get_throughput", &PerfResult::GetThroughput)
+      .def(
+        "wait_all_completed",
+        &PerfResult::WaitAllCompleted,
+        py::arg("timeout_ms") = -1,
+        py::call_guard<py::gil_scoped_release>())
       .def("count_succeeded", &PerfResult::CountSucceeded)
       .def("count_failed", &PerfResult::CountFailed)
+      .def(
+        "get_response_latencies",
+        &PerfResult::GetResponseLatencies,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_issue_lags",
+        &PerfResult::GetIssueLags,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_dispatch_delays",
+        &PerfResult::GetDispatchDelays,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_worker_queue_delays",
+        &PerfResult::GetWorkerQueueDelays,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_service_times",
+        &PerfResult::GetServiceTimes,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_return_delays",
+        &PerfResult::GetReturnDelays,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_group_latencies",
+        &PerfResult::GetGroupLatencies,
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def("get_tags", &PerfResult::GetTags)
+      .def(
+        "get_tag_latencies",
+        &PerfResult::GetTagLatencies,
+        py::arg("tag"),
+        py::arg("percentiles"),
+        py::arg("min") = true,
+        py::arg("avg") = true,
+        py::arg("max") = true,
+        py::call_guard<py::gil_scoped_release>())
+      .def("count_tag_issued", &PerfResult::CountTagIssued, py::arg("tag"))
+      .def("count_tag_succeeded", &PerfResult::CountTagSucceeded, py::arg("tag"))
+      .def("count_tag_failed", &PerfResult::CountTagFailed, py::arg("tag"))
+      .def("get_tag_issued_qps", &PerfResult::GetTagIssuedQPS, py::arg("tag"))
+      .def("get_tag_actual_qps", &PerfResult::GetTagActualQPS, py::arg("tag"))
+      .def("count_groups", &PerfResult::CountGroups)
+      .def("count_missed_deadlines", &PerfResult::CountMissedDeadlines)
+      .def("set_window", &PerfResult::SetWindow, py::arg("window_ms"), py::arg("percentiles"))
+      .def("get_windows", &PerfResult::GetWindows, py::arg("since") = 0, py::call_guard<py::gil_scoped_release>())
+      .def("set_recording", &PerfResult::SetRecording, py::arg("enabled"))
+      .def(
+        "take_records",
+        [](PerfResult& r) {
+            std::vector<PerfResult::Record> records;
+            {
+                py::gil_scoped_release release;
+                records = r.TakeRecords();
+            }
+            // one numpy array per field, the records are columns for vectorized analysis.
+            auto n = static_cast<py::ssize_t>(records.size());
+            py::dict columns;
+            auto int64_column = [&](const char* name, int64_t PerfResult::Record::*field) {
+                py::array_t<int64_t> column(n);
+                auto ptr = column.mutable_data();
+                for (py::ssize_t i = 0; i < n; i++) {
+                    ptr[i] = records[i].*field;
+                }
+                columns[name] = column;
+            };
+            int64_column("id", &PerfResult::Record::id);
+            int64_column("index", &PerfResult::Record::index);
+            int64_column("tag", &PerfResult::Record::tag);
+            int64_column("group", &PerfResult::Record::group);
+            int64_column("scheduled_at_ns", &PerfResult::Record::scheduled_at_ns);
+            int64_column("issued_at_ns", &PerfResult::Record::issued_at_ns);
+            int64_column("dequeued_at_ns", &PerfResult::Record::dequeued_at_ns);
+            int64_column("started_at_ns", &PerfResult::Record::started_at_ns);
+            int64_column("finished_at_ns", &PerfResult::Record::finished_at_ns);
+            int64_column("completed_at_ns", &PerfResult::Record::completed_at_ns);
+            py::array_t<double> latency_ms(n);
+            py::array_t<bool> error(n);
+            auto latency_ptr = latency_ms.mutable_data();
+            auto error_ptr = error.mutable_data();
+            for (py::ssize_t i = 0; i < n; i++) {
+                latency_ptr[i] = records[i].latency_ms;
+                error_ptr[i] = records[i].error;
+            }
+            columns["latency_ms"] = latency_ms;
+            columns["error"] = error;
+            return columns;
+        },
+        "the records of the queries completed since the last call, as a dict of numpy arrays.")
+      .def("is_histogram_mode", &PerfResult::IsHistogramMode)
+      .def("get_histogram", &PerfResult::GetHistogram, py::call_guard<py::gil_scoped_release>())
+      .def(
+        "get_percentile_ci",
+        &PerfResult::GetPercentileCI,
+        py::arg("percentile"),
+        py::arg("confidence") = 0.95,
+        py::call_guard<py::gil_scoped_release>())
       .def(
         "get_latencies",
         &PerfResult::GetLatencies,
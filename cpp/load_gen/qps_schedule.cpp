@@ -0,0 +1,102 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include <cmath>
+#include <stdexcept>
+#include "qps_schedule.h"
+
+QpsSchedule::QpsSchedule(std::vector<Step> steps)
+  : steps_(std::move(steps)) {
+    if (steps_.empty()) {
+        throw std::invalid_argument("QpsSchedule: at least one step is required");
+    }
+    for (const auto& step : steps_) {
+        if (step.duration_ms <= 0 || step.begin_qps <= 0 || step.end_qps <= 0) {
+            throw std::invalid_argument("QpsSchedule: durations and qps of all steps must be positive");
+        }
+    }
+}
+
+QpsSchedule QpsSchedule::Constant(double qps) {
+    return QpsSchedule({ { 1.0, qps, qps } });
+}
+
+QpsSchedule QpsSchedule::Ramp(double start_qps, double end_qps, double duration_ms, int64_t num_steps) {
+    if (num_steps <= 0) {
+        throw std::invalid_argument("QpsSchedule: num_steps must be positive");
+    }
+    std::vector<Step> steps;
+    double step_ms = duration_ms / num_steps;
+    for (int64_t i = 0; i < num_steps; i++) {
+        double begin_qps = start_qps + (end_qps - start_qps) * i / num_steps;
+        double end_qps_of_step = start_qps + (end_qps - start_qps) * (i + 1) / num_steps;
+        steps.push_back({ step_ms, begin_qps, end_qps_of_step });
+    }
+    return QpsSchedule(steps);
+}
+
+QpsSchedule QpsSchedule::Staircase(std::vector<double> qps, std::vector<double> durations_ms) {
+    if (qps.size() != durations_ms.size()) {
+        throw std::invalid_argument("QpsSchedule: qps and durations_ms must have the same length");
+    }
+    std::vector<Step> steps;
+    for (size_t i = 0; i < qps.size(); i++) {
+        steps.push_back({ durations_ms[i], qps[i], qps[i] });
+    }
+    return QpsSchedule(steps);
+}
+
+QpsSchedule QpsSchedule::Sinusoid(double mean_qps, double amplitude_qps, double period_ms, double duration_ms, int64_t num_steps) {
+    if (num_steps <= 0 || period_ms <= 0) {
+        throw std::invalid_argument("QpsSchedule: num_steps and period_ms must be positive");
+    }
+    const double pi = 3.14159265358979323846;
+    auto qps_at = [&](double t) { return mean_qps + amplitude_qps * std::sin(2 * pi * t / period_ms); };
+    std::vector<Step> steps;
+    double step_ms = duration_ms / num_steps;
+    for (int64_t i = 0; i < num_steps; i++) {
+        steps.push_back({ step_ms, qps_at(step_ms * i), qps_at(step_ms * (i + 1)) });
+    }
+    return QpsSchedule(steps);
+}
+
+double QpsSchedule::QpsAt(double elapsed_ms) const {
+    for (const auto& step : steps_) {
+        if (elapsed_ms < step.duration_ms) {
+            return step.begin_qps + (step.end_qps - step.begin_qps) * elapsed_ms / step.duration_ms;
+        }
+        elapsed_ms -= step.duration_ms;
+    }
+    return steps_.back().end_qps;
+}
+
+int64_t QpsSchedule::StepAt(double elapsed_ms) const {
+    for (size_t i = 0; i < steps_.size(); i++) {
+        if (elapsed_ms < steps_[i].duration_ms) {
+            return static_cast<int64_t>(i);
+        }
+        elapsed_ms -= steps_[i].duration_ms;
+    }
+    return static_cast<int64_t>(steps_.size()) - 1;
+}
+
+int64_t QpsSchedule::NumSteps() const {
+    return static_cast<int64_t>(steps_.size());
+}
+
+double QpsSchedule::GetDurationMs() const {
+    double duration_ms = 0;
+    for (const auto& step : steps_) {
+        duration_ms += step.duration_ms;
+    }
+    return duration_ms;
+}
+
+double QpsSchedule::GetStepQps(int64_t step) const {
+    const Step& s = steps_.at(static_cast<size_t>(step));
+    return (s.begin_qps + s.end_qps) / 2;
+}
+
+const std::vector<QpsSchedule::Step>& QpsSchedule::GetSteps() const {
+    return steps_;
+}
@@ -0,0 +1,43 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <cstdint>
+#include <vector>
+
+// A piecewise-linear target QPS over the run. Each step has a duration and
+// ramps linearly from begin_qps to end_qps. Queries are tagged with the index
+// of the step they are issued in, so one run yields a latency/throughput
+// curve. After the last step, its end_qps is kept until the run is finished.
+class QpsSchedule {
+  public:
+    struct Step {
+        double duration_ms;
+        double begin_qps;
+        double end_qps;
+    };
+
+    QpsSchedule() = default;
+    QpsSchedule(std::vector<Step> steps);
+    virtual ~QpsSchedule() = default;
+
+    static QpsSchedule Constant(double qps);
+    // linear ramp from start_qps to end_qps, split into num_steps tagged steps.
+    static QpsSchedule Ramp(double start_qps, double end_qps, double duration_ms, int64_t num_steps = 10);
+    // staircase, hold qps[i] for durations_ms[i].
+    static QpsSchedule Staircase(std::vector<double> qps, std::vector<double> durations_ms);
+    // mean_qps + amplitude_qps * sin(2*pi*t/period_ms), approximated by num_steps linear steps.
+    static QpsSchedule Sinusoid(double mean_qps, double amplitude_qps, double period_ms, double duration_ms, int64_t num_steps = 24);
+
+    double QpsAt(double elapsed_ms) const;
+    int64_t StepAt(double elapsed_ms) const;
+    int64_t NumSteps() const;
+    double GetDurationMs() const;
+    // the average target qps of the step.
+    double GetStepQps(int64_t step) const;
+    const std::vector<Step>& GetSteps() const;
+
+  private:
+    std::vector<Step> steps_;
+};
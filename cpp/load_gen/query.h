@@ -9,10 +9,23 @@
 #include <chrono>
 #include <memory>
 #include <future>
+#include <functional>
 
 struct Query {
     int64_t id;
-    std::chrono::high_resolution_clock::time_point issued_at;
+    std::chrono::steady_clock::time_point issued_at;
+    // when the load gen intended to issue the query, same as issued_at unless the load gen runs on a schedule.
+    std::chrono::steady_clock::time_point scheduled_at;
     std::chrono::nanoseconds latency;
     std::shared_ptr<std::promise<bool>> completed;
+    // called by PerfResult once the query is completed.
+    std::function<void()> on_completed;
+    // index of the query payload to send, -1 if the runner is free to choose one.
+    int64_t index = -1;
+    // tag of the load phase the query is issued in (e.g. step of a qps schedule), -1 if untagged.
+    int64_t tag = -1;
+    // queries issued together (e.g. samples of one frame) share the same group,
+    // the group is completed when all of its queries are completed.
+    int64_t group = -1;
+    std::chrono::steady_clock::time_point deadline;
 };
@@ -5,29 +5,61 @@
 #include <iostream>
 #include "server_load_gen.h"
 
-ServerLoadGen::ServerLoadGen(std::shared_ptr<PerfResult> result, float target_qps, int64_t min_query_count, int64_t min_duration_ms)
+ServerLoadGen::ServerLoadGen(std::shared_ptr<PerfResult> result, float target_qps, int64_t min_query_count, int64_t min_duration_ms,
+                             std::shared_ptr<ArrivalProcess> arrival)
+  : ServerLoadGen(result, QpsSchedule::Constant(target_qps), min_query_count, min_duration_ms, arrival) {
+}
+
+ServerLoadGen::ServerLoadGen(std::shared_ptr<PerfResult> result, const QpsSchedule& schedule, int64_t min_query_count, int64_t min_duration_ms,
+                             std::shared_ptr<ArrivalProcess> arrival)
   : LoadGen(result, min_query_count, min_duration_ms)
-  , target_qps_(target_qps)
-  , exp_(target_qps_) {
-    auto now = std::chrono::high_resolution_clock::now();
-    next_schedule_time_ = now + std::chrono::duration_cast<std::chrono::nanoseconds>(
-                                  std::chrono::duration<double>(exp_(rng_)));
+  , schedule_(schedule)
+  , arrival_(arrival ? arrival : ArrivalProcess::Poisson()) {
+    arrival_->Reset();
+    auto now = std::chrono::steady_clock::now();
+    schedule_start_time_ = now;
+    next_schedule_time_ = now;
+    next_schedule_time_ += NextInterval();
+}
+
+std::chrono::nanoseconds ServerLoadGen::NextInterval() {
+    // the rate of the arrival process follows the schedule at the current schedule time.
+    double elapsed_ms = std::chrono::duration<double, std::milli>(next_schedule_time_ - schedule_start_time_).count();
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(
+      std::chrono::duration<double>(arrival_->NextInterval(rng_, schedule_.QpsAt(elapsed_ms))));
+}
+
+std::shared_ptr<Query> ServerLoadGen::IssueScheduledQuery(std::chrono::steady_clock::time_point now) {
+    if (CountIssued() != 0 && IsFinished(now)) {
+        return LoadGen::IssueQuery();
+    }
+
+    std::shared_ptr<Query> q = std::make_shared<Query>();
+    q->issued_at = now;
+    q->scheduled_at = next_schedule_time_;
+    // only tag queries if there are multiple steps to tell apart.
+    if (schedule_.NumSteps() > 1) {
+        double elapsed_ms = std::chrono::duration<double, std::milli>(next_schedule_time_ - schedule_start_time_).count();
+        q->tag = schedule_.StepAt(elapsed_ms);
+    }
+    return AddQuery(q);
 }
 
 std::list<std::shared_ptr<Query>> ServerLoadGen::IssueQuery() {
-    auto now = std::chrono::high_resolution_clock::now();
+    auto now = std::chrono::steady_clock::now();
 
     // for the first query
     if (CountIssued() == 0) {
-        next_schedule_time_ = now + std::chrono::duration_cast<std::chrono::nanoseconds>(
-                                      std::chrono::duration<double>(exp_(rng_)));
+        arrival_->Reset();
+        schedule_start_time_ = now;
+        next_schedule_time_ = now;
+        next_schedule_time_ += NextInterval();
     }
     std::list<std::shared_ptr<Query>> res;
 
     while (next_schedule_time_ <= now) {
-        res.push_back(LoadGen::IssueQuery());
-        next_schedule_time_ += std::chrono::duration_cast<std::chrono::nanoseconds>(
-          std::chrono::duration<double>(exp_(rng_)));
+        res.push_back(IssueScheduledQuery(now));
+        next_schedule_time_ += NextInterval();
     }
 
     if (res.size() != 0) {
@@ -36,9 +68,8 @@ std::list<std::shared_ptr<Query>> ServerLoadGen::IssueQuery() {
 
     if (now < next_schedule_time_) {
         std::this_thread::sleep_until(next_schedule_time_);
-        res.push_back(LoadGen::IssueQuery());
-        next_schedule_time_ += std::chrono::duration_cast<std::chrono::nanoseconds>(
-          std::chrono::duration<double>(exp_(rng_)));
+        res.push_back(IssueScheduledQuery(std::chrono::steady_clock::now()));
+        next_schedule_time_ += NextInterval();
     }
     
     return res;
@@ -50,4 +81,4 @@ double ServerLoadGen::TestQPS() {
         qs = IssueQuery();
     } while ((*qs.rbegin())->id >= 0);
     return GetIssuedQPS();
-}
\ No newline at end of file
+}
@@ -5,16 +5,26 @@
 
 #include <list>
 #include "load_gen.h"
+#include "qps_schedule.h"
+#include "arrival_process.h"
 
 class ServerLoadGen:public LoadGen {
   public:
-    ServerLoadGen(std::shared_ptr<PerfResult> result, float target_qps, int64_t min_query_count = 100, int64_t min_duration_ms = 10000);
+    // arrival defaults to a Poisson process if not given.
+    ServerLoadGen(std::shared_ptr<PerfResult> result, float target_qps, int64_t min_query_count = 100, int64_t min_duration_ms = 10000,
+                  std::shared_ptr<ArrivalProcess> arrival = nullptr);
+    ServerLoadGen(std::shared_ptr<PerfResult> result, const QpsSchedule& schedule, int64_t min_query_count = 100, int64_t min_duration_ms = 10000,
+                  std::shared_ptr<ArrivalProcess> arrival = nullptr);
     virtual ~ServerLoadGen() = default;
     std::list<std::shared_ptr<Query>> IssueQuery();
     double TestQPS();
 
   private:
-    float target_qps_;  
-    std::exponential_distribution<double> exp_;
-    std::chrono::high_resolution_clock::time_point next_schedule_time_;
-};
\ No newline at end of file
+    std::chrono::nanoseconds NextInterval();
+    std::shared_ptr<Query> IssueScheduledQuery(std::chrono::steady_clock::time_point now);
+
+    QpsSchedule schedule_;
+    std::shared_ptr<ArrivalProcess> arrival_;
+    std::chrono::steady_clock::time_point schedule_start_time_;
+    std::chrono::steady_clock::time_point next_schedule_time_;
+};
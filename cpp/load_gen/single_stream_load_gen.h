@@ -4,9 +4,10 @@
 #pragma once
 
 #include <list>
-#include "load_gen.h"
+#include "closed_loop_load_gen.h"
 
-class SingleStreamLoadGen:public LoadGen {
+// SingleStream scenario: a closed loop with exactly one outstanding query.
+class SingleStreamLoadGen:public ClosedLoopLoadGen {
   public:
     SingleStreamLoadGen(
         std::shared_ptr<PerfResult> result,
@@ -17,8 +18,4 @@ class SingleStreamLoadGen:public LoadGen {
       int64_t min_query_count = 100,
       int64_t min_duration_ms = 10000);
     virtual ~SingleStreamLoadGen() = default;
-    std::list<std::shared_ptr<Query>> IssueQuery();
-
-  private: 
-    std::future<bool> pre_query_completed_;
-};
\ No newline at end of file
+};
@@ -0,0 +1,124 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#include <thread>
+#include <algorithm>
+#include <fstream>
+#include <sstream>
+#include <stdexcept>
+#include "trace_load_gen.h"
+
+TraceLoadGen::TraceLoadGen(std::shared_ptr<PerfResult> result, const std::string& trace_file, double time_scale, bool with_index)
+  : TraceLoadGen(result, ReadTrace(trace_file, with_index), time_scale) {
+}
+
+TraceLoadGen::TraceLoadGen(std::shared_ptr<PerfResult> result, std::vector<int64_t> offsets_us, std::vector<int64_t> indices, double time_scale)
+  : TraceLoadGen(result, std::make_pair(std::move(offsets_us), std::move(indices)), time_scale) {
+}
+
+TraceLoadGen::TraceLoadGen(std::shared_ptr<PerfResult> result, std::pair<std::vector<int64_t>, std::vector<int64_t>> trace, double time_scale)
+  : LoadGen(result, static_cast<int64_t>(trace.first.size()), 0)
+  , offsets_us_(std::move(trace.first))
+  , indices_(std::move(trace.second))
+  , time_scale_(time_scale)
+  , next_entry_(0) {
+    if (offsets_us_.empty()) {
+        throw std::invalid_argument("TraceLoadGen: the trace is empty");
+    }
+    if (!indices_.empty() && indices_.size() != offsets_us_.size()) {
+        throw std::invalid_argument("TraceLoadGen: offsets and indices must have the same length");
+    }
+    if (time_scale_ <= 0) {
+        throw std::invalid_argument("TraceLoadGen: time_scale must be positive");
+    }
+}
+
+std::pair<std::vector<int64_t>, std::vector<int64_t>> TraceLoadGen::ReadTrace(const std::string& trace_file, bool with_index) {
+    std::vector<int64_t> offsets_us;
+    std::vector<int64_t> indices;
+
+    auto ext_pos = trace_file.find_last_of('.');
+    std::string ext = ext_pos == std::string::npos ? "" : trace_file.substr(ext_pos);
+    if (ext == ".csv" || ext == ".txt") {
+        std::ifstream in(trace_file);
+        if (!in) {
+            throw std::runtime_error("TraceLoadGen: failed to open " + trace_file);
+        }
+
+        std::string line;
+        while (std::getline(in, line)) {
+            std::replace(line.begin(), line.end(), ',', ' ');
+            std::istringstream fields(line);
+            double offset_us;
+            // skip headers, comments and empty lines
+            if (!(fields >> offset_us)) {
+                continue;
+            }
+            int64_t index;
+            offsets_us.push_back(static_cast<int64_t>(offset_us));
+            indices.push_back((fields >> index) ? index : -1);
+        }
+    } else {
+        std::ifstream in(trace_file, std::ios::binary);
+        if (!in) {
+            throw std::runtime_error("TraceLoadGen: failed to open " + trace_file);
+        }
+
+        int64_t entry[2] = { 0, -1 };
+        std::streamsize entry_size = with_index ? sizeof(entry) : sizeof(entry[0]);
+        while (in.read(reinterpret_cast<char*>(entry), entry_size)) {
+            offsets_us.push_back(entry[0]);
+            indices.push_back(entry[1]);
+        }
+    }
+    return std::make_pair(std::move(offsets_us), std::move(indices));
+}
+
+std::chrono::steady_clock::time_point TraceLoadGen::ScheduleTime(size_t i) {
+    double offset_us = static_cast<double>(offsets_us_[i] - offsets_us_[0]) * time_scale_;
+    return trace_start_time_ + std::chrono::duration_cast<std::chrono::steady_clock::duration>(
+                                 std::chrono::duration<double, std::micro>(offset_us));
+}
+
+std::shared_ptr<Query> TraceLoadGen::IssueEntry(std::chrono::steady_clock::time_point now) {
+    std::shared_ptr<Query> q = std::make_shared<Query>();
+    q->issued_at = now;
+    q->scheduled_at = ScheduleTime(next_entry_);
+    if (!indices_.empty()) {
+        q->index = indices_[next_entry_];
+    }
+    next_entry_++;
+    return AddQuery(q);
+}
+
+std::list<std::shared_ptr<Query>> TraceLoadGen::IssueQuery() {
+    auto now = std::chrono::steady_clock::now();
+
+    // for the first query
+    if (CountIssued() == 0) {
+        trace_start_time_ = now;
+    }
+    std::list<std::shared_ptr<Query>> res;
+
+    // the whole trace is replayed.
+    if (next_entry_ >= offsets_us_.size()) {
+        res.push_back(LoadGen::IssueQuery());
+        return res;
+    }
+
+    while (next_entry_ < offsets_us_.size() && ScheduleTime(next_entry_) <= now) {
+        res.push_back(IssueEntry(now));
+    }
+
+    if (res.size() != 0) {
+        return res;
+    }
+
+    std::this_thread::sleep_until(ScheduleTime(next_entry_));
+    res.push_back(IssueEntry(std::chrono::steady_clock::now()));
+    return res;
+}
+
+int64_t TraceLoadGen::CountEntries() {
+    return static_cast<int64_t>(offsets_us_.size());
+}
@@ -0,0 +1,38 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT License.
+
+#pragma once
+
+#include <list>
+#include <string>
+#include <vector>
+#include <utility>
+#include "load_gen.h"
+
+// Replay recorded arrival times. The trace is either a text file (.csv/.txt)
+// with one `offset_us[,query_index]` per line, or a binary file of native
+// int64 offsets in microseconds (`offset_us, query_index` pairs if with_index).
+// Offsets are relative to the first entry and multiplied by time_scale, e.g.
+// time_scale=0.5 replays the trace twice as fast.
+class TraceLoadGen:public LoadGen {
+  public:
+    TraceLoadGen(std::shared_ptr<PerfResult> result, const std::string& trace_file, double time_scale = 1.0, bool with_index = false);
+    TraceLoadGen(std::shared_ptr<PerfResult> result, std::vector<int64_t> offsets_us, std::vector<int64_t> indices = {}, double time_scale = 1.0);
+    virtual ~TraceLoadGen() = default;
+    std::list<std::shared_ptr<Query>> IssueQuery();
+    int64_t CountEntries();
+
+    // read (offsets_us, indices) from a trace file, indices are -1 if not recorded.
+    static std::pair<std::vector<int64_t>, std::vector<int64_t>> ReadTrace(const std::string& trace_file, bool with_index = false);
+
+  private:
+    TraceLoadGen(std::shared_ptr<PerfResult> result, std::pair<std::vector<int64_t>, std::vector<int64_t>> trace, double time_scale);
+    std::chrono::steady_clock::time_point ScheduleTime(size_t i);
+    std::shared_ptr<Query> IssueEntry(std::chrono::steady_clock::time_point now);
+
+    std::vector<int64_t> offsets_us_;
+    std::vector<int64_t> indices_;
+    double time_scale_;
+    size_t next_entry_;
+    std::chrono::steady_clock::time_point trace_start_time_;
+};
@@ -2,4 +2,6 @@
 # Licensed under the MIT License.
 
 #from .mlperf_benchmark import MLPerfBenchmark
-from .server_model_runner import ServerModelRunner
\ No newline at end of file
+from .server_model_runner import ServerModelRunner
+from .sweep import Sweep
+from .records import QueryRecorder, load_records
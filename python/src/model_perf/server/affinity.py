@@ -0,0 +1,116 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import sys
+from pathlib import Path
+import psutil
+from ..logger import logger
+
+
+# environment variables read by common thread pools when they are created.
+thread_budget_env_vars = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def get_available_cpus():
+    ''' logical cpus this process may run on. '''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        return sorted(psutil.Process().cpu_affinity())
+    except (AttributeError, NotImplementedError):
+        return list(range(psutil.cpu_count()))
+
+
+def parse_cpu_list(text):
+    ''' parse a linux cpu list such as `0-3,8-11`. '''
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            begin, end = part.split('-')
+            cpus.extend(range(int(begin), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def get_cpu_domains(domain='numa'):
+    '''
+    Group the available cpus by NUMA node (`numa`) or by shared L3 cache (`l3`). The domains
+    are only known on Linux, otherwise all cpus are in a single domain.
+    '''
+    available = set(get_available_cpus())
+    groups = []
+    if sys.platform.startswith('linux') and domain == 'numa':
+        for node in sorted(Path('/sys/devices/system/node').glob('node[0-9]*'), key=lambda p: int(p.name[4:])):
+            groups.append(parse_cpu_list((node / 'cpulist').read_text()))
+    elif sys.platform.startswith('linux') and domain == 'l3':
+        for cpu in sorted(available):
+            shared = Path(f'/sys/devices/system/cpu/cpu{cpu}/cache/index3/shared_cpu_list')
+            if shared.exists():
+                group = parse_cpu_list(shared.read_text())
+                if group not in groups:
+                    groups.append(group)
+    elif domain not in ['numa', 'l3']:
+        raise ValueError(f'unknown cpu domain {domain}, choose from numa or l3')
+
+    groups = [[c for c in g if c in available] for g in groups]
+    groups = [g for g in groups if g]
+    covered = set(c for g in groups for c in g)
+    if available - covered:
+        groups.append(sorted(available - covered))
+    return groups
+
+
+def plan_affinity(num_workers, cores_per_worker=None, domain=None, node=None):
+    '''
+    Assign a disjoint set of cpus to each worker. With `domain` ('numa' or 'l3'), each worker
+    is packed into a single domain as long as its cpus fit in one, and with `node` all workers
+    are confined to that domain. By default the cpus are split evenly among workers.
+    '''
+    if domain is None and node is None:
+        domains = [get_available_cpus()]
+    else:
+        domains = get_cpu_domains(domain or 'numa')
+        if node is not None:
+            if node >= len(domains):
+                raise ValueError(f'cpu domain {node} does not exist, there are {len(domains)} domains')
+            domains = [domains[node]]
+
+    num_cpus = sum(len(d) for d in domains)
+    if cores_per_worker is None:
+        cores_per_worker = num_cpus // num_workers
+    if cores_per_worker < 1 or cores_per_worker * num_workers > num_cpus:
+        raise ValueError(f'cannot place {num_workers} workers with {cores_per_worker} cores each on {num_cpus} cpus')
+
+    plan = []
+    # first fill whole workers inside each domain, then place the rest across the leftovers.
+    leftovers = []
+    for cpus in domains:
+        while len(cpus) >= cores_per_worker and len(plan) < num_workers:
+            plan.append(cpus[:cores_per_worker])
+            cpus = cpus[cores_per_worker:]
+        leftovers.extend(cpus)
+    while len(plan) < num_workers:
+        plan.append(leftovers[:cores_per_worker])
+        leftovers = leftovers[cores_per_worker:]
+    return plan
+
+
+def set_affinity(cpus):
+    ''' pin the current process to `cpus`. '''
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    else:
+        try:
+            psutil.Process().cpu_affinity(cpus)
+        except (AttributeError, NotImplementedError):
+            logger.warning(f'cpu affinity is not supported on {sys.platform}, workers are not pinned')
+
+
+def set_thread_budget(num_threads):
+    ''' limit thread pools created after this call in the current process to `num_threads`. '''
+    for var in thread_budget_env_vars:
+        os.environ[var] = str(num_threads)
@@ -2,90 +2,182 @@
 # Licensed under the MIT License.
 
 import threading
+import collections
 import multiprocessing
 import asyncio
+import concurrent.futures
 from .worker import Worker
+from .load_gen import clock_ns
 from ..logger import logger
 
 
 class AsyncWorker(Worker):
-    def __init__(self, sut_cls, query_queue, response_queue, num_tasks=100):
-        super().__init__(sut_cls, query_queue, response_queue)
+    '''
+    Run up to `num_tasks` queries concurrently on an event loop. A reader thread blocks on the
+    query queue and hands messages over to the loop, and a task reports its completion from
+    its done callback, so the loop never polls. The reader only takes a message from the queue
+    while there are fewer than `num_tasks` running or pending queries, which leaves the rest to
+    other workers sharing the queue.
+
+    If the inference call of the sut is not a coroutine function, e.g. a blocking call that
+    releases the GIL, it is run on a pool of `executor_threads` threads, `num_tasks` by default.
+    '''
+    def __init__(self, sut_cls, query_queue, response_queue, num_tasks=100, executor_threads=None, **kwargs):
+        super().__init__(sut_cls, query_queue, response_queue, **kwargs)
         self.num_tasks = num_tasks
-        self.event_loop = asyncio.get_event_loop()
-        
+        self.executor_threads = executor_threads or num_tasks
+        self.executor = None
+        self.event_loop = asyncio.new_event_loop()
+        # set by the event loop when it can take more queries, see `read_queries`.
+        self.want_queries = threading.Event()
+        # `(query_id, query, dequeued_at_ns)` received but not started yet because of `num_tasks`.
+        self.pending_queries = collections.deque()
+        # worker timestamps of each running task, see `run_query`.
+        self.task_timestamps = {}
+        self.should_stop = False
+        self.completions = None
+        self.flush_handle = None
+
     def start(self):
-        running_tasks = set()
         pid = multiprocessing.current_process().pid
         tid = threading.get_ident()
-        
-        self.sut_obj = self.sut_cls(*self.sut_args[0], **self.sut_args[1])    
+        asyncio.set_event_loop(self.event_loop)
+
+        self.sut_obj = self.create_sut()
         if self.setup_call is not None:
             f = getattr(self.sut_obj, self.setup_call)
             if asyncio.iscoroutinefunction(f):
                 self.event_loop.run_until_complete(f())
             else:
                 f()
-            
+
         logger.info(f'sut {self.sut_obj} is hosted in process {pid} thread {tid} worker {self}')
         # notify the main thread that the sut is ready
         self.response_queue.put((None, 'model created', None))
-        inference_call = getattr(self.sut_obj, self.infer_call)
-        should_stop = False
-        while True:
-            try:              
-                while len(running_tasks) < self.num_tasks and not self.query_queue.empty():
-                    query_sample_id, query = self.query_queue.get()
-                    if query is None:
-                        query = (query_sample_id,)
-                    if query_sample_id is None:
-                        self.query_queue.put((query_sample_id, query))
-                        should_stop = True
-                        break
-                    new_task = self.event_loop.create_task(inference_call(*query), name=query_sample_id)
-                    running_tasks.add(new_task)
-                
-                if should_stop:
-                    for task in running_tasks:
-                        task.cancel()
-                    self.event_loop.stop()
-                    break
-                
-                if len(running_tasks) == 0:
-                    self.event_loop.run_until_complete(asyncio.sleep(0.1))
-                    continue
-                                   
-                finished, unfinished = self.event_loop.run_until_complete(
-                    asyncio.wait(running_tasks, return_when=asyncio.FIRST_COMPLETED, timeout=0.1))      
-                for task in finished:                   
-                    query_id = int(task.get_name())                        
-                    # If no unhandled exception was raised in the wrapped coroutine,
-                    # then a value of None is returned. Otherwise, exception is 
-                    # re-raised when calling the result() method and need to be handled.
-                    exception = task.exception()
-                    response = {'error': False}
-                    if exception is not None:
-                        response['error'] = True
-                        logger.warning(f'error happened during processing query {query_id} {query}', exc_info=exception)
-                    else:
-                        task_result = task.result()
-                        if task_result is dict:
-                            response.update(task_result)
-                    self.response_queue.put((query_id, response)) #(query_id, response)
-                running_tasks = unfinished
-            except Exception as e:
-                logger.error(f'error happened during running async tasks', exc_info=e)
-        
+        self.inference_call = getattr(self.sut_obj, self.infer_call)
+        if not asyncio.iscoroutinefunction(self.inference_call):
+            logger.info(f'{self.infer_call} of sut is not a coroutine function, it runs on {self.executor_threads} executor threads')
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.executor_threads)
+        self.completions = self.create_completion_batch()
+
+        reader = threading.Thread(target=self.read_queries, daemon=True)
+        reader.start()
+        self.want_queries.set()
+        self.event_loop.run_forever()
+        reader.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+
         if self.teardown_call is not None:
             f = getattr(self.sut_obj, self.teardown_call)
             if asyncio.iscoroutinefunction(f):
                 self.event_loop.run_until_complete(f())
             else:
-                f()               
+                f()
+        self.event_loop.close()
+
+    def read_queries(self):
+        ''' runs on the reader thread, forward messages of the query queue to the event loop. '''
+        while True:
+            self.want_queries.wait()
+            message = self.query_queue.get()
+            dequeued_at_ns = clock_ns()
+            # the loop sets it again once it has room for more queries.
+            self.want_queries.clear()
+            queries = [(query_id, query, dequeued_at_ns) for query_id, query in self.unpack_queries(message)]
+            self.event_loop.call_soon_threadsafe(self.on_queries_received, queries)
+            if any(query_id is None for query_id, _, _ in queries):
+                break
+
+    def on_queries_received(self, queries):
+        for query_id, query, dequeued_at_ns in queries:
+            if query_id is None:
+                # let the other workers sharing the queue stop as well.
+                self.query_queue.put((None, None))
+                self.should_stop = True
+                break
+            self.pending_queries.append((query_id, query, dequeued_at_ns))
+        self.start_queries()
+
+    def start_queries(self):
+        while self.pending_queries and len(self.task_timestamps) < self.num_tasks:
+            query_id, query, dequeued_at_ns = self.pending_queries.popleft()
+            if query is None:
+                query = (query_id,)
+            timestamps = {'dequeued_at_ns': dequeued_at_ns}
+            try:
+                query = self.query_resolver.resolve(query)
+                if self.executor is None:
+                    coro = self.run_query(self.inference_call(*query), timestamps)
+                else:
+                    coro = self.run_query_in_executor(query, timestamps)
+                task = self.event_loop.create_task(coro, name=query_id)
+            except Exception as e:
+                logger.warning(f'error happened during processing query {query_id} {query}', exc_info=e)
+                self.complete_query(query_id, {'error': True, **timestamps})
+                continue
+            self.task_timestamps[task] = timestamps
+            task.add_done_callback(self.on_task_done)
+
+        if self.should_stop:
+            if not self.task_timestamps and not self.pending_queries:
+                self.completions.flush()
+                self.event_loop.stop()
+        elif len(self.task_timestamps) + len(self.pending_queries) < self.num_tasks:
+            self.want_queries.set()
+
+    def on_task_done(self, task):
+        query_id = int(task.get_name())
+        response = {'error': False, **self.task_timestamps.pop(task)}
+        # If no unhandled exception was raised in the wrapped coroutine,
+        # then a value of None is returned. Otherwise, exception is
+        # re-raised when calling the result() method and need to be handled.
+        exception = task.exception() if not task.cancelled() else asyncio.CancelledError()
+        if exception is not None:
+            response['error'] = True
+            logger.warning(f'error happened during processing query {query_id}', exc_info=exception)
+        else:
+            task_result = task.result()
+            if isinstance(task_result, dict):
+                response.update(task_result)
+        self.complete_query(query_id, response)
+        self.start_queries()
+
+    def complete_query(self, query_id, response):
+        self.completions.add(query_id, response)
+        # flush a partial batch when its deadline is due, unless it is flushed by size before.
+        timeout = self.completions.timeout()
+        if timeout is not None and self.flush_handle is None:
+            self.flush_handle = self.event_loop.call_later(timeout, self.flush_completions)
+
+    def flush_completions(self):
+        self.flush_handle = None
+        if self.completions.timeout() == 0:
+            self.completions.flush()
+        elif self.completions.timeout() is not None:
+            self.flush_handle = self.event_loop.call_later(self.completions.timeout(), self.flush_completions)
+
+    @staticmethod
+    async def run_query(coro, timestamps):
+        ''' record when the query actually starts and finishes running on the event loop. '''
+        timestamps['started_at_ns'] = clock_ns()
+        result = await coro
+        timestamps['finished_at_ns'] = clock_ns()
+        return result
+
+    async def run_query_in_executor(self, query, timestamps):
+        return await self.event_loop.run_in_executor(self.executor, self.run_sync_query, query, timestamps)
+
+    def run_sync_query(self, query, timestamps):
+        ''' runs on an executor thread, the time spent waiting for a free thread is not service time. '''
+        timestamps['started_at_ns'] = clock_ns()
+        result = self.inference_call(*query)
+        timestamps['finished_at_ns'] = clock_ns()
+        return result
 
     def join(self):
         logger.info(f'worker {self} is terminated')
 
 
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import time
+import queue
+import asyncio
+import collections
+from .sync_worker import SyncWorker
+from .load_gen import clock_ns
+from ..logger import logger
+
+
+class BatchingWorker(SyncWorker):
+    '''
+    Dynamic batching as done by inference servers. Each thread gathers queries until it has
+    `max_batch_size` of them or the oldest one waited for `max_wait_ms`, then runs them with
+    a single `SUT::predict_batch(queries)` call, where `queries` is a list of the queries, i.e.
+    tuples of `predict` arguments. `predict_batch` may return a list with the result of each
+    query, and may be a coroutine function. if it raises, all queries of the batch fail.
+    '''
+    def __init__(self, sut_cls, query_queue, response_queue, num_threads=1,
+                 max_batch_size=8, max_wait_ms=5.0, **kwargs):
+        super().__init__(sut_cls, query_queue, response_queue, num_threads=num_threads, **kwargs)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1e3
+        if self.infer_batch_call is None:
+            raise ValueError(f'sut {sut_cls.__name__} has no `predict_batch` method required by batching')
+
+    def detect_sut_functions(self):
+        super().detect_sut_functions()
+        self.infer_batch_call = None
+        for fun in dir(self.sut_cls):
+            if fun.lower() in ['forward_batch', 'predict_batch', 'run_batch', 'infer_batch', 'execute_batch']:
+                self.infer_batch_call = fun
+        logger.info(f'sut: {self.sut_cls.__name__}, batch_inference_call: {self.infer_batch_call}')
+
+    def gather_batch(self, pending, completions):
+        ''' move up to `max_batch_size` `(query_id, query, dequeued_at_ns)` into a batch, waiting
+        at most `max_wait_ms` after the first query. pending completions are flushed while waiting. '''
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            if pending:
+                batch.append(pending.popleft())
+                if batch[-1][0] is None:
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_wait
+                continue
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            timeout = None if deadline is None else deadline - now
+            if completions.timeout() is not None:
+                timeout = completions.timeout() if timeout is None else min(timeout, completions.timeout())
+            try:
+                message = self.query_queue.get(timeout=timeout)
+            except queue.Empty:
+                completions.flush()
+                continue
+            dequeued_at_ns = clock_ns()
+            pending.extend((query_id, query, dequeued_at_ns) for query_id, query in self.unpack_queries(message))
+        return batch
+
+    def thread_callback(self):
+        # notify the main thread that the thread is ready for processing
+        self.response_queue.put((None, 'model created', None))
+        batch_call = getattr(self.sut_obj, self.infer_batch_call)
+        event_loop = asyncio.new_event_loop() if asyncio.iscoroutinefunction(batch_call) else None
+        completions = self.create_completion_batch()
+        # queries received in bulk that don't fit in the current batch.
+        pending = collections.deque()
+        should_stop = False
+        while not should_stop:
+            batch = self.gather_batch(pending, completions)
+            if batch and batch[-1][0] is None:
+                # pass the stop request to the other threads once the queries before it are done.
+                self.query_queue.put((None, None))
+                should_stop = True
+                batch.pop()
+            if not batch:
+                continue
+
+            queries = []
+            for query_id, query, _ in batch:
+                if query is None:
+                    query = (query_id,)
+                queries.append(self.query_resolver.resolve(query))
+            started_at_ns = clock_ns()
+            try:
+                results = batch_call(queries)
+                if event_loop is not None:
+                    results = event_loop.run_until_complete(results)
+                finished_at_ns = clock_ns()
+                errors = [False] * len(batch)
+            except Exception as e:
+                results, finished_at_ns = None, None
+                errors = [True] * len(batch)
+                logger.warning(f'error happened during processing a batch of {len(batch)} queries', exc_info=e)
+
+            for i, (query_id, _, dequeued_at_ns) in enumerate(batch):
+                response = {'error': errors[i], 'dequeued_at_ns': dequeued_at_ns, 'started_at_ns': started_at_ns}
+                if finished_at_ns is not None:
+                    response['finished_at_ns'] = finished_at_ns
+                if isinstance(results, (list, tuple)) and i < len(results) and isinstance(results[i], dict):
+                    response.update(results[i])
+                completions.add(query_id, response)
+        completions.flush()
+        if event_loop is not None:
+            event_loop.close()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,95 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import random
+import threading
+
+
+class DispatchPolicy:
+    ''' choose the worker that receives the next message given the outstanding queries of each worker. '''
+    name = None
+
+    def select(self, outstanding):
+        raise NotImplementedError()
+
+
+class RoundRobinPolicy(DispatchPolicy):
+    name = 'round_robin'
+
+    def __init__(self):
+        self.next_worker = 0
+
+    def select(self, outstanding):
+        worker = self.next_worker % len(outstanding)
+        self.next_worker = worker + 1
+        return worker
+
+
+class LeastOutstandingPolicy(DispatchPolicy):
+    name = 'least_outstanding'
+
+    def select(self, outstanding):
+        return min(range(len(outstanding)), key=outstanding.__getitem__)
+
+
+class PowerOfTwoChoicesPolicy(DispatchPolicy):
+    ''' the less loaded of two random workers, which is nearly as balanced as least-outstanding
+    but doesn't send every message to the same worker when the counts are stale. '''
+    name = 'power_of_two'
+
+    def select(self, outstanding):
+        if len(outstanding) == 1:
+            return 0
+        a, b = random.sample(range(len(outstanding)), 2)
+        return a if outstanding[a] <= outstanding[b] else b
+
+
+dispatch_policies = {p.name: p for p in [RoundRobinPolicy, LeastOutstandingPolicy, PowerOfTwoChoicesPolicy]}
+
+
+class Dispatcher:
+    '''
+    Send queries to one queue per worker instead of a queue shared by all workers, and keep
+    track of the queries dispatched to and outstanding on each worker.
+
+    A message is either a single `(query_id, query)` or a list of them, it is sent to a
+    single worker as a whole.
+    '''
+    def __init__(self, queues, policy='round_robin'):
+        if policy not in dispatch_policies:
+            raise ValueError(f'unknown dispatch policy {policy}, choose from {list(dispatch_policies.keys())}')
+        self.queues = queues
+        self.policy = dispatch_policies[policy]()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.outstanding = [0] * len(self.queues)
+            self.dispatched = [0] * len(self.queues)
+            self.max_outstanding = [0] * len(self.queues)
+            self.query_workers = {}
+
+    def put(self, message):
+        query_ids = [q[0] for q in message] if isinstance(message, list) else [message[0]]
+        with self.lock:
+            worker = self.policy.select(self.outstanding)
+            for query_id in query_ids:
+                self.query_workers[query_id] = worker
+            self.outstanding[worker] += len(query_ids)
+            self.dispatched[worker] += len(query_ids)
+            self.max_outstanding[worker] = max(self.max_outstanding[worker], self.outstanding[worker])
+        self.queues[worker].put(message)
+
+    def complete(self, query_id):
+        with self.lock:
+            worker = self.query_workers.pop(query_id, None)
+            if worker is not None:
+                self.outstanding[worker] -= 1
+
+    def get_stats(self):
+        with self.lock:
+            return {'dispatch/policy': self.policy.name,
+                    'dispatch/queries': list(self.dispatched),
+                    'dispatch/outstanding': list(self.outstanding),
+                    'dispatch/max_outstanding': list(self.max_outstanding)}
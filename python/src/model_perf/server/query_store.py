@@ -0,0 +1,151 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import pickle
+import struct
+import collections
+import sys
+import threading
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from ..logger import logger
+
+
+# what is sent to workers instead of the query itself, see `SharedQueryStore`.
+SharedQueryRef = collections.namedtuple('SharedQueryRef', ['store', 'index'])
+
+# `SharedMemory` only registers blocks with the resource tracker on posix, which has no tracker 
+# otherwise, e.g. it can't be started on Windows.
+tracks_shared_memory = os.name == 'posix'
+
+
+class SharedQueryStore:
+    '''
+    Stage a list of queries once in a `multiprocessing.shared_memory` block, so that only a
+    `SharedQueryRef(store, index)` has to be pickled into the query queue for each issued query.
+
+    Each query is a tuple of the arguments of `SUT::predict`. Numpy arrays are copied into
+    the block and rebuilt as zero-copy, read-only views by the workers. Other arguments are
+    pickled once into the header of the block and shared by all queries that reference them.
+
+    Layout of the block: an 8-byte header length, the pickled header, then the array data
+    aligned to 64 bytes.
+    '''
+    alignment = 64
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        header_size = struct.unpack_from('<Q', self.shm.buf, 0)[0]
+        header = pickle.loads(self.shm.buf[8:8 + header_size])
+        data_offset = self.align(8 + header_size)
+        self.queries = [self.rebuild_query(args, data_offset) if kind == 'tuple' else args 
+                        for kind, args in header]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def align(cls, size):
+        return (size + cls.alignment - 1) // cls.alignment * cls.alignment
+
+    @classmethod
+    def attach(cls, name):
+        ''' attach to a store created by `SharedQueryStore.create` in another process. '''
+        # only the creator owns the block. otherwise the resource tracker of an attached
+        # process unlinks it when that process exits.
+        if sys.version_info >= (3, 13):
+            return cls(shared_memory.SharedMemory(name=name, track=False))
+        shm = shared_memory.SharedMemory(name=name)
+        if tracks_shared_memory:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    @classmethod
+    def create(cls, queries):
+        header, arrays, data_size = [], [], 0
+        for query in queries:
+            # only the arguments of a tuple are staged, other queries are kept as they are.
+            if not isinstance(query, tuple):
+                header.append(('object', query))
+                continue
+            args = []
+            for arg in query:
+                if isinstance(arg, np.ndarray) and not arg.dtype.hasobject:
+                    arg = np.ascontiguousarray(arg)
+                    args.append(('array', data_size, arg.shape, arg.dtype.str))
+                    arrays.append((data_size, arg))
+                    data_size += cls.align(arg.nbytes)
+                else:
+                    args.append(('object', arg))
+            header.append(('tuple', args))
+
+        num_queries = len(header)
+        header = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+        data_offset = cls.align(8 + len(header))
+        shm = shared_memory.SharedMemory(create=True, size=max(data_offset + data_size, 1))
+        struct.pack_into('<Q', shm.buf, 0, len(header))
+        shm.buf[8:8 + len(header)] = header
+        for offset, arr in arrays:
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, offset=data_offset + offset)[...] = arr
+        logger.info(f'staged {num_queries} queries in shared memory {shm.name}, {shm.size / 2**20:.2f} MB')
+        return cls(shm, owner=True)
+
+    def rebuild_query(self, args, data_offset):
+        query = []
+        for arg in args:
+            if arg[0] == 'array':
+                _, offset, shape, dtype = arg
+                view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=data_offset + offset)
+                # queries are shared by all workers, a sut must not modify them in place.
+                view.flags.writeable = False
+                query.append(view)
+            else:
+                query.append(arg[1])
+        return tuple(query)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __getitem__(self, index):
+        return self.queries[index]
+
+    def ref(self, index):
+        return SharedQueryRef(self.name, index)
+
+    def release(self):
+        ''' drop the local views and unlink the block if this process created it. workers
+        that are still attached keep their mapping until they exit. '''
+        self.queries = []
+        try:
+            self.shm.close()
+        except BufferError:
+            # views handed to a sut are still alive, the mapping goes away with the process.
+            pass
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+
+class SharedQueryResolver:
+    '''
+    used by workers to turn `SharedQueryRef`s back into queries. a worker stays attached to the
+    store of the current queries only, the previous store is released once a ref names another
+    store, so that its mapping doesn't outlive the store unlinked by the runner.
+    '''
+    def __init__(self):
+        self.store = None
+        self.lock = threading.Lock()
+
+    def resolve(self, query):
+        if not isinstance(query, SharedQueryRef):
+            return query
+        # indexing is done under the lock as well, a store must not be released in between.
+        with self.lock:
+            if self.store is None or self.store.name != query.store:
+                if self.store is not None:
+                    self.store.release()
+                self.store = SharedQueryStore.attach(query.store)
+            return self.store[query.index]
@@ -0,0 +1,213 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import threading
+import importlib.util
+import numpy as np
+from pathlib import Path
+from .load_gen import PerfResult
+from ..logger import logger
+
+
+class QueryRecorder:
+    '''
+    Stream a record of every completed query to `path` while the runner runs. The records kept
+    by `PerfResult` are taken every `flush_interval_ms` and written as a chunk of columns, so the
+    memory is bounded by the queries completed between two flushes instead of the whole run.
+
+    The columns are those of `PerfResult::take_records`, i.e. `id`, `index` of the payload,
+    `tag`, `group`, the `*_at_ns` timestamps, `latency_ms` and `error`, the `run` each record
+    belongs to, i.e. the number of the benchmark call, and any other field of the responses,
+    e.g. the `worker` or a field returned by `SUT::predict` in a dict. a field missing from a
+    response is NaN, -1, False or '' depending on the column type. warm-ups are not recorded.
+
+    With `format='npz'`, `path` is a directory with a `records-<chunk>.npz` file per chunk.
+    `parquet` and `arrow` write a single file with a row group or record batch per chunk and
+    require pyarrow. The records are read back with `load_records(path)`.
+    '''
+    formats = ['npz', 'parquet', 'arrow']
+
+    def __init__(self, path, format='npz', flush_interval_ms=1000):
+        if format not in self.formats:
+            raise ValueError(f'unknown record format {format}, choose from {self.formats}')
+        if format != 'npz' and importlib.util.find_spec('pyarrow') is None:
+            raise ImportError(f'the {format} record format requires pyarrow, install it with `pip install pyarrow`')
+        self.path = Path(path)
+        self.format = format
+        self.flush_interval = flush_interval_ms / 1e3
+        # the fields of the response of each query that PerfResult doesn't keep.
+        self.standard_fields = set(PerfResult.complete_query_args())
+        self.lock = threading.Lock()
+        self.fields = {}
+        self.perf_result = None
+        self.run = -1
+        # only a single thread writes chunks at a time.
+        self.write_lock = threading.Lock()
+        self.writer, self.schema = None, None
+        self.num_chunks, self.num_records = 0, 0
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        if self.format == 'npz':
+            os.makedirs(self.path, exist_ok=True)
+        else:
+            os.makedirs(self.path.parent, exist_ok=True)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+        self.detach()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        logger.info(f'{self.num_records} query records are written to {self.path}')
+
+    def attach(self, perf_result):
+        ''' record the queries completed into `perf_result`, a new run, see `detach`. '''
+        self.detach()
+        with self.lock:
+            self.perf_result = perf_result
+            self.run += 1
+        perf_result.set_recording(True)
+
+    def detach(self):
+        '''
+        flush the records of the current run and stop recording it, the queries it completes
+        after that are not recorded. fields added while no run is attached are ignored.
+        '''
+        self.flush()
+        with self.lock:
+            if self.perf_result is not None:
+                self.perf_result.set_recording(False)
+                self.perf_result = None
+            # fields of queries that never completed, e.g. dropped by an aborted run.
+            self.fields = {}
+
+    def add_fields(self, query_id, fields):
+        with self.lock:
+            if self.perf_result is not None:
+                self.fields.setdefault(query_id, {}).update(fields)
+
+    def add_response(self, query_id, response):
+        ''' keep the fields of a response that are not completed into `PerfResult`. '''
+        fields = {k: v for k, v in response.items() if k not in self.standard_fields}
+        if fields:
+            self.add_fields(query_id, fields)
+
+    def flush_periodically(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f'failed to write query records to {self.path}', exc_info=e)
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                if self.perf_result is None:
+                    return
+                records = self.perf_result.take_records()
+                if len(records['id']) == 0:
+                    return
+                fields = [self.fields.pop(query_id, None) for query_id in records['id'].tolist()]
+                run = self.run
+            columns = self.build_columns(records, fields, run)
+            self.write_chunk(columns)
+            self.num_chunks += 1
+            self.num_records += len(records['id'])
+
+    @staticmethod
+    def build_columns(records, fields, run):
+        ''' join the `fields` of each record as columns, a field overrides a column of the same name. '''
+        columns = dict(records)
+        columns['run'] = np.full(len(records['id']), run, dtype=np.int64)
+        names = dict.fromkeys(k for f in fields if f for k in f.keys())
+        for name in names:
+            values = [f.get(name) if f else None for f in fields]
+            if name in columns:
+                column = columns[name].copy()
+                for i, value in enumerate(values):
+                    if value is not None:
+                        column[i] = value
+                columns[name] = column
+            else:
+                columns[name] = to_column(values)
+        return columns
+
+    def write_chunk(self, columns):
+        if self.format == 'npz':
+            np.savez(self.path / f'records-{self.num_chunks:05d}.npz', **columns)
+            return
+
+        import pyarrow as pa
+        table = pa.table(columns)
+        if self.writer is None:
+            # the schema is fixed by the first chunk, columns of later chunks are cast to it.
+            self.schema = table.schema
+            if self.format == 'parquet':
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(str(self.path), self.schema)
+            else:
+                self.writer = pa.ipc.new_file(str(self.path), self.schema)
+        else:
+            dropped = [name for name in table.column_names if name not in self.schema.names]
+            if dropped:
+                logger.warning(f'columns {dropped} are not in the first chunk of {self.path}, they are dropped')
+            arrays = [table.column(f.name).cast(f.type) if f.name in table.column_names else pa.nulls(len(table), f.type)
+                      for f in self.schema]
+            table = pa.Table.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(table)
+
+
+def to_column(values):
+    ''' a numpy array of a field, with a type that fits all of its values. '''
+    present = [v for v in values if v is not None]
+    complete = len(present) == len(values)
+    if all(isinstance(v, (bool, np.bool_)) for v in present):
+        return np.array([bool(v) for v in values], dtype=bool)
+    if complete and all(isinstance(v, (int, np.integer)) for v in present):
+        return np.array(values, dtype=np.int64)
+    if all(isinstance(v, (int, float, np.integer, np.floating)) for v in present):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array(['' if v is None else str(v) for v in values])
+
+
+def fill_value(dtype):
+    if dtype.kind == 'f':
+        return np.nan
+    if dtype.kind in 'iu':
+        return -1
+    if dtype.kind == 'b':
+        return False
+    return ''
+
+
+def load_records(path):
+    ''' the records written by a `QueryRecorder` to `path`, as a dict of numpy arrays. '''
+    path = Path(path)
+    if path.is_dir():
+        chunks = [dict(np.load(f)) for f in sorted(path.glob('records-*.npz'))]
+        names = list(dict.fromkeys(k for chunk in chunks for k in chunk.keys()))
+        columns = {}
+        for name in names:
+            dtype = next(chunk[name].dtype for chunk in chunks if name in chunk)
+            parts = [chunk[name] if name in chunk else np.full(len(chunk['id']), fill_value(dtype), dtype=dtype)
+                     for chunk in chunks]
+            columns[name] = np.concatenate(parts)
+        return columns
+
+    import pyarrow as pa
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(str(path))
+    else:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    return {name: table.column(name).to_numpy() for name in table.column_names}
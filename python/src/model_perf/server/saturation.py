@@ -0,0 +1,107 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import time
+import threading
+import collections
+from ..logger import logger
+
+
+class SaturationMonitor:
+    '''
+    Track the outstanding queries of a run and its issued and completed rates over the last
+    `window_ms`, to tell when the target qps exceeds what the workers can serve. A run is
+    saturated once, for at least `saturation_ms`, queries are completed slower than they are
+    issued by more than `tolerance`, and the outstanding queries keep growing beyond the
+    `max_concurrency` queries the workers run at once. It is saturated right away if more than
+    `max_outstanding` queries are outstanding. With `abort`, a saturated run is stopped.
+    '''
+    def __init__(self, max_concurrency, interval_ms=100, window_ms=1000, saturation_ms=2000,
+                 tolerance=0.05, max_outstanding=None, abort=False):
+        self.max_concurrency = max_concurrency
+        self.interval = interval_ms / 1e3
+        self.window = window_ms / 1e3
+        self.saturation = saturation_ms / 1e3
+        self.tolerance = tolerance
+        self.max_outstanding = max_outstanding
+        self.abort = abort
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        # `(time, issued, completed)` over the last window.
+        self.samples = collections.deque()
+        self.diverging_since = None
+        self.saturated = False
+        self.detected_at = None
+        self.peak_outstanding = 0
+        self.issued_qps, self.completed_qps = 0, 0
+
+    def start(self, load_gen, perf_result):
+        self.reset()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.monitor, args=(load_gen, perf_result), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def monitor(self, load_gen, perf_result):
+        while not self.stop_event.wait(self.interval):
+            completed = perf_result.count_succeeded() + perf_result.count_failed()
+            if not self.check(time.monotonic(), load_gen.count_issued(), completed):
+                continue
+            # keep tracking the outstanding queries until the end of the run.
+            if self.abort:
+                logger.warning(f'the run is saturated, {self.peak_outstanding} queries are outstanding, abort it')
+                load_gen.stop()
+            else:
+                logger.warning(f'the run is saturated, {self.peak_outstanding} queries are outstanding')
+
+    def check(self, now, issued, completed):
+        ''' add a sample, returns True when the run becomes saturated. '''
+        outstanding = issued - completed
+        self.peak_outstanding = max(self.peak_outstanding, outstanding)
+        self.samples.append((now, issued, completed))
+        while now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        if self.saturated:
+            return False
+
+        if self.max_outstanding is not None and outstanding > self.max_outstanding:
+            return self.set_saturated(now)
+        then, issued_then, completed_then = self.samples[0]
+        if now - then < self.window / 2:
+            return False
+        self.issued_qps = (issued - issued_then) / (now - then)
+        self.completed_qps = (completed - completed_then) / (now - then)
+        diverging = (self.completed_qps < self.issued_qps * (1 - self.tolerance)
+                     and outstanding > max(self.max_concurrency, issued_then - completed_then))
+        if not diverging:
+            self.diverging_since = None
+            return False
+        if self.diverging_since is None:
+            self.diverging_since = now
+        if now - self.diverging_since >= self.saturation:
+            return self.set_saturated(now)
+        return False
+
+    def set_saturated(self, now):
+        self.saturated = True
+        self.detected_at = now
+        return True
+
+    def get_report(self):
+        report = {'saturated': self.saturated,
+                  'saturation/max_outstanding': self.peak_outstanding}
+        if self.saturated:
+            report.update({'saturation/detected_at_ms': round((self.detected_at - self.started_at) * 1e3),
+                           'saturation/issued_qps': round(self.issued_qps, 3),
+                           'saturation/completed_qps': round(self.completed_qps, 3),
+                           'saturation/aborted': self.abort})
+        return report
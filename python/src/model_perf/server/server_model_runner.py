@@ -2,14 +2,24 @@
 # Licensed under the MIT License.
 
 import threading
+import queue
 import random
 import multiprocessing
 import time
+import asyncio
+import numpy as np
 from typing import Optional, Type
 from types import TracebackType
 from .sync_worker import SyncWorker
 from .async_worker import AsyncWorker
-from .load_gen import ServerLoadGen, SingleStreamLoadGen, PerfResult
+from .batching_worker import BatchingWorker
+from .worker import Worker, InProcessResponseQueue
+from .query_store import SharedQueryStore
+from .dispatcher import Dispatcher
+from .saturation import SaturationMonitor
+from .records import QueryRecorder
+from .affinity import plan_affinity
+from .load_gen import ServerLoadGen, SingleStreamLoadGen, ClosedLoopLoadGen, OfflineLoadGen, MultiStreamLoadGen, TraceLoadGen, QpsSchedule, PerfResult
 from ..logger import logger
 
 
@@ -61,13 +71,36 @@ def Pipe(duplex=True):
 '''
 
 class ServerModelRunner:
+    percentiles = [0.5, 0.9, 0.95, 0.97, 0.99, 0.999]
+    window_percentiles = [0.5, 0.9, 0.99, 0.999]
+    
     def __init__(self, sut_cls,
                  async_worker=False,
                  num_workers=1, num_threads=1, num_tasks=1,               
-                 tensorboard=False):
+                 tensorboard=False,
+                 latency_histogram=False, significant_digits=3,
+                 bulk_dispatch=False,
+                 window_ms=1000,
+                 shared_queries=False,
+                 dispatch_policy=None,
+                 completion_batch_size=1, completion_batch_ms=1.0,
+                 max_batch_size=None, max_wait_ms=5.0,
+                 cpu_affinity=False, cores_per_worker=None, affinity_domain=None, numa_node=None,
+                 executor_threads=None,
+                 in_process=False,
+                 abort_on_saturation=False, max_outstanding=None,
+                 record_path=None, record_format='npz', record_flush_ms=1000):
         self.sut_cls = sut_cls
         self.sut_args = ([], {})
         
+        # run workers as threads of this process, for suts that release the GIL in their hot path. 
+        # queries are passed by reference instead of pickled, a sut must not modify them in place, 
+        # and workers complete queries in `PerfResult` themselves without a response thread.
+        self.in_process = in_process
+        if in_process and (shared_queries or cpu_affinity):
+            raise ValueError('in_process workers share the queries and cpus of the runner process, '
+                             'it does not support shared_queries or cpu_affinity')
+        
         self.async_worker = async_worker
         self.num_workers = num_workers
         if self.async_worker:
@@ -76,8 +109,18 @@ class ServerModelRunner:
             self.num_worker_concurrency = num_threads       
         self.workers = []
         
-        self.query_queue = multiprocessing.Queue()
-        self.response_queue = multiprocessing.Queue()
+        queue_cls = queue.Queue if in_process else multiprocessing.Queue
+        self.query_queue = queue_cls()
+        # by default all workers compete on `query_queue`. with a dispatch policy, i.e. 
+        # 'round_robin', 'least_outstanding' or 'power_of_two', each worker has its own queue.
+        self.dispatcher = None
+        if dispatch_policy is not None:
+            self.dispatcher = Dispatcher([queue_cls() for _ in range(num_workers)], 
+                                         policy=dispatch_policy)
+        if in_process:
+            self.response_queue = InProcessResponseQueue(self.handle_response)
+        else:
+            self.response_queue = multiprocessing.Queue()
         self.response_thread = None
         
         self.queries = []
@@ -86,6 +129,57 @@ class ServerModelRunner:
         
         self.load_gen = None
         self.perf_result = None
+        # the `EarlyStopping` rule of the current run, if any.
+        self.early_stopping = None
+        # keep a log-bucketed histogram instead of every query latency, which
+        # bounds the memory and the cost of percentiles for long runs.
+        self.latency_histogram = latency_histogram
+        self.significant_digits = significant_digits
+        # issue all queries due at a wake-up of the load gen with a single call
+        # and send them to workers in a few messages instead of one per query.
+        self.bulk_dispatch = bulk_dispatch
+        # length of the time windows that `get_windows` reports, 0 disables them.
+        self.window_ms = window_ms
+        # stage queries once in shared memory, so that only a reference to a query
+        # is pickled for each issued query and numpy inputs are not copied.
+        self.shared_queries = shared_queries
+        self.query_store, self.query_store_source = None, None
+        
+        # workers send up to `completion_batch_size` completions in one message, holding each 
+        # for at most `completion_batch_ms`. note the hold time is part of measured latencies.
+        self.completion_batch_size = completion_batch_size
+        self.completion_batch_ms = completion_batch_ms
+        
+        # size of the thread pool running a sync `SUT::predict` in async workers, `num_tasks` by default.
+        self.executor_threads = executor_threads
+        # dynamic batching, each worker thread runs up to `max_batch_size` queries with a single 
+        # `SUT::predict_batch` call, waiting at most `max_wait_ms` for a batch to fill.
+        if max_batch_size is not None and async_worker:
+            raise ValueError('dynamic batching is done by threads of sync workers, it does not support async_worker')
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        
+        # pin each worker to a disjoint set of cpus, see `plan_affinity`. `cpu_affinity` is either 
+        # True to plan the placement or a list with the cpus of each worker.
+        self.cpu_affinity = cpu_affinity
+        self.cores_per_worker = cores_per_worker
+        self.affinity_domain = affinity_domain
+        self.numa_node = numa_node
+        self.affinity_plan = None
+        
+        # server mode runs are flagged as `saturated` once the workers fall behind the target qps, 
+        # see `SaturationMonitor`. with `abort_on_saturation` the run ends early and its backlog 
+        # is dropped. `max_outstanding` is a hard limit of outstanding queries.
+        max_concurrency = num_workers * self.num_worker_concurrency * (max_batch_size or 1)
+        self.saturation_monitor = SaturationMonitor(max_concurrency, max_outstanding=max_outstanding, 
+                                                    abort=abort_on_saturation)
+        self.track_saturation = False
+        
+        # stream a record of every query, with its payload index, worker, timestamps and the fields 
+        # returned by the sut, to `record_path` while the runner runs, see `QueryRecorder`.
+        self.recorder = None
+        if record_path is not None:
+            self.recorder = QueryRecorder(record_path, format=record_format, flush_interval_ms=record_flush_ms)
         
         self.enable_tensorboard = tensorboard
         self.tb_logs_thread = None
@@ -95,8 +189,9 @@ class ServerModelRunner:
         return self
     
     def reset(self):
-        while not self.query_queue.empty():
-            self.query_queue.get()
+        self.drain_query_queues()
+        if self.dispatcher is not None:
+            self.dispatcher.reset()
         
         while not self.response_queue.empty():
             self.response_queue.get()
@@ -105,27 +200,107 @@ class ServerModelRunner:
             self.report = {'num_workers': self.num_workers, 'num_tasks': self.num_worker_concurrency}
         else:
             self.report = {'num_workers': self.num_workers, 'num_threads': self.num_worker_concurrency}
+        if self.in_process:
+            self.report['in_process'] = True
+        if self.max_batch_size is not None:
+            self.report.update({'batch/max_size': self.max_batch_size, 'batch/max_wait_ms': self.max_wait_ms})
+        if self.affinity_plan is not None:
+            self.report.update({'affinity/cpus': self.affinity_plan,
+                                'affinity/intra_op_threads': self.get_intra_op_num_threads(0)})
+        self.early_stopping = None
+        self.track_saturation = False
         self.done = False
     
+    def drain_query_queues(self):
+        ''' drop the queries that are not taken by workers yet, returns how many were dropped. '''
+        num_dropped = 0
+        for query_queue in self.get_query_queues():
+            while not query_queue.empty():
+                try:
+                    message = query_queue.get(timeout=0.1)
+                except queue.Empty:
+                    break
+                num_dropped += len(message) if isinstance(message, list) else 1
+        return num_dropped
+    
     @staticmethod
     def worker_process_callback(async_worker, 
                                 sut_cls, sut_args,
-                                max_concurrency, query_queue, response_queue):
-        if not async_worker:
+                                max_concurrency, query_queue, response_queue, worker_kwargs):
+        if 'max_batch_size' in worker_kwargs:
+            worker = BatchingWorker(sut_cls=sut_cls, num_threads=max_concurrency,
+                                    query_queue=query_queue, response_queue=response_queue,
+                                    **worker_kwargs)(*sut_args[0], **sut_args[1])
+        elif not async_worker:
             worker = SyncWorker(sut_cls=sut_cls, num_threads=max_concurrency,
-                                query_queue=query_queue, response_queue=response_queue)(*sut_args[0], **sut_args[1])
+                                query_queue=query_queue, response_queue=response_queue,
+                                **worker_kwargs)(*sut_args[0], **sut_args[1])
         else:
             worker = AsyncWorker(sut_cls=sut_cls, num_tasks=max_concurrency, 
-                                 query_queue=query_queue, response_queue=response_queue)(*sut_args[0], **sut_args[1])
+                                 query_queue=query_queue, response_queue=response_queue,
+                                 **worker_kwargs)(*sut_args[0], **sut_args[1])
         worker.start()
         worker.join()   
     
+    def create_perf_result(self, record=True):
+        ''' with `record`, the queries completed into the result are recorded as a new run. '''
+        perf_result = PerfResult(histogram=self.latency_histogram, 
+                                 significant_digits=self.significant_digits)
+        perf_result.set_window(window_ms=self.window_ms, percentiles=self.window_percentiles)
+        if self.recorder is not None and record:
+            self.recorder.attach(perf_result)
+        return perf_result
+    
+    def get_query_queues(self):
+        if self.dispatcher is None:
+            return [self.query_queue]
+        return self.dispatcher.queues
+    
+    def dispatch(self, message):
+        if self.dispatcher is None:
+            self.query_queue.put(message)
+        else:
+            self.dispatcher.put(message)
+    
+    def plan_affinity(self):
+        if self.cpu_affinity is True:
+            self.affinity_plan = plan_affinity(self.num_workers, cores_per_worker=self.cores_per_worker, 
+                                               domain=self.affinity_domain, node=self.numa_node)
+        elif self.cpu_affinity:
+            if len(self.cpu_affinity) != self.num_workers:
+                raise ValueError(f'cpu_affinity has {len(self.cpu_affinity)} cpu sets for {self.num_workers} workers')
+            self.affinity_plan = [list(cpus) for cpus in self.cpu_affinity]
+        if self.affinity_plan is not None:
+            for i, cpus in enumerate(self.affinity_plan):
+                logger.info(f'worker {i} is pinned to cpus {cpus} with {self.get_intra_op_num_threads(i)} intra-op threads')
+    
+    def get_intra_op_num_threads(self, worker_index):
+        '''
+        the cpus of a worker are shared by the threads of the worker, not by async tasks. an async 
+        worker runs a sync `SUT::predict` on `executor_threads` threads, `num_tasks` by default.
+        '''
+        num_threads = self.num_worker_concurrency
+        if self.async_worker:
+            num_threads = 1 if self.has_async_inference_call() else self.executor_threads or self.num_worker_concurrency
+        return max(1, len(self.affinity_plan[worker_index]) // num_threads)
+    
+    def has_async_inference_call(self):
+        ''' the same inference call as found by `Worker.detect_sut_functions`. '''
+        calls = [fun for fun in dir(self.sut_cls) if fun.lower() in Worker.infer_call_names]
+        return bool(calls) and asyncio.iscoroutinefunction(getattr(self.sut_cls, calls[-1]))
+    
     def start(self):
-        for _ in range(self.num_workers):
-            worker = multiprocessing.Process(target=ServerModelRunner.worker_process_callback,
-                                             args=(self.async_worker, 
-                                                   self.sut_cls, self.sut_args,
-                                                   self.num_worker_concurrency, self.query_queue, self.response_queue))
+        self.plan_affinity()
+        if self.recorder is not None:
+            self.recorder.start()
+        for i in range(self.num_workers):
+            query_queue = self.query_queue if self.dispatcher is None else self.dispatcher.queues[i]
+            worker_cls = threading.Thread if self.in_process else multiprocessing.Process
+            worker = worker_cls(target=ServerModelRunner.worker_process_callback,
+                                args=(self.async_worker, 
+                                      self.sut_cls, self.sut_args,
+                                      self.num_worker_concurrency, query_queue, self.response_queue,
+                                      self.get_worker_kwargs(i)))
             self.workers.append(worker)
             worker.start()
 
@@ -143,29 +318,80 @@ class ServerModelRunner:
             else:
                 logger.info(f'{num_ready} out of {total_threads} total sync worker threads are ready')
               
-        self.response_thread = threading.Thread(target=self.response_received_callback)
-        self.response_thread.start()
+        if not self.in_process:
+            self.response_thread = threading.Thread(target=self.response_received_callback)
+            self.response_thread.start()
         
         if self.enable_tensorboard:
             self.tb_logs_thread = threading.Thread(target=self.write_tensorboard_logs)
             self.tb_logs_thread.start()
     
+    def get_worker_kwargs(self, worker_index):
+        kwargs = {'completion_batch_size': self.completion_batch_size,
+                  'completion_batch_ms': self.completion_batch_ms}
+        if self.max_batch_size is not None:
+            kwargs.update({'max_batch_size': self.max_batch_size, 'max_wait_ms': self.max_wait_ms})
+        if self.async_worker:
+            kwargs['executor_threads'] = self.executor_threads
+        if self.affinity_plan is not None:
+            kwargs.update({'cpus': self.affinity_plan[worker_index], 
+                           'intra_op_num_threads': self.get_intra_op_num_threads(worker_index)})
+        if self.recorder is not None:
+            kwargs['worker_id'] = worker_index
+        return kwargs
+    
     def response_received_callback(self):
-        while True:
-            query_sample_id, perf_response = self.response_queue.get()
-            #logger.debug(f'receive response {query_sample_id}')
-            if query_sample_id is None:
-                break
-            perf_response = {k: v for k, v in perf_response.items() if k in self.perf_result.complete_query_args()}          
-            self.perf_result.complete_query(query_sample_id, **perf_response)       
+        while self.handle_response(self.response_queue.get()):
+            pass
         logger.info(f'stop receiving responses') 
+    
+    def handle_response(self, message):
+        ''' complete the queries of a message sent by a worker, returns False for the stop message. '''
+        if isinstance(message, list):
+            self.complete_queries(message)
+            return True
+        query_sample_id, perf_response = message
+        #logger.debug(f'receive response {query_sample_id}')
+        if query_sample_id is None:
+            return False
+        if self.dispatcher is not None:
+            self.dispatcher.complete(query_sample_id)
+        if self.recorder is not None:
+            self.recorder.add_response(query_sample_id, perf_response)
+        perf_response = {k: v for k, v in perf_response.items() if k in self.perf_result.complete_query_args()}          
+        self.perf_result.complete_query(query_sample_id, **perf_response)       
+        return True
+    
+    def complete_queries(self, responses):
+        ''' complete a batch of `(query_id, response)` sent by a worker with a single call. '''
+        ids = np.fromiter((query_id for query_id, _ in responses), dtype=np.int64, count=len(responses))
+        errors = np.fromiter((r.get('error', False) for _, r in responses), dtype=bool, count=len(responses))
+        latency_ms = None
+        if any('latency_ms' in r for _, r in responses):
+            latency_ms = np.fromiter((r.get('latency_ms', -1.0) for _, r in responses), dtype=np.float32, count=len(responses))
+        timestamps = {}
+        for k in ['dequeued_at_ns', 'started_at_ns', 'finished_at_ns']:
+            if any(k in r for _, r in responses):
+                timestamps[k] = np.fromiter((r.get(k, -1) for _, r in responses), dtype=np.int64, count=len(responses))
+        if self.dispatcher is not None:
+            for query_id in ids.tolist():
+                self.dispatcher.complete(query_id)
+        if self.recorder is not None:
+            for query_id, response in responses:
+                self.recorder.add_response(query_id, response)
+        self.perf_result.complete_queries(ids, error=errors, latency_ms=latency_ms, **timestamps)
         
     def stop(self):
-        self.query_queue.put((None, None))     
+        for query_queue in self.get_query_queues():
+            query_queue.put((None, None))     
         for mp_worker in self.workers:
             mp_worker.join()
-        self.response_queue.put((None, None))
-        self.response_thread.join()
+        if self.response_thread is not None:
+            self.response_queue.put((None, None))
+            self.response_thread.join()
+        self.release_query_store()
+        if self.recorder is not None:
+            self.recorder.stop()
         self.done = True
         logger.info(f'all {self.num_workers} workers are terminated')
         
@@ -173,88 +399,413 @@ class ServerModelRunner:
             self.tb_logs_thread.join()
             logger.info(f'tensorboard logs thread is terminated')
 
-    def benchmark(self, queries=None, target_qps=1, min_query_count=100, min_duration_ms=30000):
+    def benchmark(self, queries=None, target_qps=1, min_query_count=100, min_duration_ms=30000, 
+                  qps_schedule=None, arrival=None, warmup_queries=0, warmup_ms=0, early_stopping=None):
+        ''' `qps_schedule` is an optional `QpsSchedule` overriding `target_qps`. the run lasts 
+        at least the whole schedule and the report has a `steps` list with the results of each step.
+        `arrival` is an optional `ArrivalProcess` of inter-arrival times, Poisson by default.
+        `warmup_queries` and `warmup_ms` run a warm-up at the qps of the first step, see `warm_up`.
+        `early_stopping` is an optional `EarlyStopping` rule, see `set_early_stopping`.
+        '''
         self.reset()
-        self.queries = queries
+        self.set_queries(queries)
         if self.queries is None:
             logger.info(f'no queries are provided. then `SUT::predict(query_id: int)` should accept a query id and generate final model inputs itself. this is to avoid cost of query serilization/deserilization between ServerModelRunner and workers.')
         self.report['mode'] = 'server'
-        self.report['qps/target'] = target_qps
+        if arrival is not None:
+            self.report['arrival'] = arrival.name()
+        if qps_schedule is None:
+            self.report['qps/target'] = target_qps
+            qps_schedule = QpsSchedule.constant(target_qps)
+        else:
+            self.report['schedule/steps'] = qps_schedule.num_steps()
+            min_duration_ms = max(min_duration_ms, int(qps_schedule.get_duration_ms()))
         
-        self.perf_result = PerfResult()
+        warmup_schedule = QpsSchedule.constant(qps_schedule.get_step_qps(0))
+        self.warm_up(lambda result: ServerLoadGen(result=result, schedule=warmup_schedule, 
+                                                  min_query_count=warmup_queries, min_duration_ms=warmup_ms,
+                                                  arrival=arrival),
+                     warmup_queries, warmup_ms)
+        self.perf_result = self.create_perf_result()
         logger.info(f'`SUT::predict` could return the following metrics in a dict to override default behaviors: {self.perf_result.complete_query_args()}')
         self.load_gen = ServerLoadGen(result=self.perf_result,
-                                      target_qps=target_qps, 
+                                      schedule=qps_schedule, 
                                       min_query_count=min_query_count,
-                                      min_duration_ms=min_duration_ms)
-                
-        for q in self.load_gen.queries():         
-            #self.perf_result.add_query(q)
-            #self.perf_result.complete_query(q.id)          
-            if self.queries is not None:
-                self.query_queue.put((q.id, random.choice(self.queries)))         
-            else:
-                self.query_queue.put((q.id, None))
-            pass
+                                      min_duration_ms=min_duration_ms,
+                                      arrival=arrival)
+        self.set_early_stopping(early_stopping)
+        self.start_saturation_monitor()
+        self.issue_queries()
+        self.stop_saturation_monitor()
         
-        logger.info(f'issued all queries. note some queries may not be completed yet.')
-        return self.get_report()
+        if qps_schedule.num_steps() == 1:
+            logger.info(f'issued all queries. note some queries may not be completed yet.')
+            return self.get_report()
+
+        # let the last step complete, otherwise its results are cut short.
+        if self.load_gen.is_stopped():
+            logger.warning(f'the run is stopped early, the queries of the last step are not waited for')
+        elif not self.perf_result.wait_all_completed(timeout_ms=10000):
+            logger.warning(f'queries of the last step are not completed in 10 seconds')
+        return {**self.get_report(), 'steps': self.get_step_reports(qps_schedule)}
+    
+    def warm_up(self, create_load_gen, warmup_queries, warmup_ms, timeout_ms=10000):
+        '''
+        Send at least `warmup_queries` queries during at least `warmup_ms` through the same 
+        workers before the measured run, so that cold caches, lazy initialization and JIT 
+        compilation don't end up in its statistics. the warm-up has its own `PerfResult` and
+        its latencies are reported separately under `warmup_latency/`, it is not recorded.
+        '''
+        if warmup_queries <= 0 and warmup_ms <= 0:
+            return
+        
+        if self.recorder is not None:
+            self.recorder.detach()
+        self.perf_result = self.create_perf_result(record=False)
+        self.load_gen = create_load_gen(self.perf_result)
+        self.issue_queries()
+        if not self.perf_result.wait_all_completed(timeout_ms=timeout_ms):
+            logger.warning(f'warm-up queries are not completed in {timeout_ms} ms, the rest are ignored')
+        
+        latencies = self.perf_result.get_latencies(percentiles=self.percentiles, min=True, avg=True, max=True)
+        self.report.update({'warmup/#queries': self.load_gen.count_issued(),
+                            'warmup/#failed': self.perf_result.count_failed(),
+                            **self.format_latencies(latencies, prefix='warmup_latency')})
+        logger.info(f'warmed up with {self.load_gen.count_issued()} queries')
+        if self.dispatcher is not None:
+            self.dispatcher.reset()
     
-    def benchmark_single_stream(self, queries=None, min_query_count=100, min_duration_ms=30000):
+    def get_step_reports(self, qps_schedule):
+        steps = []
+        for step in self.perf_result.get_tags():
+            latencies = self.perf_result.get_tag_latencies(step, percentiles=self.percentiles,
+                                                           min=True, avg=True, max=True)
+            steps.append({'step': step,
+                          'qps/target': qps_schedule.get_step_qps(step),
+                          'qps/issued': self.perf_result.get_tag_issued_qps(step),
+                          'qps/actual': self.perf_result.get_tag_actual_qps(step),
+                          '#queries/issued': self.perf_result.count_tag_issued(step),
+                          '#queries/succeeded': self.perf_result.count_tag_succeeded(step),
+                          '#queries/failed': self.perf_result.count_tag_failed(step),
+                          **self.format_latencies(latencies)})
+        return steps
+    
+    def benchmark_single_stream(self, queries=None, min_query_count=100, min_duration_ms=30000,
+                                warmup_queries=0, warmup_ms=0, early_stopping=None):
         self.reset()
-        self.queries = queries
+        self.set_queries(queries)
         if self.queries is None:
             logger.info(f'no queries are provided. then `SUT::predict(query_id: int)` should accept a query id and generate final model inputs itself. serilization/deserilization of queries between ServerModelRunner and workers could be avoided.')
         self.report['mode'] = 'single_stream'
         
-        self.perf_result = PerfResult()
+        self.warm_up(lambda result: SingleStreamLoadGen(result=result, min_query_count=warmup_queries, 
+                                                        min_duration_ms=warmup_ms),
+                     warmup_queries, warmup_ms)
+        self.perf_result = self.create_perf_result()
         self.load_gen = SingleStreamLoadGen(result=self.perf_result,
                                             min_query_count=min_query_count,
                                             min_duration_ms=min_duration_ms)
-                
-        for q in self.load_gen.queries():         
-            #self.perf_result.add_query(q)
-            #self.perf_result.complete_query(q.id) 
-            if self.queries is not None:
-                self.query_queue.put((q.id, random.choice(self.queries)))         
-            else:
-                self.query_queue.put((q.id, None))
-            pass
+        self.set_early_stopping(early_stopping)
+        self.issue_queries()
         
         logger.info(f'issued all queries')
         return self.get_report()
     
+    def benchmark_closed_loop(self, queries=None, concurrency=1, min_query_count=100, min_duration_ms=30000,
+                              early_stopping=None):
+        self.reset()
+        self.set_queries(queries)
+        if self.queries is None:
+            logger.info(f'no queries are provided. then `SUT::predict(query_id: int)` should accept a query id and generate final model inputs itself. serilization/deserilization of queries between ServerModelRunner and workers could be avoided.')
+        self.report['mode'] = 'closed_loop'
+        self.report['concurrency'] = concurrency
+        
+        self.perf_result = self.create_perf_result()
+        self.load_gen = ClosedLoopLoadGen(result=self.perf_result,
+                                          concurrency=concurrency,
+                                          min_query_count=min_query_count,
+                                          min_duration_ms=min_duration_ms)
+        self.set_early_stopping(early_stopping)
+        self.issue_queries()
+        
+        logger.info(f'issued all queries, waiting for the last {concurrency} outstanding queries to be completed')
+        self.perf_result.wait_all_completed()
+        return {**self.get_report(),
+                'throughput/samples_per_sec': self.perf_result.get_throughput()}
+    
+    def benchmark_concurrency(self, queries=None, concurrencies=(1, 2, 4, 8, 16, 32), 
+                              min_query_count=100, min_duration_ms=30000, 
+                              saturation_threshold=0.05):
+        ''' run the closed-loop scenario at each concurrency and return the reports. 
+        the sweep stops once the throughput improves by less than `saturation_threshold` 
+        over the best one so far, and that report is marked with `saturated`.
+        '''
+        reports = []
+        best_throughput = 0
+        for concurrency in concurrencies:
+            report = self.benchmark_closed_loop(queries=queries, concurrency=concurrency, 
+                                                min_query_count=min_query_count,
+                                                min_duration_ms=min_duration_ms)
+            throughput = report['throughput/samples_per_sec']
+            report['saturated'] = throughput < best_throughput * (1 + saturation_threshold)
+            logger.info(f'concurrency {concurrency}: {throughput:.2f} samples/sec')
+            reports.append(report)
+            if report['saturated']:
+                logger.info(f'throughput saturates at concurrency {concurrency}')
+                break
+            best_throughput = max(best_throughput, throughput)
+        return reports
+    
+    def benchmark_multi_stream(self, queries=None, samples_per_frame=4, frame_interval_ms=33.3, 
+                               min_query_count=100, min_duration_ms=30000, early_stopping=None):
+        self.reset()
+        self.set_queries(queries)
+        if self.queries is None:
+            logger.info(f'no queries are provided. then `SUT::predict(query_id: int)` should accept a query id and generate final model inputs itself. serilization/deserilization of queries between ServerModelRunner and workers could be avoided.')
+        self.report['mode'] = 'multi_stream'
+        self.report['frame/samples'] = samples_per_frame
+        self.report['frame/interval_ms'] = frame_interval_ms
+        
+        self.perf_result = self.create_perf_result()
+        self.load_gen = MultiStreamLoadGen(result=self.perf_result,
+                                           samples_per_frame=samples_per_frame,
+                                           frame_interval_ms=frame_interval_ms,
+                                           min_query_count=min_query_count,
+                                           min_duration_ms=min_duration_ms)
+        self.set_early_stopping(early_stopping)
+        self.issue_queries()
+        
+        logger.info(f'issued all {self.load_gen.count_frames()} frames, waiting for them to be completed')
+        self.perf_result.wait_all_completed()
+        frame_latencies = self.perf_result.get_group_latencies(percentiles=self.percentiles, 
+                                                               min=True, avg=True, max=True)
+        return {**self.get_report(),
+                '#frames/issued': self.load_gen.count_frames(),
+                '#frames/completed': self.perf_result.count_groups(),
+                '#frames/missed': self.perf_result.count_missed_deadlines(),
+                **self.format_latencies(frame_latencies, prefix='frame_latency')}
+    
+    def benchmark_trace(self, trace_file, queries=None, time_scale=1.0, with_index=False):
+        ''' replay the arrival times recorded in `trace_file`, see `TraceLoadGen` for the format.
+        if the trace carries query indices, `queries[index]` is sent instead of a random query.
+        '''
+        self.reset()
+        self.set_queries(queries)
+        if self.queries is None:
+            logger.info(f'no queries are provided. then `SUT::predict(query_id: int)` should accept a query id and generate final model inputs itself. serilization/deserilization of queries between ServerModelRunner and workers could be avoided.')
+        self.report['mode'] = 'trace'
+        self.report['trace/time_scale'] = time_scale
+        
+        self.perf_result = self.create_perf_result()
+        self.load_gen = TraceLoadGen(result=self.perf_result,
+                                     trace_file=str(trace_file),
+                                     time_scale=time_scale,
+                                     with_index=with_index)
+        self.issue_queries()
+        
+        logger.info(f'replayed all {self.load_gen.count_entries()} queries of {trace_file}. note some queries may not be completed yet.')
+        return self.get_report()
+    
+    def benchmark_offline(self, queries=None, query_count=1000, timeout_ms=-1):
+        self.reset()
+        self.set_queries(queries)
+        if self.queries is None:
+            logger.info(f'no queries are provided. then `SUT::predict(query_id: int)` should accept a query id and generate final model inputs itself. serilization/deserilization of queries between ServerModelRunner and workers could be avoided.')
+        self.report['mode'] = 'offline'
+        
+        self.perf_result = self.create_perf_result()
+        self.load_gen = OfflineLoadGen(result=self.perf_result, query_count=query_count)
+        self.issue_queries()
+        
+        logger.info(f'issued all {query_count} queries at once, waiting for them to be completed')
+        if not self.perf_result.wait_all_completed(timeout_ms=timeout_ms):
+            logger.warning(f'not all queries are completed within {timeout_ms} ms')
+        return {**self.get_report(),
+                'throughput/samples_per_sec': self.perf_result.get_throughput()}
+    
+    def start_saturation_monitor(self):
+        self.track_saturation = True
+        self.saturation_monitor.start(self.load_gen, self.perf_result)
+    
+    def stop_saturation_monitor(self):
+        self.saturation_monitor.stop()
+        if self.saturation_monitor.saturated and self.saturation_monitor.abort:
+            # the backlog would keep the workers busy after the run and holds the queued payloads.
+            self.report['saturation/dropped'] = self.drain_query_queues()
+    
+    def set_early_stopping(self, early_stopping):
+        '''
+        With an `EarlyStopping(percentile, relative_width, confidence, max_duration_ms)`, the run 
+        goes on after `min_query_count` and `min_duration_ms` are met until the confidence interval 
+        of the latency percentile is narrower than `relative_width` of the percentile, or until 
+        `max_duration_ms`. the achieved interval is reported under `ci/`.
+        '''
+        self.early_stopping = early_stopping
+        if early_stopping is not None:
+            self.load_gen.set_early_stopping(early_stopping)
+    
+    def get_confidence_interval(self):
+        ''' the interval of the early stopping percentile at this point of the run. '''
+        percentile = self.early_stopping.percentile
+        ci = self.perf_result.get_percentile_ci(percentile, confidence=self.early_stopping.confidence)
+        res = {'ci/percentile': f'p{round(percentile*100, 3):g}',
+               'ci/confidence': self.early_stopping.confidence,
+               'ci/target_width': self.early_stopping.relative_width,
+               'ci/converged': self.load_gen.is_converged()}
+        if len(ci) != 0:
+            res.update({'ci/low': round(ci[0], 3), 'ci/high': round(ci[2], 3),
+                        'ci/relative_width': round((ci[2] - ci[0]) / ci[1], 4) if ci[1] > 0 else 0})
+        return res
+    
+    def set_queries(self, queries):
+        self.queries = queries
+        if not self.shared_queries or queries is None:
+            return
+        # the store is reused as long as the same queries are benchmarked.
+        if self.query_store is not None and self.query_store_source is queries:
+            return
+        self.release_query_store()
+        self.query_store = SharedQueryStore.create(queries)
+        self.query_store_source = queries
+    
+    def release_query_store(self):
+        if self.query_store is not None:
+            self.query_store.release()
+            self.query_store, self.query_store_source = None, None
+    
+    def get_query_index(self, index=-1):
+        ''' `index` within the queries, or a random index if `index` is negative. '''
+        if index < 0:
+            return random.randrange(len(self.queries))
+        return index % len(self.queries)
+    
+    def get_query(self, index):
+        if self.query_store is not None:
+            return self.query_store.ref(index)
+        return self.queries[index]
+    
+    def get_payload(self, query_id, index):
+        ''' the query at `index`, the index actually used is recorded if queries are recorded. '''
+        index = self.get_query_index(index)
+        if self.recorder is not None:
+            self.recorder.add_fields(query_id, {'index': index})
+        return self.get_query(index)
+    
+    def issue_queries(self):
+        if self.bulk_dispatch:
+            self.issue_queries_in_bulk()
+            return
+        
+        for q in self.load_gen.queries():         
+            if self.queries is None:
+                self.dispatch((q.id, None))
+            else:
+                self.dispatch((q.id, self.get_payload(q.id, q.index)))
+    
+    def issue_queries_in_bulk(self):
+        # split each batch among at most as many messages as queries the workers 
+        # can process concurrently, so a batch doesn't serialize on one worker.
+        max_messages = self.num_workers * self.num_worker_concurrency
+        while True:
+            batch = self.load_gen.issue_query_batch()
+            if batch is None:
+                break
+            ids, indices = batch
+            if len(ids) == 0:
+                continue
+            
+            ids = ids.tolist()
+            if self.queries is None:
+                payloads = [None] * len(ids)
+            else:
+                payloads = [self.get_payload(query_id, i) for query_id, i in zip(ids, indices.tolist())]
+            
+            messages = list(zip(ids, payloads))
+            num_messages = min(len(messages), max_messages)
+            for i in range(num_messages):
+                self.dispatch(messages[i::num_messages])
+    
     def get_latencies(self):
-        percentiles = [0.5, 0.9, 0.95, 0.97, 0.99, 0.999]
-        latencies = self.perf_result.get_latencies(percentiles=percentiles, 
+        # service latency is measured from when a query is actually issued, response latency 
+        # from when it was scheduled to be issued, which doesn't hide stalls of the issuing loop.
+        latencies = self.perf_result.get_latencies(percentiles=self.percentiles, 
                                                    min=True, avg=True, max=True)
+        response_latencies = self.perf_result.get_response_latencies(percentiles=self.percentiles, 
+                                                                     min=True, avg=True, max=True)
+        issue_lags = self.perf_result.get_issue_lags(percentiles=self.percentiles, 
+                                                     min=True, avg=True, max=True)
+        return {**self.format_latencies(latencies),
+                **self.format_latencies(response_latencies, prefix='response_latency'),
+                **self.format_latencies(issue_lags, prefix='issue_lag'),
+                **self.get_latency_breakdown()}
+    
+    def get_latency_breakdown(self):
+        ''' where the latency of a query is spent, measured with worker timestamps: in the 
+        queue to a worker, in the worker before it runs, in the sut, and back to the runner. '''
+        breakdown = {}
+        for prefix, get in [('dispatch_delay', self.perf_result.get_dispatch_delays),
+                            ('worker_queue_delay', self.perf_result.get_worker_queue_delays),
+                            ('service_time', self.perf_result.get_service_times),
+                            ('return_delay', self.perf_result.get_return_delays)]:
+            breakdown.update(self.format_latencies(get(percentiles=self.percentiles, min=True, avg=True, max=True), 
+                                                   prefix=prefix))
+        return breakdown
+    
+    def format_latencies(self, latencies, prefix='latency', percentiles=None):
         if len(latencies) == 0:
             return {}
         
-        res = {'latency/min':latencies[-3], 'latency/avg':latencies[-2], 'latency/max': latencies[-1]}
+        if percentiles is None:
+            percentiles = self.percentiles
+        res = {f'{prefix}/min':latencies[-3], f'{prefix}/avg':latencies[-2], f'{prefix}/max': latencies[-1]}
         for i, p in enumerate(percentiles):
-            res[f'latency/p{int(p*100)}'] = latencies[i]
+            res[f'{prefix}/p{round(p*100, 3):g}'] = latencies[i]
         for k in res.keys():
             res[k] = round(res[k], 3)
         return res
     
+    def get_windows(self, since=0):
+        ''' statistics of each closed time window of the current run, see `window_ms`. '''
+        windows = []
+        for w in self.perf_result.get_windows(since=since):
+            windows.append({'window': w.index,
+                            'time_ms': w.start_ms,
+                            'qps/actual': w.qps,
+                            '#queries/issued': w.num_issued,
+                            '#queries/succeeded': w.num_succeeded,
+                            '#queries/failed': w.num_failed,
+                            **self.format_latencies(w.latencies, percentiles=self.window_percentiles)})
+        return windows
+    
     def get_actual_qps(self):
         return self.perf_result.get_actual_qps()
 
     def get_report(self):
-        return {**self.report, 
-                'qps/issued': self.load_gen.get_issued_qps(), 
-                'qps/actual':self.get_actual_qps(),
-                '#queries/issued': self.load_gen.count_issued(),
-                '#queries/succeeded': self.perf_result.count_succeeded(),
-                '#queries/failed': self.perf_result.count_failed(),
-                **self.get_latencies()}
+        report = {**self.report, 
+                  'qps/issued': self.load_gen.get_issued_qps(), 
+                  'qps/actual':self.get_actual_qps(),
+                  '#queries/issued': self.load_gen.count_issued(),
+                  '#queries/succeeded': self.perf_result.count_succeeded(),
+                  '#queries/failed': self.perf_result.count_failed(),
+                  **self.get_latencies()}
+        if self.early_stopping is not None:
+            report.update(self.get_confidence_interval())
+        if self.track_saturation:
+            report.update(self.saturation_monitor.get_report())
+        if self.recorder is not None:
+            report.update({'records/path': str(self.recorder.path), 'records/run': self.recorder.run})
+        if self.dispatcher is not None:
+            # per worker lists, to check how evenly the policy spreads the load.
+            report.update(self.dispatcher.get_stats())
+        return report
 
     def get_tensorboard_scalars(self):
         legends = ['qps/issued', 'qps/actual', 'qps/target', 
                    "#queries/succeeded", "#queries/failed", "#queries/issued"]
-        legends += [f"latency/p{int(p*100)}" for p in [0.5, 0.9, 0.95, 0.97, 0.99, 0.999]]
-        legends += ['latency/min', 'latency/avg', 'latency/max']
+        for prefix in ['latency', 'response_latency', 'issue_lag', 
+                       'dispatch_delay', 'worker_queue_delay', 'service_time', 'return_delay']:
+            legends += [f"{prefix}/p{round(p*100, 3):g}" for p in self.percentiles]
+            legends += [f'{prefix}/min', f'{prefix}/avg', f'{prefix}/max']
         return legends
 
     def write_tensorboard_logs(self):
@@ -277,86 +828,153 @@ class ServerModelRunner:
         writer.add_custom_scalars(layout)
       
         step = 0
+        last_report_time = 0
+        perf_result, next_window = None, 0
         while True:
             if self.done:
-                break       
-            report = self.get_report()
-            logger.info(report)
-            for k, v in report.items():
-                if k.split('/')[0] in layout[category]:
-                    writer.add_scalar(k, v, step)                             
-            time.sleep(wait_secs)
-            step += 1     
+                break
+            # a run creates its perf result before its load gen.
+            if self.perf_result is None or self.load_gen is None:
+                time.sleep(1)
+                continue
+            
+            # windows are cheap to poll and show transient degradation that the 
+            # since-start report smooths out.
+            if perf_result is not self.perf_result:
+                perf_result, next_window = self.perf_result, 0
+            for window in self.get_windows(since=next_window):
+                for k, v in window.items():
+                    if k not in ['window', 'time_ms']:
+                        writer.add_scalar(f'window/{k}', v, window['window'])
+                next_window = window['window'] + 1
+            
+            if time.time() - last_report_time >= wait_secs:
+                last_report_time = time.time()
+                report = self.get_report()
+                logger.info(report)
+                for k, v in report.items():
+                    if k.split('/')[0] in layout[category]:
+                        writer.add_scalar(k, v, step)                             
+                step += 1
+            time.sleep(1)
         writer.close()
     
-    # This function is copied from legacy code. In the future, if we need this 
-    # function, we should refactor it.
-    def search_qps(self, queries,
-                       latency_bound_ms=100, percentile=90, 
-                       init_qps=10, min_duration_ms=10000,
-                       log_dir='.'):
-        logger.info(f'running in server mode, searching for max qps given P{percentile} latency is {latency_bound_ms}ms')
-
-        self.report['latency_bound_ms'] = latency_bound_ms
-        self.report['percentile'] = percentile
-        eps = 0.05
-        self.run_server_mode(queries=queries, target_qps=init_qps, min_duration_ms=min_duration_ms)
-        latencies = self.parse_latency_result()
-        start_latency = latencies[f'p{percentile}']
-        message = {'target_qps': init_qps, 'latency': latencies}
-        logger.info(message) 
-        if abs(start_latency - latency_bound_ms) / latency_bound_ms < eps: # stop when we are very close
-            logger.info(self.get_report())
-            return init_qps
-      
-        if start_latency < latency_bound_ms:
-            target_qps, last_latency = init_qps, start_latency         
-            while last_latency < latency_bound_ms:
-                left = target_qps
+    def search_qps(self, queries=None, latency_bound_ms=100, percentile=0.9, init_qps=10, 
+                   probe_ms=10000, tolerance=0.05, max_probes=20, arrival=None,
+                   warmup_queries=0, warmup_ms=0, drain_timeout_ms=10000,
+                   min_duration_ms=None, log_dir=None):
+        '''
+        Search the max qps at which the `percentile` latency, a fraction such as 0.9 for the p90, 
+        stays within `latency_bound_ms`. The qps is doubled from `init_qps` until a probe of `probe_ms` violates the bound, then bisected 
+        between the highest passing and the lowest failing qps until they are within `tolerance`. 
+        
+        The workers stay up and warm across probes, `warmup_queries` and `warmup_ms` only warm up 
+        before the first probe. A probe is aborted as soon as the bound is clearly violated, see 
+        `is_sla_violated`, and its backlog is dropped before the next probe.
+        
+        Returns the knee, i.e. the highest passing qps or None, with the report of every probe.
+        
+        Unlike earlier versions, `percentile` is a fraction rather than a percent, 90 is rejected, 
+        and a report is returned instead of the qps. `min_duration_ms` is still accepted as an alias 
+        of `probe_ms`, and `log_dir` is accepted but ignored, it never had an effect.
+        '''
+        if min_duration_ms is not None:
+            probe_ms = min_duration_ms
+        if log_dir is not None:
+            logger.warning('the log_dir of search_qps is ignored, enable tensorboard on the runner instead')
+        if not 0 < percentile < 1:
+            raise ValueError(f'percentile {percentile} is not a fraction in (0, 1), e.g. 0.9 for the p90')
+        logger.info(f'searching for the max qps given p{round(percentile*100, 3):g} latency is within {latency_bound_ms} ms')
+        self.reset()
+        self.set_queries(queries)
+        self.warm_up(lambda result: ServerLoadGen(result=result, target_qps=init_qps, 
+                                                  min_query_count=warmup_queries, min_duration_ms=warmup_ms,
+                                                  arrival=arrival),
+                     warmup_queries, warmup_ms)
+        warmup = {k: v for k, v in self.report.items() if k.startswith('warmup')}
+        
+        probes = []
+        passed, failed = None, None
+        target_qps = init_qps
+        for _ in range(max_probes):
+            report = self.probe_qps(queries, target_qps, latency_bound_ms, percentile, probe_ms, arrival, drain_timeout_ms)
+            logger.info(f"probe at {target_qps:.2f} qps: latency {report['search/latency']} ms, "
+                        f"{'passed' if report['search/passed'] else 'failed'}{', aborted' if report['search/aborted'] else ''}")
+            probes.append(report)
+            if report['search/passed']:
+                passed = target_qps if passed is None else max(passed, target_qps)
+            else:
+                failed = target_qps if failed is None else min(failed, target_qps)
+            
+            if failed is None:
                 target_qps *= 2
-                self.run_server_mode(queries=queries, target_qps=target_qps, min_duration_ms=min_duration_ms, log_dir=log_dir)
-                latencies = self.parse_latency_result()
-                last_latency = latencies[f'p{percentile}']
-                message = {'target_qps': target_qps, 'latency': latencies}
-                logger.info(message)
-            right = target_qps
-        else:
-            target_qps, last_latency = init_qps, start_latency
-            while last_latency > latency_bound_ms:
-                right = target_qps
+            elif passed is None:
                 target_qps /= 2
-                self.run_server_mode(queries=queries, target_qps=target_qps, min_duration_ms=min_duration_ms, log_dir=log_dir)
-                latencies = self.parse_latency_result()
-                cur_latency = latencies[f'p{percentile}']
-                message = {'target_qps': target_qps, 'latency': latencies}
-                logger.info(message)
-                if abs(cur_latency - latency_bound_ms) / latency_bound_ms < eps: # stop when we are very close
-                    return target_qps
-                if abs(last_latency - cur_latency) / last_latency < eps:
-                    raise RuntimeError(f'failed to search a feasible target qps, may be the p{percentile} latency of {latency_bound_ms} ms is unreachable')
-                last_latency = cur_latency
-            left = target_qps
-        
-        target_qps = (left + right) / 2
-        while left < right and abs(right - left) / left > 0.01:
-            self.run_server_mode(queries=queries, target_qps=target_qps, min_duration_ms=min_duration_ms, log_dir=log_dir)
-            latencies = self.parse_latency_result()
-            cur_latency = latencies[f'p{percentile}']
-            message = {'target_qps': target_qps, 'latency': latencies}
-            logger.info(message)
-            if abs(cur_latency - latency_bound_ms) / latency_bound_ms < eps:
-                logger.info(self.get_report())
-                return target_qps
-            
-            if cur_latency < latency_bound_ms:
-                left = target_qps
+            elif (failed - passed) / passed <= tolerance:
+                break
             else:
-                right = target_qps           
-            target_qps = (left + right) / 2
+                target_qps = (passed + failed) / 2
+        else:
+            logger.warning(f'the search is not converged in {max_probes} probes')
+        
+        if passed is None:
+            logger.warning(f'no probed qps meets the p{round(percentile*100, 3):g} latency bound of {latency_bound_ms} ms')
+        return {'qps/max': passed,
+                'latency_bound_ms': latency_bound_ms,
+                'percentile': f'p{round(percentile*100, 3):g}',
+                **warmup,
+                'probes': probes}
+    
+    def probe_qps(self, queries, target_qps, latency_bound_ms, percentile, probe_ms, arrival, drain_timeout_ms):
+        ''' run a server mode probe at `target_qps` while `watch_sla` aborts it on a violation. '''
+        stop = threading.Event()
+        # `load_gen` is left as it is, the tensorboard thread may be reporting the previous probe.
+        watcher = threading.Thread(target=self.watch_sla, args=(latency_bound_ms, percentile, stop, self.load_gen))
+        watcher.start()
+        try:
+            self.benchmark(queries=queries, target_qps=target_qps, min_query_count=0, 
+                           min_duration_ms=probe_ms, arrival=arrival)
+        finally:
+            stop.set()
+            watcher.join()
         
-        logger.info(self.get_report())
-        return target_qps
-        #raise RuntimeError(f'failed to search for the target qps, may be the p{percentile} latency of {latency_bound_ms} ms is unreachable')
+        # the backlog of an aborted probe is not worth waiting for, the next probe drops it.
+        aborted = self.load_gen.is_stopped()
+        completed = not aborted and self.perf_result.wait_all_completed(timeout_ms=drain_timeout_ms)
+        latency = self.perf_result.get_latencies([percentile], min=False, avg=False, max=False)
+        latency = round(latency[0], 3) if latency else None
+        return {**self.get_report(),
+                'search/latency': latency,
+                'search/passed': completed and latency is not None and latency <= latency_bound_ms,
+                'search/aborted': aborted}
+    
+    def watch_sla(self, latency_bound_ms, percentile, stop, previous_load_gen=None, interval_ms=100):
+        # wait for the load gen of the probe, `benchmark` creates its perf result before it.
+        while self.load_gen is None or self.load_gen is previous_load_gen:
+            if stop.wait(0.01):
+                return
+        load_gen, perf_result = self.load_gen, self.perf_result
+        while not stop.wait(interval_ms / 1e3):
+            if self.is_sla_violated(load_gen, perf_result, latency_bound_ms, percentile):
+                logger.info(f'p{round(percentile*100, 3):g} latency is clearly above {latency_bound_ms} ms, abort the probe')
+                load_gen.stop()
+                return
+    
+    @staticmethod
+    def is_sla_violated(load_gen, perf_result, latency_bound_ms, percentile, confidence=0.95):
+        '''
+        The bound is clearly violated once the confidence interval of the percentile is above it, 
+        or once more than `1 - percentile` of the issued queries are outstanding for longer than 
+        the bound, which counts queries stuck in an overloaded system that never complete.
+        '''
+        ci = perf_result.get_percentile_ci(percentile, confidence=confidence)
+        if len(ci) != 0 and ci[0] > latency_bound_ms:
+            return True
+        issued = load_gen.count_issued()
+        outstanding = issued - perf_result.count_succeeded() - perf_result.count_failed()
+        # at most the queries issued within the last `latency_bound_ms` are outstanding but not late.
+        late = outstanding - load_gen.get_issued_qps() * latency_bound_ms / 1e3
+        return late >= 1 and late > (1 - percentile) * issued
     
     def __enter__(self):
         self.start()
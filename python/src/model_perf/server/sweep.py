@@ -0,0 +1,159 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import re
+import json
+import hashlib
+import itertools
+from pathlib import Path
+import numpy as np
+from .server_model_runner import ServerModelRunner
+from ..logger import logger
+
+
+def stable_repr(value):
+    '''
+    turn a value that is not plain json into one that is the same in every process. a value
+    whose repr has its address, i.e. the default repr of an object, can't key a cached result.
+    '''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    text = repr(value)
+    if re.search(r' at 0x[0-9a-fA-F]+', text):
+        raise ValueError(f'{text} of the sweep configuration has no stable repr to key its cached result, '
+                         f'give it a __repr__ or pass plain values instead')
+    return text
+
+
+class Sweep:
+    '''
+    Benchmark a sut at each point of a search space of `ServerModelRunner` and sut constructor
+    parameters, e.g. `runner_space={'num_workers': [1, 2, 4], 'num_threads': [1, 2]}`. A space
+    is either a dict of lists, whose product is the grid, or a list of dicts with the points.
+
+    Each point has its own runner, which is started, benchmarked with `benchmark` and stopped.
+    Its report is cached in `cache_dir` under a key of the configuration, so an interrupted
+    sweep resumes from the points that are not finished yet. `queries` are not part of the key,
+    use another `cache_dir` for other queries. Other values of the key that are not plain json,
+    e.g. an `EarlyStopping` in `benchmark_kwargs`, are keyed by their repr, see `stable_repr`.
+    Points run one at a time, otherwise they would compete for the same cores.
+    '''
+    def __init__(self, sut_cls, runner_space, sut_space=None, sut_args=(), sut_kwargs=None,
+                 benchmark='benchmark_offline', benchmark_kwargs=None, queries=None,
+                 cache_dir='sweep_results'):
+        self.sut_cls = sut_cls
+        self.runner_space = runner_space
+        self.sut_space = sut_space
+        self.sut_args = tuple(sut_args)
+        self.sut_kwargs = sut_kwargs or {}
+        self.benchmark = benchmark
+        self.benchmark_kwargs = benchmark_kwargs or {}
+        self.queries = queries
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def expand(space):
+        if space is None:
+            return [{}]
+        if isinstance(space, dict):
+            names = list(space.keys())
+            return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+        return [dict(point) for point in space]
+
+    def points(self):
+        ''' `(runner_params, sut_params)` of every point of the sweep. '''
+        return [(runner_params, sut_params)
+                for runner_params in self.expand(self.runner_space)
+                for sut_params in self.expand(self.sut_space)]
+
+    def get_config(self, runner_params, sut_params):
+        return {'sut': self.sut_cls.__name__,
+                'sut_args': list(self.sut_args),
+                'runner': runner_params,
+                'sut_params': {**self.sut_kwargs, **sut_params},
+                'benchmark': self.benchmark,
+                'benchmark_kwargs': self.benchmark_kwargs}
+
+    def get_cache_file(self, config):
+        key = hashlib.sha1(json.dumps(config, sort_keys=True, default=stable_repr).encode()).hexdigest()
+        return self.cache_dir / f'{key[:16]}.json'
+
+    def run_point(self, runner_params, sut_params):
+        sut_kwargs = {**self.sut_kwargs, **sut_params}
+        with ServerModelRunner(self.sut_cls, **runner_params)(*self.sut_args, **sut_kwargs) as runner:
+            return getattr(runner, self.benchmark)(queries=self.queries, **self.benchmark_kwargs)
+
+    def run(self):
+        '''
+        Run the points without a cached report and return the result of every point, a dict
+        with its `config`, its `report` and whether it is `cached`. a point that raises is
+        reported with its `error` and is not cached, it runs again when the sweep resumes.
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        results = []
+        points = self.points()
+        for i, (runner_params, sut_params) in enumerate(points):
+            config = self.get_config(runner_params, sut_params)
+            cache_file = self.get_cache_file(config)
+            if cache_file.exists():
+                with open(cache_file) as f:
+                    results.append({**json.load(f), 'cached': True})
+                logger.info(f'point {i + 1}/{len(points)} {runner_params} {sut_params} is cached in {cache_file}')
+                continue
+
+            logger.info(f'running point {i + 1}/{len(points)} {runner_params} {sut_params}')
+            try:
+                report = self.run_point(runner_params, sut_params)
+            except Exception as e:
+                logger.warning(f'point {runner_params} {sut_params} failed', exc_info=e)
+                results.append({'config': config, 'error': str(e), 'cached': False})
+                continue
+
+            result = {'config': json.loads(json.dumps(config, default=stable_repr)), 'report': report}
+            # write to a temporary file first, so an interrupted write doesn't leave a broken cache.
+            tmp_file = cache_file.with_suffix('.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(result, f, indent=2, default=lambda o: o.item() if hasattr(o, 'item') else str(o))
+            os.replace(tmp_file, cache_file)
+            results.append({**result, 'cached': False})
+        logger.info(f'results of {len(points)} points:\n{self.format_table(self.rank(results))}')
+        return results
+
+    @staticmethod
+    def rank(results, by=None, columns=('latency/p50', 'latency/p90', 'latency/p99')):
+        '''
+        A row per succeeded point with its runner and sut parameters, its throughput and the
+        latency `columns`, sorted by `by` from the highest. `by` defaults to the throughput of
+        the benchmark, i.e. `throughput/samples_per_sec` if reported, else `qps/actual`.
+        '''
+        ranked = []
+        for result in results:
+            if 'report' not in result:
+                continue
+            report = result['report']
+            metric = by
+            if metric is None:
+                metric = 'throughput/samples_per_sec' if 'throughput/samples_per_sec' in report else 'qps/actual'
+            row = {**result['config']['runner'], **result['config']['sut_params'],
+                   metric: report.get(metric)}
+            row.update({c: report.get(c) for c in columns})
+            value = report.get(metric)
+            ranked.append((value if value is not None else float('-inf'), row))
+        ranked.sort(key=lambda r: r[0], reverse=True)
+        return [row for _, row in ranked]
+
+    @staticmethod
+    def format_table(rows):
+        if not rows:
+            return ''
+        columns = list(dict.fromkeys(k for row in rows for k in row.keys()))
+        cells = [[str(row.get(c, '')) if not isinstance(row.get(c), float) else f'{row[c]:.3f}' for c in columns]
+                 for row in rows]
+        widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+        lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths)),
+                 '  '.join('-' * w for w in widths)]
+        lines += ['  '.join(v.ljust(w) for v, w in zip(r, widths)) for r in cells]
+        return '\n'.join(line.rstrip() for line in lines)
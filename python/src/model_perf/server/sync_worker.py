@@ -1,15 +1,17 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import queue
 import threading
 import multiprocessing
 from .worker import Worker
+from .load_gen import clock_ns
 from ..logger import logger
 
 
 class SyncWorker(Worker):
-    def __init__(self, sut_cls, query_queue, response_queue, num_threads=1):
-        super().__init__(sut_cls, query_queue, response_queue)
+    def __init__(self, sut_cls, query_queue, response_queue, num_threads=1, **kwargs):
+        super().__init__(sut_cls, query_queue, response_queue, **kwargs)
         self.num_threads = num_threads
         self.worker_threads = []
 
@@ -17,27 +19,42 @@ class SyncWorker(Worker):
         # notify the main thread that the thread is ready for processing
         self.response_queue.put((None, 'model created', None))
         inference_call = getattr(self.sut_obj, self.infer_call)
-        while True:          
-            query_sample_id, query = self.query_queue.get()
-            if query is None:
-                query = (query_sample_id,)
-            if query_sample_id is None:
-                self.query_queue.put((query_sample_id, query))
-                break
-            response = {'error': False}
-            try:              
-                result = inference_call(*query)
-                if result is dict:
-                    response.update(result)
-            except Exception as e:
-                response['error'] = True              
-                logger.warning(f'error happened during processing query {query_sample_id} {query}', exc_info=e)
-            self.response_queue.put((query_sample_id, response))             
+        completions = self.create_completion_batch()
+        should_stop = False
+        while not should_stop:
+            # don't let pending completions wait for the next query longer than their deadline.
+            try:
+                message = self.query_queue.get(timeout=completions.timeout())
+            except queue.Empty:
+                completions.flush()
+                continue
+            # timestamps use the clock of the load gen, so that the runner can split the latency 
+            # into dispatch delay, worker queue delay, service time and return delay.
+            dequeued_at_ns = clock_ns()
+            for query_sample_id, query in self.unpack_queries(message):
+                if query is None:
+                    query = (query_sample_id,)
+                query = self.query_resolver.resolve(query)
+                if query_sample_id is None:
+                    self.query_queue.put((query_sample_id, query))
+                    should_stop = True
+                    break
+                response = {'error': False, 'dequeued_at_ns': dequeued_at_ns, 'started_at_ns': clock_ns()}
+                try:              
+                    result = inference_call(*query)
+                    response['finished_at_ns'] = clock_ns()
+                    if isinstance(result, dict):
+                        response.update(result)
+                except Exception as e:
+                    response['error'] = True              
+                    logger.warning(f'error happened during processing query {query_sample_id} {query}', exc_info=e)
+                completions.add(query_sample_id, response)
+        completions.flush()
     
     def start(self):
         pid = multiprocessing.current_process().pid
         tid = threading.get_ident()       
-        self.sut_obj = self.sut_cls(*self.sut_args[0], **self.sut_args[1])         
+        self.sut_obj = self.create_sut()         
         if self.setup_call is not None:
             getattr(self.sut_obj, self.setup_call)()         
         logger.info(f'sut {self.sut_obj} is hosted in process {pid} thread {tid} worker {self}')
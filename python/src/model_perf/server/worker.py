@@ -1,11 +1,84 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import time
+import queue
+import inspect
+from .query_store import SharedQueryResolver
+from .affinity import set_affinity, set_thread_budget
 from ..logger import logger
 
 
+class CompletionBatch:
+    '''
+    Responses waiting to be sent to the runner in a single message, which is flushed once it 
+    has `max_size` responses or its oldest response waited for `max_wait_ms`. A batch is not 
+    thread-safe, each thread of a worker has its own. `max_size` of 1 sends every response 
+    as soon as it is added, in the `(query_id, response)` form. if `worker_id` is set, it is 
+    added to each response as its `worker`.
+    '''
+    def __init__(self, response_queue, max_size=1, max_wait_ms=1.0, worker_id=None):
+        self.response_queue = response_queue
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1e3
+        self.worker_id = worker_id
+        self.responses = []
+        self.started_at = 0
+    
+    def add(self, query_id, response):
+        if self.worker_id is not None:
+            response['worker'] = self.worker_id
+        if self.max_size <= 1:
+            self.response_queue.put((query_id, response))
+            return
+        if not self.responses:
+            self.started_at = time.monotonic()
+        self.responses.append((query_id, response))
+        if len(self.responses) >= self.max_size or self.timeout() == 0:
+            self.flush()
+    
+    def timeout(self):
+        ''' seconds until the batch has to be flushed, None if it is empty. '''
+        if not self.responses:
+            return None
+        return max(0, self.started_at + self.max_wait - time.monotonic())
+    
+    def flush(self):
+        if self.responses:
+            self.response_queue.put(self.responses)
+            self.responses = []
+
+
+class InProcessResponseQueue:
+    '''
+    Stands in for the response queue of workers running as threads of the runner process. 
+    A response is completed by the worker thread that puts it, with `complete(message)`, 
+    instead of being pickled to the response thread of the runner. only the ready messages 
+    of workers are queued, for the runner to wait for them with `get`.
+    '''
+    def __init__(self, complete):
+        self.complete = complete
+        self.ready_queue = queue.SimpleQueue()
+    
+    def put(self, message):
+        if isinstance(message, tuple) and len(message) == 3:
+            self.ready_queue.put(message)
+        else:
+            self.complete(message)
+    
+    def get(self, block=True, timeout=None):
+        return self.ready_queue.get(block=block, timeout=timeout)
+    
+    def empty(self):
+        return self.ready_queue.empty()
+
+
 class Worker:
-    def __init__(self, sut_cls, query_queue, response_queue):
+    # methods of a sut that run a query, see `detect_sut_functions`.
+    infer_call_names = ['forward', 'predict', 'run', 'infer', 'inference', 'execute']
+    
+    def __init__(self, sut_cls, query_queue, response_queue, completion_batch_size=1, completion_batch_ms=1.0,
+                 cpus=None, intra_op_num_threads=None, worker_id=None):
         self.sut_cls = sut_cls
         self.sut_args = ([], {})
         self.sut_obj = None
@@ -14,22 +87,61 @@ class Worker:
         
         self.query_queue = query_queue
         self.response_queue = response_queue
+        # completions are sent in batches of up to `completion_batch_size` responses, 
+        # each waiting at most `completion_batch_ms` for the batch to fill.
+        self.completion_batch_size = completion_batch_size
+        self.completion_batch_ms = completion_batch_ms
+        # the cpus the worker process is pinned to and the threads each query may use, 
+        # see `create_sut`.
+        self.cpus = cpus
+        self.intra_op_num_threads = intra_op_num_threads
+        # the index of the worker, reported in responses when the runner records queries.
+        self.worker_id = worker_id
+        # turns `SharedQueryRef`s sent by the runner back into queries.
+        self.query_resolver = SharedQueryResolver()
     
     def __call__(self, *args, **kwds):
         self.sut_args = (args, kwds)
         return self
 
+    def create_sut(self):
+        ''' pin the process and set its thread budget before the sut creates its thread pools. 
+        the budget is passed to the sut if its constructor has an `intra_op_num_threads` argument. '''
+        if self.cpus is not None:
+            set_affinity(self.cpus)
+        args, kwds = self.sut_args
+        if self.intra_op_num_threads is not None:
+            set_thread_budget(self.intra_op_num_threads)
+            try:
+                params = inspect.signature(self.sut_cls).parameters
+            except (TypeError, ValueError):
+                params = {}
+            if 'intra_op_num_threads' in params and 'intra_op_num_threads' not in kwds:
+                kwds = {**kwds, 'intra_op_num_threads': self.intra_op_num_threads}
+        return self.sut_cls(*args, **kwds)
+    
     def detect_sut_functions(self):
         for fun in dir(self.sut_cls):
             if fun.lower() in ['setup', 'start', 'init', 'open', 'create', 'load']:
                 self.setup_call = fun
-            if fun.lower() in ['forward', 'predict', 'run', 'infer', 'inference', 'execute']:
+            if fun.lower() in self.infer_call_names:
                 self.infer_call = fun
             if fun.lower() in ['teardown', 'stop', 'destroy', 'close', 'exit', 'quit', 'clear', 'clean', 'cleanup', '__del__']:
                 self.teardown_call = fun
         
         logger.info(f'sut: {self.sut_cls.__name__}, setup_call: {self.setup_call}, inference_call: {self.infer_call}, teardown_call: {self.teardown_call}')    
     
+    @staticmethod
+    def unpack_queries(message):
+        ''' a message is either a single `(query_id, query)` or a list of them sent in bulk. '''
+        if isinstance(message, list):
+            return message
+        return [message]
+    
+    def create_completion_batch(self):
+        return CompletionBatch(self.response_queue, max_size=self.completion_batch_size, 
+                               max_wait_ms=self.completion_batch_ms, worker_id=self.worker_id)
+    
     def start(self):
         raise NotImplementedError()
         
@@ -0,0 +1,32 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import unittest
+from unittest import mock
+from model_perf.server import affinity
+from model_perf.server.affinity import parse_cpu_list, plan_affinity
+
+
+class TestAffinity(unittest.TestCase):
+    def test_parse_cpu_list(self):
+        self.assertEqual(parse_cpu_list('0-3,8,10-11\n'), [0, 1, 2, 3, 8, 10, 11])
+    
+    @mock.patch.object(affinity, 'get_available_cpus', lambda: list(range(8)))
+    def test_even_split(self):
+        self.assertEqual(plan_affinity(4), [[0, 1], [2, 3], [4, 5], [6, 7]])
+        self.assertEqual(plan_affinity(3), [[0, 1], [2, 3], [4, 5]])
+        with self.assertRaises(ValueError):
+            plan_affinity(3, cores_per_worker=3)
+    
+    @mock.patch.object(affinity, 'get_cpu_domains', lambda domain: [[0, 1, 2, 4, 5], [3, 6, 7, 8, 9]])
+    def test_domains(self):
+        # a worker doesn't straddle two domains as long as it fits in one.
+        self.assertEqual(plan_affinity(4, cores_per_worker=2, domain='numa'), [[0, 1], [2, 4], [3, 6], [7, 8]])
+        self.assertEqual(plan_affinity(2, domain='numa', node=1), [[3, 6], [7, 8]])
+        self.assertEqual(plan_affinity(3, cores_per_worker=3, domain='numa'), [[0, 1, 2], [3, 6, 7], [4, 5, 8]])
+        with self.assertRaises(ValueError):
+            plan_affinity(1, domain='numa', node=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,13 @@
 # Licensed under the MIT License.
 
 import unittest
-from model_perf.server.load_gen import ServerLoadGen, PerfResult
+import random
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+from model_perf.server.load_gen import ServerLoadGen, QpsSchedule, ArrivalProcess, TraceLoadGen, SingleStreamLoadGen, ClosedLoopLoadGen, OfflineLoadGen, MultiStreamLoadGen, PerfResult, LatencyHistogram, Query, EarlyStopping, clock_ns
 
 
 class TestLoadGen(unittest.TestCase):
@@ -35,6 +41,256 @@ class TestLoadGen(unittest.TestCase):
         print(f'actual qps {actual_qps}')
         self.assertAlmostEqual(actual_qps, 1000, delta=10)
 
+    def test_offline(self):
+        perf_result = PerfResult()
+        load_gen = OfflineLoadGen(perf_result, query_count=100)
+        ids = [q.id for q in load_gen.queries()]
+        self.assertEqual(len(ids), 100)
+        self.assertFalse(perf_result.wait_all_completed(timeout_ms=10))
+        for id in ids:
+            perf_result.complete_query(id)
+        self.assertTrue(perf_result.wait_all_completed())
+        self.assertEqual(perf_result.count_succeeded(), 100)
+
+    def test_multi_stream(self):
+        perf_result = PerfResult()
+        # a frame is issued late when the issuing thread stalls, the interval leaves room for 
+        # stalls of the machine so that only the slow frame misses its deadline.
+        load_gen = MultiStreamLoadGen(perf_result, samples_per_frame=3, frame_interval_ms=50,
+                                      min_query_count=30, min_duration_ms=0)
+        queries = list(load_gen.queries())
+        self.assertEqual(len(queries), 30)
+        self.assertEqual(load_gen.count_frames(), 10)
+        for q in queries:
+            # queries of the first frame miss the deadline of 50 ms.
+            latency_ms = 100 if q.group == queries[0].group else 1
+            perf_result.complete_query(q.id, latency_ms=latency_ms)
+        self.assertEqual(perf_result.count_groups(), 10)
+        self.assertEqual(perf_result.count_missed_deadlines(), 1)
+        self.assertAlmostEqual(perf_result.get_group_latencies([0.5])[0], 1.0, delta=0.01)
+
+    def test_closed_loop(self):
+        perf_result = PerfResult()
+        load_gen = ClosedLoopLoadGen(perf_result, concurrency=4, min_query_count=20, min_duration_ms=0)
+        queries = load_gen.issue_query()
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(load_gen.count_outstanding(), 4)
+        perf_result.complete_query(queries[0].id)
+        perf_result.complete_query(queries[1].id)
+        self.assertEqual(len(load_gen.issue_query()), 2)
+        self.assertEqual(load_gen.count_issued(), 6)
+    
+    def test_single_stream(self):
+        perf_result = PerfResult()
+        load_gen = SingleStreamLoadGen(perf_result, min_query_count=10, min_duration_ms=0)
+        num_issued = 0
+        for q in load_gen.queries():
+            num_issued += 1
+            perf_result.complete_query(q.id)
+        self.assertEqual(num_issued, 10)
+        self.assertEqual(perf_result.count_succeeded(), 10)
+
+    def test_trace(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_file = os.path.join(tmp_dir, 'trace.csv')
+            with open(csv_file, 'w') as f:
+                f.write('offset_us,index\n1000000,3\n1000000,1\n1010000,2\n1030000,0\n')
+            bin_file = os.path.join(tmp_dir, 'trace.bin')
+            with open(bin_file, 'wb') as f:
+                f.write(struct.pack('8q', 1000000, 3, 1000000, 1, 1010000, 2, 1030000, 0))
+            self.assertEqual(TraceLoadGen.read_trace(csv_file), 
+                             TraceLoadGen.read_trace(bin_file, with_index=True))
+            
+            perf_result = PerfResult()
+            load_gen = TraceLoadGen(perf_result, csv_file, time_scale=2.0)
+            queries = [(q.index, q.issued_at) for q in load_gen.queries()]
+        self.assertEqual([q[0] for q in queries], [3, 1, 2, 0])
+        span = queries[-1][1] - queries[0][1]
+        self.assertAlmostEqual(span.total_seconds(), 0.06, delta=0.01)
+
+    def test_qps_schedule(self):
+        schedule = QpsSchedule.staircase(qps=[500, 2000], durations_ms=[500, 500])
+        self.assertEqual(schedule.num_steps(), 2)
+        self.assertEqual(schedule.step_at(600), 1)
+        self.assertAlmostEqual(QpsSchedule.ramp(100, 200, 1000, num_steps=4).qps_at(500), 150)
+        
+        perf_result = PerfResult()
+        load_gen = ServerLoadGen(perf_result, schedule=schedule, min_query_count=0, min_duration_ms=1000)
+        for q in load_gen.queries():
+            perf_result.complete_query(q.id)
+        self.assertEqual(perf_result.get_tags(), [0, 1])
+        self.assertAlmostEqual(perf_result.count_tag_issued(0), 250, delta=60)
+        self.assertAlmostEqual(perf_result.count_tag_issued(1), 1000, delta=120)
+        self.assertEqual(perf_result.count_tag_succeeded(1), perf_result.count_tag_issued(1))
+
+    def test_arrival_processes(self):
+        processes = [ArrivalProcess.poisson(), ArrivalProcess.constant(), ArrivalProcess.pareto(shape=2.5),
+                     ArrivalProcess.on_off(on_ms=20, off_ms=30), 
+                     ArrivalProcess.mmpp(rate_factors=[10, 1], mean_dwell_ms=[0.5, 2])]
+        for arrival in processes:
+            load_gen = ServerLoadGen(PerfResult(), target_qps=2000, min_query_count=0, 
+                                     min_duration_ms=1000, arrival=arrival)
+            for q in load_gen.queries():
+                pass
+            self.assertAlmostEqual(load_gen.count_issued(), 2000, delta=400, msg=arrival.name())
+
+    def test_issue_query_batch(self):
+        perf_result = PerfResult()
+        load_gen = ServerLoadGen(perf_result, target_qps=10000, min_query_count=1000, min_duration_ms=0)
+        num_issued = 0
+        while True:
+            batch = load_gen.issue_query_batch()
+            if batch is None:
+                break
+            ids, indices = batch
+            self.assertEqual(len(ids), len(indices))
+            self.assertTrue((indices == -1).all())
+            num_issued += len(ids)
+        self.assertEqual(num_issued, load_gen.count_issued())
+
+    def test_coordinated_omission(self):
+        perf_result = PerfResult()
+        load_gen = ServerLoadGen(perf_result, target_qps=1000, min_query_count=0, min_duration_ms=200)
+        for i, q in enumerate(load_gen.queries()):
+            # stall the issuing loop once, queries scheduled during the stall are issued late.
+            if i == 10:
+                time.sleep(0.05)
+            perf_result.complete_query(q.id, latency_ms=1.0)
+        service = perf_result.get_latencies([], min=False, avg=False, max=True)
+        response = perf_result.get_response_latencies([], min=False, avg=False, max=True)
+        issue_lag = perf_result.get_issue_lags([], min=False, avg=False, max=True)
+        self.assertAlmostEqual(service[0], 1.0, delta=0.01)
+        self.assertGreater(issue_lag[0], 40)
+        self.assertAlmostEqual(response[0], service[0] + issue_lag[0], delta=0.1)
+
+    def test_complete_queries(self):
+        perf_result = PerfResult()
+        load_gen = OfflineLoadGen(perf_result, query_count=100)
+        ids = np.array([q.id for q in load_gen.queries()], dtype=np.int64)
+        errors = np.zeros(len(ids), dtype=bool)
+        errors[:10] = True
+        perf_result.complete_queries(ids[:50], error=errors[:50], latency_ms=np.full(50, 2.0, dtype=np.float32))
+        perf_result.complete_queries(ids[50:])
+        self.assertTrue(perf_result.wait_all_completed(timeout_ms=0))
+        self.assertEqual(perf_result.count_failed(), 10)
+        self.assertEqual(perf_result.count_succeeded(), 90)
+        self.assertAlmostEqual(perf_result.get_latencies([], min=True, avg=False, max=False)[0], 0, delta=2.0)
+        with self.assertRaises(ValueError):
+            perf_result.complete_queries(ids, error=errors[:1])
+
+    def test_early_stopping(self):
+        # a deterministic sequence spread evenly over 1-2 ms, the true p90 is 1.9 ms.
+        latency_ms = lambda i: 1 + (i * 0.6180339887) % 1
+        perf_result = PerfResult()
+        load_gen = SingleStreamLoadGen(perf_result, min_query_count=10, min_duration_ms=0)
+        load_gen.set_early_stopping(EarlyStopping(percentile=0.9, relative_width=0.05, 
+                                                  max_duration_ms=60000, check_interval_ms=0))
+        for i, q in enumerate(load_gen.queries()):
+            perf_result.complete_query(q.id, latency_ms=latency_ms(i))
+            if perf_result.count_succeeded() == 10:
+                # too few latencies to bound the p99.
+                self.assertEqual(perf_result.get_percentile_ci(0.99), [])
+        self.assertTrue(load_gen.is_converged())
+        # the first query count whose interval is within 5% of the p90.
+        self.assertEqual(load_gen.count_issued(), 140)
+        low, p90, high = perf_result.get_percentile_ci(0.9)
+        self.assertLessEqual(high - low, 0.05 * p90)
+        self.assertGreater(high - low, 0.045 * p90)
+        self.assertAlmostEqual(p90, 1.9, delta=0.01)
+        
+        # the interval can't be that narrow, the run stops at max_duration_ms instead.
+        perf_result = PerfResult(histogram=True)
+        load_gen = SingleStreamLoadGen(perf_result, min_query_count=10, min_duration_ms=0)
+        load_gen.set_early_stopping(EarlyStopping(percentile=0.9, relative_width=0, max_duration_ms=200))
+        start = time.time()
+        for i, q in enumerate(load_gen.queries()):
+            perf_result.complete_query(q.id, latency_ms=latency_ms(i))
+        self.assertFalse(load_gen.is_converged())
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        with self.assertRaises(ValueError):
+            EarlyStopping(percentile=99)
+
+    def test_records(self):
+        perf_result = PerfResult()
+        load_gen = OfflineLoadGen(perf_result, query_count=20)
+        queries = list(load_gen.queries())
+        perf_result.complete_query(queries[0].id)
+        perf_result.set_recording(True)
+        for q in queries[1:]:
+            perf_result.complete_query(q.id, error=(q.id % 2 == 0), started_at_ns=q.id)
+        records = perf_result.take_records()
+        # only queries completed while recording are kept, and taking them clears them.
+        self.assertEqual(records['id'].tolist(), [q.id for q in queries[1:]])
+        self.assertEqual(records['started_at_ns'].tolist(), records['id'].tolist())
+        self.assertEqual(records['error'].tolist(), [q.id % 2 == 0 for q in queries[1:]])
+        self.assertTrue(np.all(records['completed_at_ns'] >= records['issued_at_ns']))
+        self.assertEqual(len(perf_result.take_records()['id']), 0)
+
+    def test_latency_breakdown(self):
+        perf_result = PerfResult()
+        load_gen = OfflineLoadGen(perf_result, query_count=10)
+        for q in load_gen.queries():
+            issued_at_ns = clock_ns()
+            perf_result.complete_query(q.id, dequeued_at_ns=issued_at_ns + 1000000,
+                                       started_at_ns=issued_at_ns + 2000000, finished_at_ns=issued_at_ns + 5000000)
+        self.assertAlmostEqual(perf_result.get_service_times([0.5])[0], 3.0, delta=0.01)
+        self.assertAlmostEqual(perf_result.get_worker_queue_delays([0.5])[0], 1.0, delta=0.01)
+        self.assertEqual(len(perf_result.get_return_delays([0.5])), 4)
+        # queries completed without worker timestamps are not part of the breakdown.
+        perf_result = PerfResult()
+        for q in OfflineLoadGen(perf_result, query_count=10).queries():
+            perf_result.complete_query(q.id)
+        self.assertEqual(perf_result.get_service_times([0.5]), [])
+
+    def test_windows(self):
+        perf_result = PerfResult()
+        perf_result.set_window(window_ms=100, percentiles=[0.5, 0.99])
+        load_gen = ServerLoadGen(perf_result, target_qps=1000, min_query_count=0, min_duration_ms=500)
+        for q in load_gen.queries():
+            perf_result.complete_query(q.id, error=(q.id % 10 == 0))
+        time.sleep(0.2)
+        windows = perf_result.get_windows()
+        self.assertGreaterEqual(len(windows), 4)
+        self.assertEqual([w.index for w in windows], list(range(len(windows))))
+        self.assertEqual(len(windows[0].latencies), 5)
+        self.assertEqual(sum(w.num_issued for w in windows), load_gen.count_issued())
+        self.assertEqual(sum(w.num_failed for w in windows), perf_result.count_failed())
+        self.assertAlmostEqual(windows[1].qps, windows[1].num_succeeded / windows[1].duration_ms * 1e3)
+        self.assertEqual(len(perf_result.get_windows(since=3)), len(windows) - 3)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        latencies = [random.uniform(0.1, 500.0) for _ in range(10000)]
+        percentiles = [0.5, 0.9, 0.99, 0.999]
+        exact, hist = PerfResult(), PerfResult(histogram=True, significant_digits=3)
+        for i, lat in enumerate(latencies):
+            for r in [exact, hist]:
+                r.add_query(self.make_query(i))
+                r.complete_query(i, latency_ms=lat)
+        expected = exact.get_latencies(percentiles)
+        actual = hist.get_latencies(percentiles)
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, delta=e * 1e-3 + 1e-6)
+        self.assertEqual(hist.count_succeeded(), len(latencies))
+    
+    def test_merge(self):
+        h1, h2 = LatencyHistogram(), LatencyHistogram(significant_digits=2)
+        for v in range(1, 1001):
+            h1.record(v * 1000000)
+            h2.record((v + 1000) * 1000000)
+        h1.merge(h2)
+        self.assertEqual(h1.count(), 2000)
+        self.assertAlmostEqual(h1.get_percentile(0.5), 1000.0, delta=1.0)
+        self.assertAlmostEqual(h1.get_latencies([], min=True, avg=False, max=True)[1], 2000.0, delta=20.0)
+    
+    @staticmethod
+    def make_query(id):
+        q = Query()
+        q.id = id
+        return q
+
 
 if __name__ == '__main__':
     unittest.main()
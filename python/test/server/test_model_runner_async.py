@@ -1,7 +1,9 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import time
 import unittest
+import asyncio
 import aiohttp
 from model_perf.server import ServerModelRunner
 
@@ -39,5 +41,64 @@ class TestModelRunner(unittest.TestCase):
         print(report)
 
 
+class SystemUnderTestWithSleep:
+    async def run(self, fail):
+        await asyncio.sleep(0.001)
+        if fail:
+            raise ValueError('failed query')
+
+
+class TestModelRunnerLightLoad(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithSleep,
+                                        async_worker=True,
+                                        num_workers=2,
+                                        num_tasks=4)
+        self.runner.start()
+
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        # queries are started as soon as they arrive instead of at the next polling interval.
+        report = self.runner.benchmark(queries=[(False,), (False,), (True,)], target_qps=20, 
+                                       min_query_count=60, min_duration_ms=0)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        report = self.runner.get_report()
+        print(report)
+        self.assertGreater(report['#queries/failed'], 0)
+        self.assertEqual(report['#queries/succeeded'] + report['#queries/failed'], report['#queries/issued'])
+        self.assertLess(report['latency/p90'], 20)
+
+
+class SystemUnderTestWithBlockingCall:
+    def run(self):
+        # a blocking call that releases the GIL, like an onnxruntime session.
+        time.sleep(0.01)
+
+
+class TestModelRunnerExecutor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithBlockingCall,
+                                        async_worker=True,
+                                        num_workers=1,
+                                        num_tasks=8,
+                                        executor_threads=4)
+        self.runner.start()
+
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        # one thread serves 100 qps, the pool of 4 keeps up with 250.
+        report = self.runner.benchmark(queries=[()], target_qps=250, min_query_count=0, min_duration_ms=1000)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        report = self.runner.get_report()
+        print(report)
+        self.assertEqual(report['#queries/succeeded'], report['#queries/issued'])
+        self.assertAlmostEqual(report['service_time/p50'], 10, delta=5)
+        self.assertLess(report['latency/p50'], 50)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,18 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import os
+import tempfile
+import multiprocessing
+from unittest import mock
+import threading
 import unittest
 import time
-from model_perf.server import ServerModelRunner
+import numpy as np
+from model_perf.server import ServerModelRunner, load_records
+from model_perf.server.load_gen import EarlyStopping
+from model_perf.server import query_store
+from model_perf.server.query_store import SharedQueryStore, SharedQueryResolver
 
 
 class SystemUnderTest:
@@ -74,6 +83,29 @@ class TestModelRunner(unittest.TestCase):
     def test_server_mode(self): 
         report = self.runner.benchmark(target_qps=10000, min_duration_ms=10000)
         print(report)
+        self.assertIn('dispatch_delay/p99', report)
+        self.assertIn('service_time/p99', report)
+    
+    def test_offline_mode(self): 
+        report = self.runner.benchmark_offline(query_count=1000)
+        print(report)
+        self.assertEqual(report['#queries/succeeded'], 1000)
+        self.assertGreater(report['throughput/samples_per_sec'], 0)
+    
+    def test_multi_stream_mode(self): 
+        report = self.runner.benchmark_multi_stream(samples_per_frame=4, frame_interval_ms=10,
+                                                    min_query_count=100, min_duration_ms=1000)
+        print(report)
+        self.assertEqual(report['#frames/completed'], report['#frames/issued'])
+        self.assertEqual(report['#queries/issued'], 4 * report['#frames/issued'])
+        self.assertIn('frame_latency/p99', report)
+    
+    def test_closed_loop_mode(self): 
+        reports = self.runner.benchmark_concurrency(concurrencies=[1, 4], min_query_count=100, min_duration_ms=500)
+        print(reports)
+        self.assertEqual([r['concurrency'] for r in reports], [1, 4][:len(reports)])
+        for r in reports:
+            self.assertEqual(r['#queries/succeeded'], r['#queries/issued'])
     
     @unittest.skip("skip")  
     def test_single_stream_mode(self): 
@@ -81,6 +113,481 @@ class TestModelRunner(unittest.TestCase):
         print(report)
 
 
+class TestModelRunnerBulkDispatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithQueries,
+                                        num_workers=2,
+                                        num_threads=2,
+                                        bulk_dispatch=True)(['a', 'b', 'c'])
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        report = self.runner.benchmark(target_qps=20000, min_duration_ms=2000)
+        print(report)
+        self.runner.perf_result.wait_all_completed(timeout_ms=10000)
+        self.assertEqual(self.runner.perf_result.count_succeeded(), report['#queries/issued'])
+    
+    # every scenario issues its queries in bulk, with and without payloads.
+    def test_offline_mode(self): 
+        report = self.runner.benchmark_offline(queries=[(0,), (1,), (2,)], query_count=1000)
+        self.assertEqual(report['#queries/succeeded'], 1000)
+    
+    def test_multi_stream_mode(self): 
+        report = self.runner.benchmark_multi_stream(samples_per_frame=4, frame_interval_ms=10,
+                                                    min_query_count=100, min_duration_ms=500)
+        self.assertEqual(report['#frames/completed'], report['#frames/issued'])
+        self.assertEqual(report['#queries/issued'], 4 * report['#frames/issued'])
+    
+    def test_closed_loop_mode(self): 
+        report = self.runner.benchmark_closed_loop(queries=[(0,), (1,), (2,)], concurrency=4, 
+                                                   min_query_count=100, min_duration_ms=500)
+        self.assertEqual(report['#queries/succeeded'], report['#queries/issued'])
+        self.assertGreaterEqual(report['#queries/issued'], 100)
+    
+    def test_single_stream_mode(self): 
+        report = self.runner.benchmark_single_stream(min_query_count=100, min_duration_ms=500)
+        self.assertEqual(report['#queries/succeeded'], report['#queries/issued'])
+        self.assertGreaterEqual(report['#queries/issued'], 100)
+    
+    def test_trace_mode(self): 
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trace_file = os.path.join(tmp_dir, 'trace.csv')
+            with open(trace_file, 'w') as f:
+                f.write('offset_us,index\n' + ''.join(f'{i * 1000},{i % 3}\n' for i in range(200)))
+            self.runner.benchmark_trace(trace_file, queries=[(0,), (1,), (2,)], with_index=True)
+        self.runner.perf_result.wait_all_completed(timeout_ms=10000)
+        self.assertEqual(self.runner.perf_result.count_succeeded(), 200)
+
+
+class TestModelRunnerBatchedCompletions(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithQueries,
+                                        num_workers=2,
+                                        num_threads=2,
+                                        completion_batch_size=16,
+                                        completion_batch_ms=2.0)(['a', 'b', 'c'])
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        # at a low qps, batches are flushed by time instead of by size.
+        for target_qps in [20000, 50]:
+            report = self.runner.benchmark(target_qps=target_qps, min_query_count=100, min_duration_ms=1000)
+            print(report)
+            self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+            self.assertEqual(self.runner.perf_result.count_succeeded(), report['#queries/issued'])
+        self.assertLess(self.runner.perf_result.get_latencies([0.5])[0], 50)
+        self.assertIn('service_time/p50', self.runner.get_report())
+
+
+class SystemUnderTestWithBatches:
+    def predict(self, x):
+        return x
+    
+    def predict_batch(self, queries):
+        # a batch costs about as much as a single query.
+        time.sleep(0.005)
+        if any(q[0] < 0 for q in queries):
+            raise ValueError('negative query')
+        return [None] * len(queries)
+
+
+class TestModelRunnerDynamicBatching(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithBatches,
+                                        num_workers=1,
+                                        num_threads=1,
+                                        max_batch_size=16,
+                                        max_wait_ms=2.0)
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        # a single thread serves 200 qps one query at a time, batching lets it keep up with 1000.
+        report = self.runner.benchmark(queries=[(1,), (2,)], target_qps=1000, min_duration_ms=1000)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        report = self.runner.get_report()
+        print(report)
+        self.assertEqual(report['batch/max_size'], 16)
+        self.assertEqual(report['#queries/succeeded'], report['#queries/issued'])
+        self.assertLess(report['latency/p50'], 100)
+    
+    def test_failed_batch(self): 
+        self.runner.benchmark(queries=[(-1,)], target_qps=100, min_query_count=20, min_duration_ms=0)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        self.assertEqual(self.runner.perf_result.count_failed(), 20)
+
+
+class SystemUnderTestWithThreadBudget:
+    def __init__(self, intra_op_num_threads=None) -> None:
+        self.intra_op_num_threads = intra_op_num_threads
+        self.cpus = sorted(os.sched_getaffinity(0))
+    
+    def run(self, expected_cpus):
+        if self.cpus != expected_cpus or self.intra_op_num_threads != len(expected_cpus):
+            raise ValueError(f'unexpected placement {self.cpus} {self.intra_op_num_threads}')
+
+
+@unittest.skipUnless(hasattr(os, 'sched_getaffinity'), 'cpu affinity is not supported')
+class TestModelRunnerAffinity(unittest.TestCase):
+    def test_pinned_worker(self):
+        cpus = sorted(os.sched_getaffinity(0))[:1]
+        runner = ServerModelRunner(SystemUnderTestWithThreadBudget, num_workers=1, num_threads=1, 
+                                   cpu_affinity=[cpus])
+        runner.start()
+        try:
+            report = runner.benchmark(queries=[(cpus,)], target_qps=100, min_query_count=20, min_duration_ms=0)
+            self.assertTrue(runner.perf_result.wait_all_completed(timeout_ms=10000))
+            self.assertEqual(report['affinity/cpus'], [cpus])
+            self.assertEqual(runner.perf_result.count_failed(), 0)
+        finally:
+            runner.stop()
+    
+    def test_async_thread_budget(self):
+        class AsyncSystemUnderTest:
+            async def predict(self):
+                pass
+        
+        # a sync predict runs on `num_tasks` executor threads unless `executor_threads` is set.
+        for sut_cls, executor_threads, expected in [(SystemUnderTest, None, 2), (SystemUnderTest, 2, 4),
+                                                    (AsyncSystemUnderTest, None, 8)]:
+            runner = ServerModelRunner(sut_cls, async_worker=True, num_tasks=4, 
+                                       executor_threads=executor_threads, cpu_affinity=[list(range(8))])
+            runner.plan_affinity()
+            self.assertEqual(runner.get_intra_op_num_threads(0), expected)
+
+
+class SystemUnderTestWithColdStart:
+    def __init__(self) -> None:
+        self.warm = False
+    
+    def run(self):
+        if not self.warm:
+            time.sleep(0.1)
+            self.warm = True
+
+
+class TestModelRunnerWarmup(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithColdStart, num_workers=1, num_threads=1)
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        report = self.runner.benchmark(queries=[()], target_qps=100, min_query_count=50, min_duration_ms=0, 
+                                       warmup_queries=20)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        report = self.runner.get_report()
+        print(report)
+        self.assertEqual(report['warmup/#queries'], 20)
+        self.assertGreaterEqual(report['warmup_latency/max'], 100)
+        self.assertEqual(report['#queries/succeeded'], 50)
+        self.assertLess(report['latency/max'], 100)
+
+
+class TestModelRunnerDispatchPolicy(unittest.TestCase):
+    def test_policies(self): 
+        for policy in ['round_robin', 'least_outstanding', 'power_of_two']:
+            runner = ServerModelRunner(SystemUnderTestWithQueries,
+                                       num_workers=4,
+                                       num_threads=1,
+                                       dispatch_policy=policy)(['a', 'b', 'c'])
+            runner.start()
+            try:
+                report = runner.benchmark(target_qps=2000, min_duration_ms=1000)
+                runner.perf_result.wait_all_completed(timeout_ms=10000)
+                print(report)
+                self.assertEqual(runner.perf_result.count_succeeded(), report['#queries/issued'])
+                self.assertEqual(report['dispatch/policy'], policy)
+                self.assertEqual(sum(report['dispatch/queries']), report['#queries/issued'])
+                self.assertTrue(all(n > 0 for n in report['dispatch/queries']))
+            finally:
+                runner.stop()
+
+
+class TestModelRunnerEarlyStopping(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithQueries, num_workers=1, num_threads=2)(['a', 'b', 'c'])
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        early_stopping = EarlyStopping(percentile=0.5, relative_width=0.2, max_duration_ms=20000)
+        start = time.time()
+        report = self.runner.benchmark(target_qps=2000, min_query_count=100, min_duration_ms=0,
+                                       early_stopping=early_stopping)
+        print(report)
+        self.assertLess(time.time() - start, 20)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        report = self.runner.get_report()
+        self.assertTrue(report['ci/converged'])
+        self.assertEqual(report['ci/percentile'], 'p50')
+        self.assertLessEqual(report['ci/low'], report['latency/p50'])
+        self.assertGreaterEqual(report['ci/high'], report['latency/p50'])
+        # without a rule the report has no interval.
+        report = self.runner.benchmark(target_qps=2000, min_query_count=100, min_duration_ms=0)
+        self.assertNotIn('ci/converged', report)
+
+
+class SystemUnderTestWithServiceTime:
+    def run(self, query_id):
+        time.sleep(0.002)
+
+
+class TestModelRunnerSearchQps(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithServiceTime, num_workers=1, num_threads=1)
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_search_qps(self): 
+        # a single thread serves at most 500 qps.
+        result = self.runner.search_qps(latency_bound_ms=20, percentile=0.9, init_qps=50, 
+                                        probe_ms=500, tolerance=0.2, warmup_queries=10)
+        print({k: v for k, v in result.items() if k != 'probes'})
+        for probe in result['probes']:
+            print(probe['qps/target'], probe['search/latency'], probe['search/passed'], probe['search/aborted'])
+        self.assertGreaterEqual(result['qps/max'], 50)
+        self.assertLessEqual(result['qps/max'], 500)
+        self.assertEqual(result['warmup/#queries'], 10)
+        passed = [p['qps/target'] for p in result['probes'] if p['search/passed']]
+        self.assertEqual(max(passed), result['qps/max'])
+        failed = [p['qps/target'] for p in result['probes'] if not p['search/passed']]
+        self.assertGreater(min(failed), result['qps/max'])
+    
+    def test_percentile_is_a_fraction(self):
+        with self.assertRaises(ValueError):
+            self.runner.search_qps(latency_bound_ms=20, percentile=90)
+
+    def test_legacy_arguments(self):
+        # `min_duration_ms` is the duration of each probe, `log_dir` is ignored.
+        start = time.time()
+        result = self.runner.search_qps(latency_bound_ms=20, percentile=0.9, init_qps=50,
+                                        max_probes=1, min_duration_ms=300, log_dir='.')
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual(len(result['probes']), 1)
+        self.assertTrue(result['probes'][0]['search/passed'])
+
+    def test_abort_probe(self):
+        # reports are polled during the probes like the tensorboard thread does.
+        errors, done = [], threading.Event()
+        def poll_reports():
+            started = False
+            while not done.wait(0.001):
+                try:
+                    if self.runner.perf_result is not None and self.runner.load_gen is not None:
+                        started = True
+                        self.runner.get_report()
+                    elif started:
+                        errors.append('the load gen is reset between probes')
+                except Exception as e:
+                    errors.append(e)
+        poller = threading.Thread(target=poll_reports)
+        poller.start()
+        try:
+            # an overloaded probe is aborted long before its end.
+            start = time.time()
+            report = self.runner.probe_qps(None, 2000, latency_bound_ms=20, percentile=0.9, probe_ms=10000,
+                                           arrival=None, drain_timeout_ms=1000)
+            self.assertLess(time.time() - start, 5)
+            self.assertTrue(report['search/aborted'])
+            self.assertFalse(report['search/passed'])
+            report = self.runner.probe_qps(None, 50, latency_bound_ms=20, percentile=0.9, probe_ms=500,
+                                           arrival=None, drain_timeout_ms=1000)
+            self.assertTrue(report['search/passed'])
+        finally:
+            done.set()
+            poller.join()
+        self.assertEqual(errors, [])
+
+
+class TestModelRunnerSaturation(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithServiceTime, num_workers=1, num_threads=1,
+                                        abort_on_saturation=True)
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        # a single thread serves at most 500 qps, the run is aborted long before its 30 seconds.
+        start = time.time()
+        report = self.runner.benchmark(target_qps=2000, min_query_count=0, min_duration_ms=30000)
+        print({k: v for k, v in report.items() if k.startswith('saturat')})
+        self.assertLess(time.time() - start, 10)
+        self.assertTrue(report['saturated'])
+        self.assertTrue(report['saturation/aborted'])
+        self.assertGreater(report['saturation/dropped'], 0)
+        self.assertLess(report['saturation/completed_qps'], report['saturation/issued_qps'])
+        
+        report = self.runner.benchmark(target_qps=50, min_query_count=0, min_duration_ms=3000)
+        self.assertFalse(report['saturated'])
+        self.assertNotIn('saturation/dropped', report)
+
+
+class SystemUnderTestWithFields:
+    def run(self, query):
+        return {'length': len(query)}
+
+
+class TestModelRunnerRecords(unittest.TestCase):
+    def test_server_mode(self): 
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'records')
+            with ServerModelRunner(SystemUnderTestWithFields, num_workers=2, num_threads=2, bulk_dispatch=True,
+                                   record_path=path, record_flush_ms=100)() as runner:
+                queries = [('a',), ('bb',), ('ccc',)]
+                report = runner.benchmark(queries=queries, target_qps=500, min_query_count=0, min_duration_ms=1000,
+                                          warmup_queries=50)
+                runner.perf_result.wait_all_completed(timeout_ms=10000)
+                runner.benchmark_offline(queries=queries, query_count=100)
+                runner.perf_result.wait_all_completed(timeout_ms=10000)
+            self.assertEqual(report['records/run'], 0)
+            records = load_records(path)
+            self.assertGreater(len(os.listdir(path)), 1)
+        
+        runs = records['run']
+        # the warm-up is not a run of its own, and its queries are not recorded.
+        self.assertEqual(report['warmup/#queries'], 50)
+        self.assertEqual(set(runs.tolist()), {0, 1})
+        self.assertEqual(np.sum(runs == 0), report['#queries/issued'])
+        self.assertEqual(np.sum(runs == 1), 100)
+        self.assertEqual(len(np.unique(records['id'][runs == 0])), report['#queries/issued'])
+        self.assertEqual(set(records['worker'].tolist()), {0, 1})
+        # the random payload picked for each query, and the field the sut returned for it.
+        self.assertTrue(np.all(records['index'] >= 0))
+        self.assertEqual(records['length'].tolist(), (records['index'] + 1).tolist())
+        self.assertFalse(np.any(records['error']))
+        self.assertTrue(np.all(records['finished_at_ns'] >= records['started_at_ns']))
+
+
+class SystemUnderTestWithArrays:
+    def run(self, tokens, mask):
+        # queries staged in shared memory arrive as read-only views.
+        if tokens.flags.writeable or tokens.shape != (8, 128) or tokens[0, 0] != mask.sum():
+            raise ValueError('unexpected query')
+
+
+class TestModelRunnerSharedQueries(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ServerModelRunner(SystemUnderTestWithArrays,
+                                        num_workers=2,
+                                        num_threads=2,
+                                        shared_queries=True)
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        queries = []
+        for i in range(4):
+            mask = np.ones(i + 1, dtype=np.int8)
+            queries.append((np.full((8, 128), i + 1, dtype=np.int64), mask))
+        report = self.runner.benchmark(queries=queries, target_qps=2000, min_duration_ms=1000)
+        print(report)
+        self.runner.perf_result.wait_all_completed(timeout_ms=10000)
+        self.assertEqual(self.runner.perf_result.count_failed(), 0)
+        self.assertEqual(self.runner.perf_result.count_succeeded(), report['#queries/issued'])
+
+
+def resolve_in_worker(requests, results):
+    resolver = SharedQueryResolver()
+    refs = requests.get()
+    values = [int(resolver.resolve(refs[0])[0][0])]
+    previous = resolver.store
+    values.append(int(resolver.resolve(refs[1])[0][0]))
+    results.put((values, len(previous), previous.shm.buf is None))
+
+
+class TestSharedQueryStore(unittest.TestCase):
+    def test_attach_untracked(self):
+        # as on Windows, where there is no resource tracker to unregister the block from.
+        store = SharedQueryStore.create([(np.arange(4),)])
+        try:
+            with mock.patch.object(query_store, 'tracks_shared_memory', False), \
+                 mock.patch.object(query_store.resource_tracker, 'unregister') as unregister:
+                attached = SharedQueryStore.attach(store.name)
+            self.assertEqual(attached[0][0].tolist(), [0, 1, 2, 3])
+            unregister.assert_not_called()
+            attached.release()
+        finally:
+            store.release()
+
+
+class TestSharedQueryResolver(unittest.TestCase):
+    def test_switch_stores(self):
+        # like runner workers, the worker is started before the stores are created.
+        requests, results = multiprocessing.Queue(), multiprocessing.Queue()
+        worker = multiprocessing.Process(target=resolve_in_worker, args=(requests, results))
+        worker.start()
+        stores = [SharedQueryStore.create([(np.full(4, i),)]) for i in range(2)]
+        try:
+            requests.put([store.ref(0) for store in stores])
+            values, previous_size, previous_closed = results.get(timeout=10)
+            worker.join()
+        finally:
+            for store in stores:
+                store.release()
+        self.assertEqual(values, [0, 1])
+        # the store of the previous queries is released once the next queries arrive.
+        self.assertEqual(previous_size, 0)
+        self.assertTrue(previous_closed)
+
+
+class SystemUnderTestReleasingGIL:
+    instances = 0
+    
+    def __init__(self) -> None:
+        SystemUnderTestReleasingGIL.instances += 1
+    
+    def run(self, query_id):
+        time.sleep(0.005)
+
+
+class TestModelRunnerInProcess(unittest.TestCase):
+    def setUp(self) -> None:
+        SystemUnderTestReleasingGIL.instances = 0
+        self.runner = ServerModelRunner(SystemUnderTestReleasingGIL,
+                                        num_workers=1,
+                                        num_threads=4,
+                                        in_process=True)
+        self.runner.start()
+    
+    def tearDown(self) -> None:
+        self.runner.stop()
+    
+    def test_server_mode(self): 
+        # a single sut in this process, served by 4 threads that complete queries themselves.
+        self.assertTrue(all(isinstance(w, threading.Thread) for w in self.runner.workers))
+        self.assertEqual(SystemUnderTestReleasingGIL.instances, 1)
+        self.assertIsNone(self.runner.response_thread)
+        report = self.runner.benchmark(target_qps=400, min_query_count=0, min_duration_ms=1000)
+        print(report)
+        self.assertTrue(self.runner.perf_result.wait_all_completed(timeout_ms=10000))
+        self.assertEqual(self.runner.perf_result.count_succeeded(), report['#queries/issued'])
+        self.assertTrue(report['in_process'])
+        self.assertAlmostEqual(self.runner.get_report()['service_time/p50'], 5, delta=4)
+    
+    def test_unsupported_options(self):
+        with self.assertRaises(ValueError):
+            ServerModelRunner(SystemUnderTestReleasingGIL, in_process=True, cpu_affinity=True)
+
+
 if __name__ == '__main__':
     unittest.main()
     
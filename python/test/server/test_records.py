@@ -0,0 +1,48 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import tempfile
+import unittest
+import numpy as np
+from model_perf.server.records import QueryRecorder, load_records
+from model_perf.server.load_gen import OfflineLoadGen, PerfResult
+
+
+class TestQueryRecorder(unittest.TestCase):
+    def test_build_columns(self):
+        records = {'id': np.arange(3, dtype=np.int64), 'index': np.full(3, -1, dtype=np.int64)}
+        fields = [{'index': 2, 'label': 'x', 'score': 1}, None, {'index': 0, 'score': 0.5}]
+        columns = QueryRecorder.build_columns(records, fields, run=1)
+        self.assertEqual(columns['run'].tolist(), [1, 1, 1])
+        self.assertEqual(columns['index'].tolist(), [2, -1, 0])
+        self.assertEqual(columns['label'].tolist(), ['x', '', ''])
+        np.testing.assert_equal(columns['score'], [1.0, np.nan, 0.5])
+
+    def test_npz_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            recorder = QueryRecorder(tmp_dir, flush_interval_ms=60000)
+            recorder.start()
+            for run in range(2):
+                perf_result = PerfResult()
+                recorder.attach(perf_result)
+                for q in OfflineLoadGen(perf_result, query_count=10).queries():
+                    if run == 1:
+                        recorder.add_response(q.id, {'error': False, 'worker': 3})
+                    perf_result.complete_query(q.id)
+                recorder.flush()
+            recorder.stop()
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+            records = load_records(tmp_dir)
+        self.assertEqual(records['run'].tolist(), [0] * 10 + [1] * 10)
+        # the column only in the second chunk is filled for the first one.
+        self.assertEqual(records['worker'].tolist(), [-1] * 10 + [3] * 10)
+        self.assertEqual(records['error'].dtype, bool)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            QueryRecorder('records', format='csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import unittest
+from model_perf.server.saturation import SaturationMonitor
+
+
+class TestSaturationMonitor(unittest.TestCase):
+    def test_steady(self):
+        monitor = SaturationMonitor(max_concurrency=4, window_ms=1000, saturation_ms=2000)
+        # 100 qps served at 100 qps with a constant backlog.
+        for i in range(100):
+            self.assertFalse(monitor.check(i * 0.1, i * 10, max(0, i * 10 - 8)))
+        self.assertFalse(monitor.get_report()['saturated'])
+        self.assertEqual(monitor.get_report()['saturation/max_outstanding'], 8)
+    
+    def test_diverging(self):
+        monitor = SaturationMonitor(max_concurrency=4, window_ms=1000, saturation_ms=2000)
+        # 100 qps issued but only 50 qps completed.
+        detected = [monitor.check(i * 0.1, i * 10, i * 5) for i in range(100)]
+        self.assertEqual(detected.count(True), 1)
+        report = monitor.get_report()
+        self.assertTrue(report['saturated'])
+        self.assertAlmostEqual(report['saturation/issued_qps'], 100, delta=1)
+        self.assertAlmostEqual(report['saturation/completed_qps'], 50, delta=1)
+        # detected after the first window and `saturation_ms` of divergence.
+        self.assertAlmostEqual(detected.index(True) * 0.1, 2.5, delta=0.2)
+        self.assertEqual(report['saturation/max_outstanding'], 99 * 5)
+    
+    def test_max_outstanding(self):
+        monitor = SaturationMonitor(max_concurrency=4, max_outstanding=100)
+        self.assertFalse(monitor.check(0, 100, 0))
+        self.assertTrue(monitor.check(0.01, 101, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import tempfile
+import time
+import unittest
+from model_perf.server import Sweep
+from model_perf.server.load_gen import EarlyStopping, QpsSchedule, ArrivalProcess
+
+
+class SystemUnderTestWithDelay:
+    def __init__(self, delay_ms=0) -> None:
+        self.delay_ms = delay_ms
+    
+    def run(self, query_id):
+        time.sleep(self.delay_ms / 1e3)
+
+
+class TestSweep(unittest.TestCase):
+    def test_grid(self):
+        points = Sweep.expand({'num_workers': [1, 2], 'num_threads': [1, 2, 4]})
+        self.assertEqual(len(points), 6)
+        self.assertIn({'num_workers': 2, 'num_threads': 4}, points)
+        self.assertEqual(Sweep.expand([{'num_workers': 1}]), [{'num_workers': 1}])
+        self.assertEqual(Sweep.expand(None), [{}])
+    
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            sweep = Sweep(SystemUnderTestWithDelay, 
+                          runner_space={'num_workers': [1], 'num_threads': [1, 4]},
+                          sut_space={'delay_ms': [2]},
+                          benchmark='benchmark_offline', benchmark_kwargs={'query_count': 200},
+                          cache_dir=cache_dir)
+            results = sweep.run()
+            self.assertEqual(len(results), 2)
+            self.assertFalse(any(r['cached'] for r in results))
+            rows = Sweep.rank(results)
+            print(Sweep.format_table(rows))
+            # 4 threads process the queries faster than 1.
+            self.assertEqual(rows[0]['num_threads'], 4)
+            self.assertGreater(rows[0]['throughput/samples_per_sec'], rows[1]['throughput/samples_per_sec'])
+            
+            # an interrupted sweep only runs the points that are not finished.
+            os.remove(sweep.get_cache_file(results[1]['config']))
+            results = sweep.run()
+            self.assertEqual([r['cached'] for r in results], [True, False])
+            self.assertEqual(results[0]['report']['#queries/succeeded'], 200)
+    
+    def test_cache_key(self):
+        def cache_file(sut_args=(), **benchmark_kwargs):
+            sweep = Sweep(SystemUnderTestWithDelay, runner_space={'num_workers': [1]}, sut_args=sut_args,
+                          benchmark='benchmark', benchmark_kwargs=benchmark_kwargs)
+            runner_params, sut_params = sweep.points()[0]
+            return sweep.get_cache_file(sweep.get_config(runner_params, sut_params))
+        
+        # load gen objects are keyed by their parameters, not by their address.
+        self.assertEqual(cache_file(early_stopping=EarlyStopping(percentile=0.9)),
+                         cache_file(early_stopping=EarlyStopping(percentile=0.9)))
+        self.assertNotEqual(cache_file(early_stopping=EarlyStopping(percentile=0.9)),
+                            cache_file(early_stopping=EarlyStopping(percentile=0.99)))
+        self.assertEqual(cache_file(qps_schedule=QpsSchedule.ramp(10, 100, 1000), arrival=ArrivalProcess.pareto(2)),
+                         cache_file(qps_schedule=QpsSchedule.ramp(10, 100, 1000), arrival=ArrivalProcess.pareto(2)))
+        self.assertNotEqual(cache_file(sut_args=(1,)), cache_file(sut_args=(2,)))
+        with self.assertRaises(ValueError):
+            cache_file(arrival=object())
+    
+    def test_failed_point(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            sweep = Sweep(SystemUnderTestWithDelay, runner_space=[{'num_workers': 1, 'unknown': 1}],
+                          cache_dir=cache_dir)
+            results = sweep.run()
+            self.assertIn('error', results[0])
+            self.assertEqual(os.listdir(cache_dir), [])
+            self.assertEqual(Sweep.rank(results), [])
+
+
+if __name__ == '__main__':
+    unittest.main()